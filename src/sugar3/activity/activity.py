@@ -164,6 +164,7 @@ import logging
 import os
 import signal
 import time
+import threading
 from hashlib import sha1
 from functools import partial
 import cairo
@@ -172,14 +173,13 @@ import json
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gdk', '3.0')
-gi.require_version('TelepathyGLib', '0.12')
 gi.require_version('SugarExt', '1.0')
 
 from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gdk
+from gi.repository import GdkPixbuf
 from gi.repository import Gtk
-from gi.repository import TelepathyGLib
 import dbus
 import dbus.service
 from dbus import PROPERTIES_IFACE
@@ -187,20 +187,24 @@ from dbus import PROPERTIES_IFACE
 from sugar3 import util
 from sugar3 import power
 from sugar3.profile import get_color, get_save_as
-from sugar3.presence import presenceservice
 from sugar3.activity.activityservice import ActivityService
 from sugar3.graphics import style
 from sugar3.graphics.window import Window
 from sugar3.graphics.alert import Alert
 from sugar3.graphics.icon import Icon
-from sugar3.datastore import datastore
 from sugar3.bundle.activitybundle import get_bundle_instance
 from sugar3.bundle.helpers import bundle_from_dir
+from sugar3.presence._telepathy import CHANNEL, CHANNEL_TYPE_TEXT, CLIENT, \
+    CLIENT_HANDLER, HANDLE_TYPE_CONTACT, HANDLE_TYPE_ROOM
 from sugar3 import env
 from errno import EEXIST
 
 from gi.repository import SugarExt
 
+# only loaded when first used, many activities never share
+presenceservice = util.LazyModule('sugar3.presence.presenceservice')
+datastore = util.LazyModule('sugar3.datastore.datastore')
+
 
 def _(msg):
     return gettext.dgettext('sugar-toolkit-gtk3', msg)
@@ -218,13 +222,8 @@ N_BUS_NAME = 'org.freedesktop.Notifications'
 N_OBJ_PATH = '/org/freedesktop/Notifications'
 N_IFACE_NAME = 'org.freedesktop.Notifications'
 
-CHANNEL = TelepathyGLib.IFACE_CHANNEL
-CHANNEL_TYPE_TEXT = TelepathyGLib.IFACE_CHANNEL_TYPE_TEXT
-CLIENT = TelepathyGLib.IFACE_CLIENT
-CLIENT_HANDLER = TelepathyGLib.IFACE_CLIENT_HANDLER
-
-CONNECTION_HANDLE_TYPE_CONTACT = TelepathyGLib.HandleType.CONTACT
-CONNECTION_HANDLE_TYPE_ROOM = TelepathyGLib.HandleType.ROOM
+CONNECTION_HANDLE_TYPE_CONTACT = HANDLE_TYPE_CONTACT
+CONNECTION_HANDLE_TYPE_ROOM = HANDLE_TYPE_ROOM
 
 CONN_INTERFACE_ACTIVITY_PROPERTIES = 'org.laptop.Telepathy.ActivityProperties'
 
@@ -234,6 +233,63 @@ Size of a preview image for journal object metadata.
 """
 
 
+# Seconds without changes after which a dirty activity is saved
+_AUTOSAVE_DELAY = 5
+
+# Longest delay in seconds between a change and its autosave
+_AUTOSAVE_MAX_DELAY = 60
+
+# Icon directories of the bundles added to the icon theme search path
+_icon_search_paths = set()
+
+# Whether the Gtk settings were set for the activities of this process
+_settings_initialized = False
+
+# Window icons by file name, shared by the instances of a process
+_window_icons = {}
+
+
+def _initialize_process():
+    # Done once for all the instances hosted by a process, so that the icon
+    # theme is not rescanned and the styles not recomputed for each
+    global _settings_initialized
+
+    icons_path = os.path.join(get_bundle_path(), 'icons')
+    if icons_path not in _icon_search_paths:
+        Gtk.IconTheme.get_default().append_search_path(icons_path)
+        _icon_search_paths.add(icons_path)
+
+    if _settings_initialized:
+        return
+    _settings_initialized = True
+
+    sugar_theme = 'sugar-72'
+    if 'SUGAR_SCALING' in os.environ:
+        if os.environ['SUGAR_SCALING'] == '100':
+            sugar_theme = 'sugar-100'
+
+    # This code can be removed when we grow an xsettings daemon (the GTK+
+    # init routines will then automatically figure out the font settings)
+    settings = Gtk.Settings.get_default()
+    settings.set_property('gtk-theme-name', sugar_theme)
+    settings.set_property('gtk-icon-theme-name', 'sugar')
+    settings.set_property('gtk-button-images', True)
+    settings.set_property('gtk-font-name',
+                          '%s %f' % (style.FONT_FACE, style.FONT_SIZE))
+
+
+def _get_window_icon(file_name):
+    if file_name not in _window_icons:
+        _window_icons[file_name] = GdkPixbuf.Pixbuf.new_from_file(file_name)
+    return _window_icons[file_name]
+
+
+def _encode_preview(surface):
+    preview_str = six.BytesIO()
+    surface.write_to_png(preview_str)
+    return preview_str.getvalue()
+
+
 class _ActivitySession(GObject.GObject):
 
     __gsignals__ = {
@@ -261,6 +317,7 @@ class _ActivitySession(GObject.GObject):
 
         if len(self._activities) == 0:
             logging.debug('Quitting the activity process.')
+            power.get_power_manager().shutdown()
             Gtk.main_quit()
 
     def will_quit(self, activity, will_quit):
@@ -337,22 +394,7 @@ class Activity(Window, Gtk.Container):
                 GLib.PRIORITY_DEFAULT, signal.SIGINT, self.close)
 
         # Stuff that needs to be done early
-        icons_path = os.path.join(get_bundle_path(), 'icons')
-        Gtk.IconTheme.get_default().append_search_path(icons_path)
-
-        sugar_theme = 'sugar-72'
-        if 'SUGAR_SCALING' in os.environ:
-            if os.environ['SUGAR_SCALING'] == '100':
-                sugar_theme = 'sugar-100'
-
-        # This code can be removed when we grow an xsettings daemon (the GTK+
-        # init routines will then automatically figure out the font settings)
-        settings = Gtk.Settings.get_default()
-        settings.set_property('gtk-theme-name', sugar_theme)
-        settings.set_property('gtk-icon-theme-name', 'sugar')
-        settings.set_property('gtk-button-images', True)
-        settings.set_property('gtk-font-name',
-                              '%s %f' % (style.FONT_FACE, style.FONT_SIZE))
+        _initialize_process()
 
         Window.__init__(self)
 
@@ -393,6 +435,16 @@ class Activity(Window, Gtk.Container):
         self._jobject_old = None
         self._is_resumed = False
         self._read_file_called = False
+        self._canvas_damage = 0
+        self._preview_damage = None
+        self._preview = None
+        self._dirty = None
+        self._dirty_since = None
+        self._autosave_sid = None
+        self._save_queued = False
+        self._copy_queued = False
+        self._transfer_file = True
+        self._document_path = None
 
         self._session = _get_session()
         self._session.register(self)
@@ -462,7 +514,7 @@ class Activity(Window, Gtk.Container):
         self.set_title(self._jobject.metadata['title'])
 
         bundle = get_bundle_instance(get_bundle_path())
-        self.set_icon_from_file(bundle.get_icon())
+        self.set_icon(_get_window_icon(bundle.get_icon()))
 
         self._busy_count = 0
         self._stop_buttons = []
@@ -696,6 +748,9 @@ class Activity(Window, Gtk.Container):
         '''
 
         Window.set_canvas(self, canvas)
+        self._canvas_damage += 1
+        if canvas is not None:
+            canvas.connect_after('draw', self.__canvas_draw_cb)
         if not self._read_file_called:
             canvas.connect('map', self.__canvas_map_cb)
 
@@ -744,6 +799,9 @@ class Activity(Window, Gtk.Container):
             self._read_file_called = True
         canvas.disconnect_by_func(self.__canvas_map_cb)
 
+    def __canvas_draw_cb(self, canvas, cr):
+        self._canvas_damage += 1
+
     def __jobject_create_cb(self):
         pass
 
@@ -803,6 +861,77 @@ class Activity(Window, Gtk.Container):
         '''
         raise NotImplementedError
 
+    def update_file(self, file_path):
+        '''
+        Subclasses may implement this method to save their data
+        incrementally. 'file_path' is the file written by the previous
+        save, either by :meth:`write_file` or by this method.
+
+        You should only write the parts of the file that changed since the
+        previous save, for example by appending to it or by overwriting
+        changed chunks in place, so that long documents are not rewritten
+        every time.  The file is copied by the journal rather than handed
+        over to it.
+
+        Activities that implement this method still implement
+        :meth:`write_file`, which is used for the first save.
+
+        Args:
+            file_path (str): complete path of the file to update
+        '''
+        raise NotImplementedError
+
+    def get_dirty(self):
+        '''
+        Get whether the activity has unsaved changes.
+
+        Returns:
+            bool: the value given to :meth:`set_dirty` since the last save,
+            or None if the activity does not track its changes
+        '''
+        return self._dirty
+
+    def set_dirty(self, dirty=True):
+        '''
+        Set whether the activity has unsaved changes.
+
+        Marking the activity dirty schedules an autosave once no changes
+        have been made for a few seconds, and at most a minute after the
+        first unsaved change.  Activities calling this method also let
+        :meth:`save` skip :meth:`write_file` when there is nothing to
+        write, only updating the metadata of the journal object.
+
+        Args:
+            dirty (bool): whether there are unsaved changes
+        '''
+        self._dirty = dirty
+        if not dirty:
+            self._dirty_since = None
+            self._cancel_autosave()
+            return
+
+        now = time.time()
+        if self._dirty_since is None:
+            self._dirty_since = now
+        delay = min(_AUTOSAVE_DELAY,
+                    self._dirty_since + _AUTOSAVE_MAX_DELAY - now)
+
+        self._cancel_autosave()
+        self._autosave_sid = GLib.timeout_add(int(max(delay, 0) * 1000),
+                                              self.__autosave_cb)
+
+    def _cancel_autosave(self):
+        if self._autosave_sid is not None:
+            GLib.source_remove(self._autosave_sid)
+            self._autosave_sid = None
+
+    def __autosave_cb(self):
+        self._autosave_sid = None
+        if self._dirty and self._jobject:
+            logging.debug('Activity.__autosave_cb')
+            self.save()
+        return False
+
     def notify_user(self, summary, body):
         '''
         Display a notification with the given summary and body.
@@ -818,9 +947,22 @@ class Activity(Window, Gtk.Container):
         notifications.Notify(self.get_id(), 0, '', summary, body, [],
                              {'x-sugar-icon-file-name': icon}, -1)
 
+    def _run_queued_save(self):
+        if not self._save_queued:
+            return False
+        self._save_queued = False
+        if self._copy_queued:
+            self._copy_queued = False
+            self.copy()
+        else:
+            self.save()
+        return self._updating_jobject
+
     def __save_cb(self):
         logging.debug('Activity.__save_cb')
         self._updating_jobject = False
+        if self._run_queued_save():
+            return
         if self._quit_requested:
             self._session.will_quit(self, True)
         elif self._closing:
@@ -829,6 +971,11 @@ class Activity(Window, Gtk.Container):
     def __save_error_cb(self, err):
         logging.debug('Activity.__save_error_cb')
         self._updating_jobject = False
+        if self._dirty is not None:
+            self._dirty = True
+        if self._run_queued_save():
+            raise RuntimeError('Error saving activity object to datastore:'
+                               ' %s' % err)
         if self._quit_requested:
             self._session.will_quit(self, False)
         if self._closing:
@@ -838,6 +985,8 @@ class Activity(Window, Gtk.Container):
                            err)
 
     def _cleanup_jobject(self):
+        if self._document_path and os.path.isfile(self._document_path):
+            os.remove(self._document_path)
         if self._jobject:
             if self._owns_file and os.path.isfile(self._jobject.file_path):
                 logging.debug('_cleanup_jobject: removing %r' %
@@ -864,6 +1013,12 @@ class Activity(Window, Gtk.Container):
         :ref:`Gdk.Window` of the :meth:`canvas` widget, draws on it,
         then resizes to a surface with the preview size.
         '''
+        preview_surface = self._get_preview_surface()
+        if preview_surface is None:
+            return None
+        return _encode_preview(preview_surface)
+
+    def _get_preview_surface(self):
         if self.canvas is None or not hasattr(self.canvas, 'get_window'):
             return None
 
@@ -886,6 +1041,7 @@ class Activity(Window, Gtk.Container):
         cr.paint()
         self.canvas.draw(cr)
         del cr
+        self._preview_damage = self._canvas_damage
 
         preview_width, preview_height = PREVIEW_SIZE
         preview_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
@@ -908,9 +1064,34 @@ class Activity(Window, Gtk.Container):
         cr.set_source_surface(screenshot_surface)
         cr.paint()
 
-        preview_str = six.BytesIO()
-        preview_surface.write_to_png(preview_str)
-        return preview_str.getvalue()
+        return preview_surface
+
+    def _is_preview_current(self):
+        # The canvas only emits draw while it is visible, so the damage
+        # counter can't tell whether a hidden canvas has changed.
+        if self._preview is None or \
+                self._preview_damage != self._canvas_damage:
+            return False
+        window = self.canvas.get_window()
+        return window is not None and window.is_viewable()
+
+    def _set_preview(self, preview):
+        if preview is not None:
+            self.metadata['preview'] = dbus.ByteArray(preview)
+
+    def _encode_preview_thread(self, surface):
+        try:
+            preview = _encode_preview(surface)
+        except BaseException:
+            logging.exception('Error encoding the preview')
+            preview = None
+        GLib.idle_add(self.__preview_encoded_cb, preview)
+
+    def __preview_encoded_cb(self, preview):
+        self._preview = preview
+        self._set_preview(preview)
+        self._write_jobject()
+        return False
 
     def _get_buddies(self):
         if self.shared_activity is not None:
@@ -932,11 +1113,21 @@ class Activity(Window, Gtk.Container):
 
         This may be called by the :meth:`close` method.
 
+        The preview is encoded in a thread, and the journal object is
+        written once it is ready, so this returns before the save is
+        complete.  The preview is not captured again if the canvas has not
+        been drawn since the last save.
+
         Activities should not override this method. This method is part of the
         public API of an activity, and should behave in standard ways. Use your
         own implementation of write_file() to save your activity specific data.
+
+        A save requested while the previous one is still being written is
+        done once it completes.
         '''
+        self._save(wait=False)
 
+    def _save(self, wait):
         if self._jobject is None:
             logging.debug('Cannot save, no journal object.')
             return
@@ -944,9 +1135,17 @@ class Activity(Window, Gtk.Container):
         logging.debug('Activity.save: %r' % self._jobject.object_id)
 
         if self._updating_jobject:
-            logging.info('Activity.save: still processing a previous request.')
+            logging.info('Activity.save: still processing a previous request,'
+                         ' queued.')
+            self._save_queued = True
             return
 
+        self._cancel_autosave()
+        self._dirty_since = None
+        write_document = self._dirty is not False
+        if self._dirty is not None:
+            self._dirty = False
+
         buddies_dict = self._get_buddies()
         if buddies_dict:
             self.metadata['buddies_id'] = json.dumps(list(buddies_dict.keys()))
@@ -965,34 +1164,72 @@ class Activity(Window, Gtk.Container):
         self.metadata['spent-times'] = set_last_value(
             self.metadata['spent-times'], self._spent_time)
 
-        preview = self.get_preview()
-        if preview is not None:
-            self.metadata['preview'] = dbus.ByteArray(preview)
+        preview_surface = None
+        if type(self).get_preview is not Activity.get_preview:
+            # activities overriding get_preview() return the PNG data
+            self._set_preview(self.get_preview())
+        elif self.canvas is not None and self._is_preview_current():
+            self._set_preview(self._preview)
+        else:
+            preview_surface = self._get_preview_surface()
+            if wait and preview_surface is not None:
+                self._preview = _encode_preview(preview_surface)
+                self._set_preview(self._preview)
+                preview_surface = None
 
         if not self.metadata.get('activity_id', ''):
             self.metadata['activity_id'] = self.get_id()
 
-        file_path = os.path.join(get_activity_root(), 'instance',
-                                 '%i' % time.time())
-        try:
-            self.write_file(file_path)
-        except NotImplementedError:
-            logging.debug('Activity.write_file is not implemented.')
+        self._update_jobject_file(write_document)
+
+        self._updating_jobject = True
+        if preview_surface is None:
+            self._write_jobject()
         else:
-            if os.path.exists(file_path):
-                self._owns_file = True
-                self._jobject.file_path = file_path
+            thread = threading.Thread(target=self._encode_preview_thread,
+                                      args=(preview_surface,))
+            thread.daemon = True
+            thread.start()
+
+    def _update_jobject_file(self, write_document):
+        if write_document:
+            self._write_document()
+        else:
+            # only the metadata changed, a write without a file keeps the
+            # file of the entry, see datastore.write()
+            self._owns_file = False
+            self._jobject.file_path = None
 
-        # Cannot call datastore.write async for creates:
-        # https://dev.laptop.org/ticket/3071
-        if self._jobject.object_id is None:
-            datastore.write(self._jobject, transfer_ownership=True)
+    def _write_document(self):
+        instance_path = os.path.join(get_activity_root(), 'instance')
+        if type(self).update_file is not Activity.update_file:
+            file_path = os.path.join(instance_path,
+                                     'document-%s' % self.get_id())
+            if os.path.exists(file_path):
+                self.update_file(file_path)
+            else:
+                self.write_file(file_path)
+            self._document_path = file_path
+            transfer_ownership = False
         else:
-            self._updating_jobject = True
-            datastore.write(self._jobject,
-                            transfer_ownership=True,
-                            reply_handler=self.__save_cb,
-                            error_handler=self.__save_error_cb)
+            file_path = os.path.join(instance_path, '%i' % time.time())
+            try:
+                self.write_file(file_path)
+            except NotImplementedError:
+                logging.debug('Activity.write_file is not implemented.')
+                return
+            transfer_ownership = True
+
+        if os.path.exists(file_path):
+            self._owns_file = True
+            self._jobject.file_path = file_path
+            self._transfer_file = transfer_ownership
+
+    def _write_jobject(self):
+        datastore.write(self._jobject,
+                        transfer_ownership=self._transfer_file,
+                        reply_handler=self.__save_cb,
+                        error_handler=self.__save_error_cb)
 
     def copy(self):
         '''
@@ -1007,7 +1244,13 @@ class Activity(Window, Gtk.Container):
         :meth:`write_file`.
         '''
         logging.debug('Activity.copy: %r' % self._jobject.object_id)
-        self.save()
+        # write the current object before detaching from it
+        self._save(wait=True)
+        if self._save_queued:
+            # nothing has been sent yet, the object is written and detached
+            # once the previous save completes, see _run_queued_save()
+            self._copy_queued = True
+            return
         self._jobject.object_id = None
 
     def __privacy_changed_cb(self, shared_activity, param_spec):
@@ -1286,6 +1529,7 @@ class Activity(Window, Gtk.Container):
         return True
 
     def _complete_close(self):
+        self._cancel_autosave()
         self.destroy()
 
         if self.shared_activity:
@@ -1297,7 +1541,6 @@ class Activity(Window, Gtk.Container):
         dbus.service.Object.remove_from_connection(self._bus)
 
         self._session.unregister(self)
-        power.get_power_manager().shutdown()
 
     def _do_close(self, skip_save):
         self.busy()
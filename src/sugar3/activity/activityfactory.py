@@ -28,6 +28,7 @@ from gi.repository import GObject
 from gi.repository import GLib
 
 from sugar3.activity.activityhandle import ActivityHandle
+from sugar3.activity import zygote
 from sugar3 import util
 from sugar3 import env
 from sugar3.datastore import datastore
@@ -35,6 +36,8 @@ from sugar3.datastore import datastore
 from errno import EEXIST, ENOSPC
 
 import os
+import signal
+import socket
 import subprocess
 
 _SHELL_SERVICE = 'org.laptop.Shell'
@@ -224,18 +227,26 @@ class ActivityCreationHandler(GObject.GObject):
                               self._handle.object_id, self._handle.uri,
                               self._handle.invited)
 
+        command = [str(s) for s in command]
+        cwd = str(self._bundle.get_path())
+        user_data = (log_file, self._handle.activity_id)
+
         dev_null = open('/dev/null', 'r')
-        child = subprocess.Popen([str(s) for s in command],
-                                 env=environ,
-                                 cwd=str(self._bundle.get_path()),
-                                 close_fds=True,
-                                 stdin=dev_null.fileno(),
-                                 stdout=log_file.fileno(),
-                                 stderr=log_file.fileno())
-
-        GLib.child_watch_add(child.pid,
-                             _child_watch_cb,
-                             (log_file, self._handle.activity_id))
+        socket_path = zygote.get_socket_path()
+        if socket_path and zygote.can_launch(command):
+            try:
+                connection = zygote.send_launch_request(
+                    socket_path, command, environ, cwd, dev_null.fileno(),
+                    log_file.fileno(), log_file.fileno())
+            except (ValueError, socket.error) as e:
+                logging.warning('Cannot launch through the zygote, starting'
+                                ' a new process: %s', e)
+            else:
+                _ZygoteLaunch(connection, command, environ, cwd, dev_null,
+                              user_data)
+                return
+
+        _start_process(command, environ, cwd, dev_null, user_data)
 
     def _no_reply_handler(self, *args):
         pass
@@ -295,6 +306,75 @@ def create_with_object_id(bundle, object_id):
     return ActivityCreationHandler(bundle, activity_handle)
 
 
+def _start_process(command, environ, cwd, dev_null, user_data):
+    log_file = user_data[0]
+    child = subprocess.Popen(command,
+                             env=environ,
+                             cwd=cwd,
+                             close_fds=True,
+                             stdin=dev_null.fileno(),
+                             stdout=log_file.fileno(),
+                             stderr=log_file.fileno())
+
+    GLib.child_watch_add(child.pid, _child_watch_cb, user_data)
+
+
+class _ZygoteLaunch(object):
+    """Wait for the zygote to report the pid of a launched activity from
+    the main loop, and start the activity in a new process instead if it
+    does not within zygote.LAUNCH_TIMEOUT.
+    """
+
+    def __init__(self, connection, command, environ, cwd, dev_null,
+                 user_data):
+        self._connection = connection
+        self._process_args = (command, environ, cwd, dev_null, user_data)
+
+        self._watch_sid = GLib.io_add_watch(
+            connection.fileno(), GLib.IO_IN | GLib.IO_HUP, self.__reply_cb)
+        self._timeout_sid = GLib.timeout_add(
+            int(zygote.LAUNCH_TIMEOUT * 1000), self.__timeout_cb)
+
+    def __reply_cb(self, fd, condition):
+        GLib.source_remove(self._timeout_sid)
+        try:
+            pid = zygote.read_launch_reply(self._connection)
+        except (EOFError, KeyError, ValueError, socket.error) as e:
+            self._fall_back('%s' % e)
+            return False
+
+        dev_null = self._process_args[3]
+        dev_null.close()
+        user_data = self._process_args[4]
+        GLib.io_add_watch(self._connection.fileno(),
+                          GLib.IO_IN | GLib.IO_HUP, _zygote_child_cb,
+                          self._connection, pid, user_data)
+        return False
+
+    def __timeout_cb(self):
+        GLib.source_remove(self._watch_sid)
+        self._fall_back('no reply within %ss' % zygote.LAUNCH_TIMEOUT)
+        return False
+
+    def _fall_back(self, reason):
+        logging.warning('Cannot launch through the zygote, starting a new'
+                        ' process: %s', reason)
+        # the zygote does not start activities whose request was closed
+        self._connection.close()
+        _start_process(*self._process_args)
+
+
+def _zygote_child_cb(fd, condition, connection, pid, user_data):
+    try:
+        status = zygote.read_exit_status(connection)
+    except (EOFError, KeyError, ValueError, socket.error):
+        logging.error('Lost the connection to the zygote of %d', pid)
+        # reported as killed, the zygote is gone
+        status = signal.SIGKILL
+    _child_watch_cb(pid, status, user_data)
+    return False
+
+
 def _child_watch_cb(pid, condition, user_data):
     log_file, activity_id = user_data
 
@@ -69,20 +69,86 @@ def get_single_process_path(bundle_id):
     return '/' + bundle_id.replace('.', '/')
 
 
+def _get_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError):
+        return 0
+
+
+class _InstanceStats(object):
+    """Resources used by one of the instances hosted by a SingleProcess.
+
+    memory is the growth of the resident memory of the process while the
+    instance was created, or 0 if it shrank, and draw_time the time spent
+    drawing its window.
+    """
+
+    def __init__(self, activity, memory):
+        self.memory = max(memory, 0)
+        self.draw_time = 0.0
+        self._draw_start = None
+
+        activity.connect('draw', self.__draw_cb)
+        activity.connect_after('draw', self.__draw_after_cb)
+
+    def __draw_cb(self, widget, cr):
+        self._draw_start = time.time()
+        return False
+
+    def __draw_after_cb(self, widget, cr):
+        if self._draw_start is not None:
+            self.draw_time += time.time() - self._draw_start
+            self._draw_start = None
+        return False
+
+
 class SingleProcess(dbus.service.Object):
+    """Host of all the instances of an activity in one process.
+
+    The instances share the caches of the process, like the rendered
+    icons, the parsed bundle, and the connections to the presence service
+    and to the datastore, and the resources used by each of them are
+    accounted separately.
+    """
 
     def __init__(self, name_service, constructor):
         self.constructor = constructor
+        self._stats = {}
 
         bus = dbus.SessionBus()
         bus_name = dbus.service.BusName(name_service, bus=bus)
         object_path = get_single_process_path(name_service)
         dbus.service.Object.__init__(self, bus_name, object_path)
 
+    def create_instance(self, handle):
+        rss = _get_rss()
+        activity = create_activity_instance(self.constructor, handle)
+
+        activity_id = handle.activity_id
+        self._stats[activity_id] = _InstanceStats(activity, _get_rss() - rss)
+        activity.connect('destroy', self.__destroy_cb, activity_id)
+        return activity
+
+    def get_instance_stats(self):
+        """Return a dictionary with the memory growth in bytes and the
+        draw time in seconds of each instance, by activity id."""
+        return dict((activity_id, (stats.memory, stats.draw_time))
+                    for activity_id, stats in self._stats.items())
+
+    def __destroy_cb(self, activity, activity_id):
+        self._stats.pop(activity_id, None)
+
     @dbus.service.method('org.laptop.SingleProcess', in_signature='a{sv}')
     def create(self, handle_dict):
         handle = activityhandle.create_from_dict(handle_dict)
-        create_activity_instance(self.constructor, handle)
+        self.create_instance(handle)
+
+    @dbus.service.method('org.laptop.SingleProcess',
+                         out_signature='a{s(td)}')
+    def get_stats(self):
+        return self.get_instance_stats()
 
 
 def main():
@@ -195,6 +261,7 @@ def main():
         object_id=options.object_id, uri=options.uri,
         invited=options.invited)
 
+    single_process = None
     if options.single_process is True:
         sessionbus = dbus.SessionBus()
 
@@ -210,12 +277,11 @@ def main():
             name = None
 
         if not name:
-            SingleProcess(service_name, activity_constructor)
+            single_process = SingleProcess(service_name, activity_constructor)
         else:
             try:
-                single_process = sessionbus.get_object(service_name,
-                                                       service_path)
-                single_process.create(
+                remote = sessionbus.get_object(service_name, service_path)
+                remote.create(
                     activity_handle.get_dict(),
                     dbus_interface='org.laptop.SingleProcess')
 
@@ -228,7 +294,11 @@ def main():
     if hasattr(module, 'start'):
         module.start()
 
-    instance = create_activity_instance(activity_constructor, activity_handle)
+    if single_process is not None:
+        instance = single_process.create_instance(activity_handle)
+    else:
+        instance = create_activity_instance(activity_constructor,
+                                            activity_handle)
 
     if hasattr(instance, 'run_main_loop'):
         instance.run_main_loop()
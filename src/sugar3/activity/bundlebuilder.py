@@ -28,11 +28,18 @@ is setup by creating a `setup.py` file in the project with the following::
 
 import six
 import argparse
+import codecs
 import operator
 import os
 import sys
+import time
+import zlib
+import struct
+import hashlib
+import tempfile
 import zipfile
 import tarfile
+import multiprocessing
 import unittest
 import shutil
 import subprocess
@@ -50,9 +57,20 @@ from sugar3.bundle.activitybundle import ActivityBundle
 from six.moves import reduce
 
 
-IGNORE_DIRS = ['dist', '.git', 'screenshots']
+IGNORE_DIRS = ['dist', '.git', 'screenshots', '.xo-cache']
 IGNORE_FILES = ['.gitignore', 'MANIFEST', '*.pyc', '*~', '*.bak', 'pseudo.po']
 
+# Files that are already compressed, and are stored as they are in bundles
+STORED_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.ogg', '.oga',
+                     '.ogv', '.mp3', '.mp4', '.webm', '.webp', '.gz',
+                     '.bz2', '.xz', '.zip', '.xo', '.xol']
+
+# Directory of the dist dir keeping the compressed members of the bundles
+XO_CACHE_DIR = '.xo-cache'
+
+# Size of the chunks in which members are read to be compressed
+_COMPRESS_CHUNK_SIZE = 1024 * 1024
+
 
 def list_files(base_dir, ignore_dirs=None, ignore_files=None):
     result = []
@@ -116,61 +134,268 @@ class Config(object):
             self.tar_name = '%s-%s.tar.bz2' % (self.bundle_name, self.version)
 
 
+# Escape sequences of the strings in po files
+_PO_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'a': '\a', 'b': '\b',
+               'f': '\f', 'v': '\v', '"': '"', '\\': '\\'}
+_PO_ESCAPE_RE = re.compile(r'\\(.)')
+_PO_KEYWORD_RE = re.compile(
+    r'^(msgctxt|msgid_plural|msgid|msgstr)(?:\[(\d+)\])?\s*(".*")$')
+_PO_CHARSET_RE = re.compile(br'charset=([A-Za-z0-9_.:-]+)')
+
+
+def _unescape_po_string(path, lineno, literal):
+    if len(literal) < 2 or not literal.startswith('"') or \
+            not literal.endswith('"'):
+        raise ValueError('%s:%d: invalid string' % (path, lineno))
+    return _PO_ESCAPE_RE.sub(
+        lambda match: _PO_ESCAPES.get(match.group(1), match.group(1)),
+        literal[1:-1])
+
+
+def _parse_po(path):
+    """Parse a po file into a catalog mapping the message ids to their
+    translation, with the keys and values mo files use for plural forms
+    and contexts.
+
+    Returns the catalog and the charset of the file.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    charset = 'utf-8'
+    match = _PO_CHARSET_RE.search(data)
+    if match is not None:
+        try:
+            charset = codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+
+    catalog = {}
+    entry = {}
+    fuzzy = False
+    section = None
+
+    def add_entry():
+        if 'msgid' not in entry:
+            return
+        msgid = entry['msgid']
+        strs = entry.get('msgstr', {})
+        if fuzzy and msgid:
+            return
+        if msgid and not any(strs.values()):
+            return
+        if 'msgid_plural' in entry:
+            msgid += '\0' + entry['msgid_plural']
+        if entry.get('msgctxt') is not None:
+            msgid = entry['msgctxt'] + '\x04' + msgid
+        catalog[msgid] = '\0'.join(strs[i] for i in sorted(strs))
+
+    for lineno, line in enumerate(data.decode(charset).splitlines(), 1):
+        line = line.strip()
+
+        if not line or line.startswith('#'):
+            if section == 'msgstr':
+                add_entry()
+                entry = {}
+                fuzzy = False
+                section = None
+            if line.startswith('#,') and 'fuzzy' in line:
+                fuzzy = True
+            continue
+
+        match = _PO_KEYWORD_RE.match(line)
+        if match is not None:
+            keyword, index, literal = match.groups()
+            if keyword in ('msgctxt', 'msgid') and section == 'msgstr':
+                add_entry()
+                entry = {}
+                fuzzy = False
+            section = keyword
+            value = _unescape_po_string(path, lineno, literal)
+            if keyword == 'msgstr':
+                strs = entry.setdefault('msgstr', {})
+                index = int(index or 0)
+                strs[index] = value
+            else:
+                entry[keyword] = value
+        elif line.startswith('"') and section is not None:
+            value = _unescape_po_string(path, lineno, line)
+            if section == 'msgstr':
+                entry['msgstr'][index] += value
+            else:
+                entry[section] += value
+        else:
+            raise ValueError('%s:%d: syntax error' % (path, lineno))
+
+    add_entry()
+
+    return catalog, charset
+
+
+def _write_mo(catalog, charset, path):
+    """Write a catalog returned by _parse_po as a mo file"""
+    messages = sorted((msgid.encode(charset), msgstr.encode(charset))
+                      for msgid, msgstr in catalog.items())
+
+    ids = b''
+    strs = b''
+    offsets = []
+    for msgid, msgstr in messages:
+        offsets.append((len(msgid), len(ids), len(msgstr), len(strs)))
+        ids += msgid + b'\0'
+        strs += msgstr + b'\0'
+
+    ids_start = 7 * 4 + len(messages) * 16
+    strs_start = ids_start + len(ids)
+    table = []
+    for id_len, id_offset, str_len, str_offset in offsets:
+        table.extend([id_len, ids_start + id_offset])
+    for id_len, id_offset, str_len, str_offset in offsets:
+        table.extend([str_len, strs_start + str_offset])
+
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<7I', 0x950412de, 0, len(messages), 7 * 4,
+                            7 * 4 + len(messages) * 8, 0, 0))
+        f.write(struct.pack('<%dI' % len(table), *table))
+        f.write(ids)
+        f.write(strs)
+
+
+def _build_locale(args):
+    """Compile the po file of a language and write its linfo file. Runs in
+    the worker processes of Builder.build_locale.
+    """
+    po_path, localedir, mo_file, name, summary, builtin_msgfmt, no_fail = \
+        args
+
+    mo_path = os.path.dirname(mo_file)
+    if not os.path.isdir(mo_path):
+        os.makedirs(mo_path)
+
+    catalog = None
+    if not builtin_msgfmt:
+        args = ['msgfmt', '--output-file=%s' % mo_file, po_path]
+        try:
+            retcode = subprocess.call(args)
+        except OSError:
+            logging.warning('msgfmt not found, using the builtin compiler')
+            builtin_msgfmt = True
+        else:
+            if retcode:
+                print('ERROR - msgfmt failed with return code %i.' % retcode)
+                if no_fail:
+                    return
+
+    if builtin_msgfmt:
+        try:
+            catalog, charset = _parse_po(po_path)
+        except ValueError as e:
+            print('ERROR - could not compile %s.' % e)
+            if no_fail:
+                return
+            raise
+        _write_mo(catalog, charset, mo_file)
+
+    if catalog is None:
+        cat = gettext.GNUTranslations(open(mo_file, 'rb'))
+        translated_name = cat.gettext(name)
+        translated_summary = cat.gettext(summary)
+    else:
+        translated_name = catalog.get(name, name)
+        translated_summary = catalog.get(summary, summary)
+    if translated_summary is None:
+        translated_summary = ''
+    if translated_summary.find('\n') > -1:
+        translated_summary = translated_summary.replace('\n', '')
+        logging.warn(
+            'Translation of summary on file %s have \\n chars. '
+            'Should be removed' % po_path)
+    linfo_file = os.path.join(localedir, 'activity.linfo')
+    f = open(linfo_file, 'w')
+    f.write('[Activity]\nname = %s\n' % translated_name)
+    f.write('summary = %s\n' % translated_summary)
+    f.close()
+
+
 class Builder(object):
 
-    def __init__(self, config, no_fail=False):
+    def __init__(self, config, no_fail=False, jobs=None,
+                 builtin_msgfmt=False):
         self.config = config
         self._no_fail = no_fail
+        self._jobs = jobs or multiprocessing.cpu_count()
+        self._builtin_msgfmt = builtin_msgfmt
         self.locale_dir = os.path.join(self.config.build_dir, 'locale')
 
     def build(self):
         self.build_locale()
 
+    def _is_locale_built(self, po_path, localedir, mo_file):
+        linfo_file = os.path.join(localedir, 'activity.linfo')
+        info_path = os.path.join(self.config.source_dir, 'activity',
+                                 'activity.info')
+        try:
+            return os.path.getmtime(mo_file) >= os.path.getmtime(po_path) \
+                and os.path.getmtime(linfo_file) >= \
+                os.path.getmtime(info_path)
+        except OSError:
+            return False
+
     def build_locale(self):
+        """Compile the po files of the activity.
+
+        Languages whose po file and activity.info did not change since the
+        last build are skipped, the others are compiled by a pool of
+        processes, with msgfmt or with the builtin compiler.
+        """
         po_dir = os.path.join(self.config.source_dir, 'po')
 
         if not self.config.bundle.is_dir(po_dir):
             logging.warn('Missing po/ dir, cannot build_locale')
             return
 
-        if os.path.exists(self.locale_dir):
-            shutil.rmtree(self.locale_dir)
-
+        langs = []
+        jobs = []
         for f in sorted(os.listdir(po_dir)):
             if not f.endswith('.po') or f == 'pseudo.po':
                 continue
 
             file_name = os.path.join(po_dir, f)
             lang = f[:-3]
+            langs.append(lang)
 
             localedir = os.path.join(self.config.build_dir, 'locale', lang)
-            mo_path = os.path.join(localedir, 'LC_MESSAGES')
-            if not os.path.isdir(mo_path):
-                os.makedirs(mo_path)
+            mo_file = os.path.join(localedir, 'LC_MESSAGES',
+                                   '%s.mo' % self.config.bundle_id)
+            if self._is_locale_built(file_name, localedir, mo_file):
+                continue
 
-            mo_file = os.path.join(mo_path, '%s.mo' % self.config.bundle_id)
-            args = ['msgfmt', '--output-file=%s' % mo_file, file_name]
-            retcode = subprocess.call(args)
-            if retcode:
-                print('ERROR - msgfmt failed with return code %i.' % retcode)
-                if self._no_fail:
-                    continue
-
-            cat = gettext.GNUTranslations(open(mo_file, 'rb'))
-            translated_name = cat.gettext(self.config.activity_name)
-            translated_summary = cat.gettext(self.config.summary)
-            if translated_summary is None:
-                translated_summary = ''
-            if translated_summary.find('\n') > -1:
-                translated_summary = translated_summary.replace('\n', '')
-                logging.warn(
-                    'Translation of summary on file %s have \\n chars. '
-                    'Should be removed' % file_name)
-            linfo_file = os.path.join(localedir, 'activity.linfo')
-            f = open(linfo_file, 'w')
-            f.write('[Activity]\nname = %s\n' % translated_name)
-            f.write('summary = %s\n' % translated_summary)
-            f.close()
+            if os.path.exists(localedir):
+                shutil.rmtree(localedir)
+            jobs.append((file_name, localedir, mo_file,
+                         self.config.activity_name, self.config.summary,
+                         self._builtin_msgfmt, self._no_fail))
+
+        # drop the languages that have been removed from po/
+        if os.path.isdir(self.locale_dir):
+            for lang in os.listdir(self.locale_dir):
+                if lang not in langs:
+                    path = os.path.join(self.locale_dir, lang)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+
+        if self._jobs > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(min(self._jobs, len(jobs)))
+            try:
+                pool.map(_build_locale, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                _build_locale(job)
 
     def get_locale_files(self):
         return list_files(self.locale_dir, IGNORE_DIRS, IGNORE_FILES)
@@ -236,28 +461,193 @@ class Packager(object):
                           IGNORE_DIRS, IGNORE_FILES)
 
 
+def _is_stored(path):
+    return os.path.splitext(path)[1].lower() in STORED_EXTENSIONS
+
+
+def _compress_member(args):
+    """Compress a file into the cache directory, unless the cache already
+    has its content. Runs in the worker processes of XOPackager.
+
+    Returns the CRC and size of the file, and the path of its compressed
+    data in the cache or None if the file is stored as it is.
+    """
+    path, cache_dir = args
+
+    crc = 0
+    size = 0
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_COMPRESS_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            sha1.update(chunk)
+    crc &= 0xffffffff
+
+    if _is_stored(path):
+        return crc, size, None
+
+    cache_path = os.path.join(cache_dir, sha1.hexdigest())
+    if not os.path.exists(cache_path):
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                      zlib.DEFLATED, -15)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as dest, open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_COMPRESS_CHUNK_SIZE), b''):
+                dest.write(compressor.compress(chunk))
+            dest.write(compressor.flush())
+        os.rename(temp_path, cache_path)
+
+    return crc, size, cache_path
+
+
+class _ZipWriter(object):
+    """Write a zip archive from members that are already compressed.
+
+    zipfile only accepts uncompressed data, which would serialize the
+    compression of all the members in the packaging process.
+    """
+
+    _FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
+    _CENTRAL_DIR = struct.Struct('<4s4B4HL2L5H2L')
+    _END_ARCHIVE = struct.Struct('<4s4H2LH')
+    # Sizes above which zip64 extensions would be needed
+    _MAX_SIZE = 0xffffffff
+    _MAX_MEMBERS = 0xffff
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._central_dir = []
+
+    def write(self, source_path, arcname, crc, size, compressed_path):
+        st = os.stat(source_path)
+        date_time = time.localtime(st.st_mtime)[0:6]
+        if date_time[0] < 1980:
+            date_time = (1980, 1, 1, 0, 0, 0)
+        dos_time = date_time[3] << 11 | date_time[4] << 5 | date_time[5] // 2
+        dos_date = (date_time[0] - 1980) << 9 | date_time[1] << 5 | \
+            date_time[2]
+
+        if compressed_path is None:
+            compress_type = zipfile.ZIP_STORED
+            data_path = source_path
+            compressed_size = size
+        else:
+            compress_type = zipfile.ZIP_DEFLATED
+            data_path = compressed_path
+            compressed_size = os.path.getsize(compressed_path)
+
+        offset = self._file.tell()
+        if max(offset, size, compressed_size) > self._MAX_SIZE or \
+                len(self._central_dir) >= self._MAX_MEMBERS:
+            raise ValueError('Bundle too large for a zip without zip64')
+
+        name = arcname.encode('utf-8')
+        flags = 0
+        try:
+            arcname.encode('ascii')
+        except UnicodeError:
+            flags |= 0x800
+
+        self._file.write(self._FILE_HEADER.pack(
+            b'PK\003\004', 20, 0, flags, compress_type, dos_time, dos_date,
+            crc, compressed_size, size, len(name), 0))
+        self._file.write(name)
+        with open(data_path, 'rb') as data:
+            shutil.copyfileobj(data, self._file)
+
+        self._central_dir.append(self._CENTRAL_DIR.pack(
+            b'PK\001\002', 20, 3, 20, 0, flags, compress_type, dos_time,
+            dos_date, crc, compressed_size, size, len(name), 0, 0, 0, 0,
+            (st.st_mode & 0xffff) << 16, offset) + name)
+
+    def close(self):
+        start = self._file.tell()
+        for record in self._central_dir:
+            self._file.write(record)
+        size = self._file.tell() - start
+        count = len(self._central_dir)
+        self._file.write(self._END_ARCHIVE.pack(
+            b'PK\005\006', 0, 0, count, count, size, start, 0))
+        self._file.close()
+
+
 class XOPackager(Packager):
 
-    def __init__(self, builder):
+    def __init__(self, builder, jobs=None):
         Packager.__init__(self, builder.config)
 
         self.builder = builder
         self.builder.build_locale()
         self.package_path = os.path.join(self.config.dist_dir,
                                          self.config.xo_name)
+        self.cache_dir = os.path.join(self.config.dist_dir, XO_CACHE_DIR)
+        self.jobs = jobs or multiprocessing.cpu_count()
 
-    def package(self):
-        bundle_zip = zipfile.ZipFile(self.package_path, 'w',
-                                     zipfile.ZIP_DEFLATED)
-
+    def _get_members(self):
+        members = []
         for f in self.get_files_in_git():
-            bundle_zip.write(os.path.join(self.config.source_dir, f),
-                             os.path.join(self.config.bundle_root_dir, f))
+            members.append((os.path.join(self.config.source_dir, f),
+                            os.path.join(self.config.bundle_root_dir, f)))
 
         for f in self.builder.get_locale_files():
-            bundle_zip.write(os.path.join(self.builder.locale_dir, f),
-                             os.path.join(self.config.bundle_root_dir,
-                                          'locale', f))
+            members.append((os.path.join(self.builder.locale_dir, f),
+                            os.path.join(self.config.bundle_root_dir,
+                                         'locale', f)))
+        return members
+
+    def package(self):
+        """Create the xo bundle.
+
+        Members are compressed by a pool of processes into a cache in the
+        dist dir, indexed by content, so files that did not change since
+        the last build are not compressed again. Files that are already
+        compressed are stored as they are.
+        """
+        members = self._get_members()
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        jobs = [(path, self.cache_dir) for path, arcname_ in members]
+        if self.jobs > 1 and len(members) > 1:
+            pool = multiprocessing.Pool(self.jobs)
+            try:
+                results = pool.map(_compress_member, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_compress_member(job) for job in jobs]
+
+        try:
+            writer = _ZipWriter(self.package_path)
+            try:
+                for (path, arcname), result in zip(members, results):
+                    writer.write(path, arcname, *result)
+            finally:
+                writer.close()
+        except ValueError:
+            logging.warning('Packager: bundle needs zip64, '
+                            'falling back to zipfile')
+            self._package_with_zipfile(members)
+
+        # drop the content of files that are not in the bundle anymore
+        used = set(result[2] for result in results)
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if path not in used:
+                os.remove(path)
+
+    def _package_with_zipfile(self, members):
+        bundle_zip = zipfile.ZipFile(self.package_path, 'w',
+                                     zipfile.ZIP_DEFLATED, allowZip64=True)
+
+        for path, arcname in members:
+            compress_type = zipfile.ZIP_DEFLATED
+            if _is_stored(path):
+                compress_type = zipfile.ZIP_STORED
+            bundle_zip.write(path, arcname, compress_type)
 
         bundle_zip.close()
 
@@ -494,10 +884,15 @@ def cmd_dev(config, options):
 def cmd_dist_xo(config, options):
     """Create a xo bundle package"""
     no_fail = False
+    jobs = None
+    builtin_msgfmt = False
     if options is not None:
         no_fail = options.no_fail
+        jobs = options.jobs
+        builtin_msgfmt = options.builtin_msgfmt
 
-    packager = XOPackager(Builder(config, no_fail))
+    builder = Builder(config, no_fail, jobs, builtin_msgfmt)
+    packager = XOPackager(builder, jobs)
     packager.package()
 
 
@@ -519,7 +914,8 @@ def cmd_dist_source(config, options):
 def cmd_install(config, options):
     """Install the activity in the system"""
 
-    installer = Installer(Builder(config))
+    installer = Installer(
+        Builder(config, builtin_msgfmt=options.builtin_msgfmt))
     installer.install(
         options.destdir,
         options.prefix,
@@ -595,12 +991,20 @@ def cmd_genpot(config, options):
 def cmd_build(config, options):
     """Build generated files"""
 
-    builder = Builder(config)
+    builtin_msgfmt = False
+    if options is not None:
+        builtin_msgfmt = options.builtin_msgfmt
+
+    builder = Builder(config, builtin_msgfmt=builtin_msgfmt)
     builder.build()
 
 
 def start():
     parser = argparse.ArgumentParser(prog='./setup.py')
+    parser.add_argument(
+        "--builtin-msgfmt", dest="builtin_msgfmt", action="store_true",
+        default=False,
+        help="compile translations without running msgfmt")
     subparsers = parser.add_subparsers(
         dest="command", help="Options for %(prog)s")
 
@@ -636,6 +1040,10 @@ def start():
     dist_parser.add_argument(
         "--no-fail", dest="no_fail", action="store_true", default=False,
         help="continue past failure when building xo file")
+    dist_parser.add_argument(
+        "--jobs", "-j", dest="jobs", type=int, default=None,
+        help="number of processes compiling translations and compressing "
+        "files, defaults to the number of CPUs")
 
     subparsers.add_parser("dist_source", help="Create a tar source package")
     subparsers.add_parser("build", help="Build generated files")
@@ -0,0 +1,416 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Prefork launcher for activity processes
+
+UNSTABLE. A zygote is a warm process that has already imported the modules
+shared by all activities, and forks a child for each activity launched
+through it, so that activities do not pay for these imports again.
+
+The zygote is started with::
+
+    python3 -m sugar3.activity.zygote SOCKET_PATH
+
+and used by :mod:`sugar3.activity.activityfactory` when the
+SUGAR_ACTIVITY_ZYGOTE environment variable of the shell is set to the path
+of its socket.  Launches that the zygote can not handle, or that it does
+not acknowledge within LAUNCH_TIMEOUT, fall back to starting a new process.
+
+The socket is only accessible to the user running the zygote, which also
+checks the credentials of every client.
+
+Gtk and Gdk initialize the display connection when they are imported,
+which can not be shared between forked processes, so the zygote only loads
+their libraries and each child imports them for its own display.
+"""
+
+import os
+import sys
+import json
+import errno
+import fcntl
+import random
+import select
+import signal
+import socket
+import struct
+import logging
+import traceback
+
+# Format of the length prefix of the messages
+_LENGTH = struct.Struct('!I')
+
+# Format of the SO_PEERCRED credentials of a client: pid, uid and gid
+_PEERCRED = struct.Struct('3i')
+
+# Seconds after which a launch is given up, by the client waiting for the
+# pid of the activity and by the zygote reading the request
+LAUNCH_TIMEOUT = 5
+
+# File descriptors sent with a launch request, for stdin, stdout and stderr
+_N_FDS = 3
+
+# Python modules imported by the zygote before forking
+_PRELOAD_MODULES = [
+    'six',
+    'json',
+    'cairo',
+    'dbus',
+    'dbus.service',
+    'dbus.mainloop.glib',
+    'gi.repository.GLib',
+    'gi.repository.GObject',
+    'gi.repository.Gio',
+    'gi.repository.Pango',
+    'gi.repository.GdkPixbuf',
+    'sugar3.activity.activityinstance',
+    'sugar3.datastore.datastore',
+]
+
+# Libraries loaded without importing their Python bindings
+_PRELOAD_TYPELIBS = [
+    ('Gdk', '3.0'),
+    ('Gtk', '3.0'),
+    ('SugarExt', '1.0'),
+]
+
+
+def get_socket_path():
+    """Return the path of the socket of the zygote to launch activities
+    with, or None if activities are started in new processes.
+    """
+    return os.environ.get('SUGAR_ACTIVITY_ZYGOTE') or None
+
+
+def can_launch(command):
+    """Return whether the zygote can run the command of an activity, that
+    is whether the command starts sugar-activity with this Python version.
+    """
+    if not hasattr(socket, 'CMSG_LEN'):
+        return False
+    launcher = 'sugar-activity3' if sys.version_info[0] == 3 \
+        else 'sugar-activity'
+    return os.path.basename(command[0]) == launcher
+
+
+def _send_message(sock, message, fds=()):
+    data = json.dumps(message).encode('utf-8')
+    data = _LENGTH.pack(len(data)) + data
+    ancillary = []
+    if fds:
+        ancillary.append((socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                          struct.pack('%di' % len(fds), *fds)))
+    sent = sock.sendmsg([data], ancillary)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError('Connection closed')
+        data += chunk
+    return data
+
+
+def _recv_message(sock, n_fds=0):
+    fds_size = socket.CMSG_LEN(n_fds * struct.calcsize('i')) if n_fds else 0
+    data, ancillary, flags_, address_ = sock.recvmsg(_LENGTH.size,
+                                                     fds_size)
+    if not data:
+        raise EOFError('Connection closed')
+    data += _recv_exactly(sock, _LENGTH.size - len(data))
+
+    fds = []
+    for level, kind, fd_data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fd_data = fd_data[:len(fd_data) - len(fd_data) % 4]
+            fds.extend(struct.unpack('%di' % (len(fd_data) // 4), fd_data))
+
+    length = _LENGTH.unpack(data)[0]
+    message = json.loads(_recv_exactly(sock, length).decode('utf-8'))
+    return message, fds
+
+
+def send_launch_request(socket_path, command, environ, cwd, stdin, stdout,
+                        stderr):
+    """Ask the zygote listening on socket_path to launch an activity,
+    without blocking.
+
+    Returns the socket on which the zygote replies, to be read with
+    :func:`read_launch_reply` once it is readable.  Raises socket.error
+    when the request cannot be sent right away.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.setblocking(False)
+        sock.connect(socket_path)
+        _send_message(sock, {'command': command,
+                             'environ': environ,
+                             'cwd': cwd},
+                      [stdin, stdout, stderr])
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def read_launch_reply(sock):
+    """Return the pid of the activity launched by the request sent on
+    sock, once the reply of the zygote is readable.
+    """
+    sock.settimeout(LAUNCH_TIMEOUT)
+    pid = _recv_message(sock)[0]['pid']
+    # the exit status is only sent when the activity exits
+    sock.setblocking(True)
+    return pid
+
+
+def launch(socket_path, command, environ, cwd, stdin, stdout, stderr,
+           timeout=LAUNCH_TIMEOUT):
+    """Launch an activity through the zygote listening on socket_path,
+    waiting at most timeout seconds for it to be started.
+
+    Returns the pid of the activity process and the socket on which its
+    exit status is sent, to be read with :func:`read_exit_status`.
+    """
+    sock = send_launch_request(socket_path, command, environ, cwd, stdin,
+                               stdout, stderr)
+    try:
+        if not select.select([sock], [], [], timeout)[0]:
+            raise socket.timeout('No reply from the zygote')
+        pid = read_launch_reply(sock)
+    except BaseException:
+        sock.close()
+        raise
+    return pid, sock
+
+
+def _is_same_user(sock):
+    """Return whether the client connected on sock runs as our user."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        # only the permissions of the socket restrict the clients
+        return True
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                  _PEERCRED.size)
+    return _PEERCRED.unpack(credentials)[1] == os.getuid()
+
+
+def _is_closed(sock):
+    """Return whether the client closed its end of sock."""
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except socket.error:
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def read_exit_status(sock):
+    """Return the exit status of a launched activity, in the format of
+    os.waitpid(), once the connection to the zygote reports it.
+    """
+    try:
+        return _recv_message(sock)[0]['status']
+    finally:
+        sock.close()
+
+
+class Zygote(object):
+    """Server forking a child process for each launch request."""
+
+    def __init__(self, path):
+        self._path = path
+        self._children = {}
+
+        if os.path.exists(path):
+            os.unlink(path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self._socket.bind(path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(path, 0o600)
+        self._socket.listen(16)
+
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        for fd in (self._wakeup_read, self._wakeup_write):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def preload(self):
+        """Import the modules shared by activities."""
+        import gi
+        from gi.repository import GLib
+        from gi.repository import GIRepository
+        repository = GIRepository.Repository.get_default()
+        for namespace, version in _PRELOAD_TYPELIBS:
+            try:
+                gi.require_version(namespace, version)
+                repository.require(namespace, version, 0)
+            except (ValueError, GLib.Error):
+                logging.debug('Cannot preload %s %s', namespace, version)
+
+        for name in _PRELOAD_MODULES:
+            try:
+                __import__(name)
+            except ImportError:
+                logging.debug('Cannot preload %s', name)
+
+    def run(self):
+        """Serve launch requests until the process is terminated."""
+        signal.signal(signal.SIGCHLD, self.__sigchld_cb)
+        try:
+            while True:
+                try:
+                    readable = select.select(
+                        [self._socket, self._wakeup_read], [], [])[0]
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                if self._wakeup_read in readable:
+                    self._drain_wakeup()
+                    self._reap_children()
+                if self._socket in readable:
+                    self._accept()
+        finally:
+            self._socket.close()
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+
+    def __sigchld_cb(self, signum, frame):
+        try:
+            os.write(self._wakeup_write, b'\0')
+        except OSError:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_read, 256):
+                pass
+        except OSError:
+            pass
+
+    def _reap_children(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                return
+            if pid == 0:
+                return
+
+            connection = self._children.pop(pid, None)
+            if connection is not None:
+                try:
+                    _send_message(connection, {'status': status})
+                except socket.error:
+                    logging.debug('Cannot report the exit of %d', pid)
+                connection.close()
+
+    def _accept(self):
+        connection = self._socket.accept()[0]
+        fds = []
+        try:
+            if not _is_same_user(connection):
+                raise ValueError('Launch request from another user')
+            connection.settimeout(LAUNCH_TIMEOUT)
+            request, fds = _recv_message(connection, _N_FDS)
+            if len(fds) != _N_FDS:
+                raise ValueError('Expected %d file descriptors' % _N_FDS)
+            if _is_closed(connection):
+                raise EOFError('Launch request given up by the client')
+
+            pid = os.fork()
+            if pid == 0:
+                self._run_child(request, fds)
+            try:
+                _send_message(connection, {'pid': pid})
+            except socket.error:
+                # the client starts the activity in a new process instead
+                os.kill(pid, signal.SIGKILL)
+                raise
+            # children are only reaped by run(), after this returns
+            self._children[pid] = connection
+        except (EOFError, ValueError, OSError, socket.error):
+            logging.exception('Invalid launch request')
+            connection.close()
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def _run_child(self, request, fds):
+        status = 1
+        try:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            self._socket.close()
+            os.close(self._wakeup_read)
+            os.close(self._wakeup_write)
+            for connection in self._children.values():
+                connection.close()
+
+            for i, fd in enumerate(fds):
+                os.dup2(fd, i)
+            for fd in fds:
+                if fd > 2:
+                    os.close(fd)
+
+            # forked children would otherwise share the random state, and
+            # generate the same activity ids
+            random.seed()
+
+            os.environ.clear()
+            os.environ.update(request['environ'])
+            os.chdir(request['cwd'])
+            sys.argv = request['command']
+
+            self._run_command()
+            status = 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _run_command(self):
+        """Run the activity of sys.argv in a child process."""
+        from sugar3.activity import activityinstance
+        activityinstance.main()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print('usage: %s SOCKET_PATH' % sys.argv[0])
+        sys.exit(1)
+
+    zygote = Zygote(sys.argv[1])
+    zygote.preload()
+    zygote.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -24,9 +24,13 @@ from six.moves.configparser import ConfigParser, ParsingError
 import six
 from locale import normalize
 import os
+import json
+import atexit
 import shutil
 import tempfile
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 
 from sugar3 import env
 from sugar3.bundle.bundle import Bundle, \
@@ -37,6 +41,18 @@ from sugar3.bundle.bundleversion import InvalidVersionError
 
 _bundle_instances = {}
 
+# Version of the bundle index format, to bump when the indexed data changes
+_INDEX_VERSION = 1
+# Attributes of ActivityBundle read from activity.info and stored in the index
+_INFO_ATTRIBUTES = ['bundle_exec', '_name', '_icon', '_bundle_id',
+                    '_mime_types', '_show_launcher', '_tags',
+                    '_activity_version', '_summary', '_description',
+                    '_single_instance', '_max_participants']
+# Threads reading the bundles missing from the index in scan()
+_SCAN_WORKERS = 4
+
+_bundle_index = None
+
 
 def _expand_lang(locale):
     # Private method from gettext.py
@@ -100,7 +116,14 @@ class ActivityBundle(Bundle):
     _unzipped_extension = '.activity'
     _infodir = 'activity'
 
-    def __init__(self, path, translated=True):
+    def __init__(self, path, translated=True, metadata=None):
+        """Keyword arguments:
+        path -- path of the bundle, a directory or a .xo file
+        translated -- whether to use the name, summary and tags of the
+            locale of the user
+        metadata -- an entry of the bundle index, used instead of parsing
+            the activity.info and linfo files
+        """
         Bundle.__init__(self, path)
         self.bundle_exec = None
 
@@ -116,17 +139,74 @@ class ActivityBundle(Bundle):
         self._single_instance = False
         self._max_participants = 0
 
-        info_file = self.get_file('activity/activity.info')
-        if info_file is None:
-            raise MalformedBundleException('No activity.info file')
-        self._parse_info(info_file)
-
+        if metadata is not None:
+            self._set_metadata(metadata, translated)
+        else:
+            info_file = self.get_file('activity/activity.info')
+            if info_file is None:
+                raise MalformedBundleException('No activity.info file')
+            self._parse_info(info_file)
+
+            if translated:
+                linfo_file = self._get_linfo_file()
+                if linfo_file:
+                    self._parse_linfo(linfo_file)
+
+        # untranslated instances, like the ones parsed for the bundle
+        # index, must not be handed out by get_bundle_instance()
         if translated:
-            linfo_file = self._get_linfo_file()
-            if linfo_file:
-                self._parse_linfo(linfo_file)
+            _bundle_instances[path] = self
+
+    def _set_metadata(self, metadata, translated):
+        for attribute in _INFO_ATTRIBUTES:
+            value = metadata['info'][attribute]
+            if isinstance(value, list):
+                value = list(value)
+            setattr(self, attribute, value)
 
-        _bundle_instances[path] = self
+        if not translated:
+            return
+
+        locales = metadata['locales']
+        for lang in _get_languages():
+            if lang not in locales:
+                continue
+            linfo_path = os.path.join(self._path, 'locale', lang,
+                                      'activity.linfo')
+            try:
+                mtime = os.stat(linfo_path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime == locales[lang]['mtime']:
+                self._set_linfo(locales[lang])
+            else:
+                linfo_file = self._get_linfo_file()
+                if linfo_file:
+                    self._parse_linfo(linfo_file)
+            break
+
+    def _get_metadata(self):
+        """Get the metadata of an untranslated bundle directory, with the
+        linfo of all its locales, as stored in the bundle index."""
+        info = {}
+        for attribute in _INFO_ATTRIBUTES:
+            info[attribute] = getattr(self, attribute)
+
+        locales = {}
+        locale_path = os.path.join(self._path, 'locale')
+        if os.path.isdir(locale_path):
+            for lang in os.listdir(locale_path):
+                linfo_path = os.path.join('locale', lang, 'activity.linfo')
+                linfo_file = self.get_file(linfo_path)
+                if linfo_file is None:
+                    continue
+                mtime = os.fstat(linfo_file.fileno()).st_mtime
+                linfo = self._read_linfo(linfo_file)
+                if linfo is not None:
+                    linfo['mtime'] = mtime
+                    locales[lang] = linfo
+
+        return {'info': info, 'locales': locales}
 
     def _parse_info(self, info_file):
         cp = ConfigParser()
@@ -229,30 +309,14 @@ class ActivityBundle(Bundle):
                 self.get_path())
 
     def _get_linfo_file(self):
-        # Using method from gettext.py, first find languages from environ
-        languages = []
-        for envar in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG'):
-            val = os.environ.get(envar)
-            if val:
-                languages = val.split(':')
-                break
-
-        # Next, normalize and expand the languages
-        nelangs = []
-        for lang in languages:
-            for nelang in _expand_lang(lang):
-                if nelang not in nelangs:
-                    nelangs.append(nelang)
-
-        # Finally, select a language
-        for lang in nelangs:
+        for lang in _get_languages():
             linfo_path = os.path.join('locale', lang, 'activity.linfo')
             linfo_file = self.get_file(linfo_path)
             if linfo_file is not None:
                 return linfo_file
         return None
 
-    def _parse_linfo(self, linfo_file):
+    def _read_linfo(self, linfo_file):
         cp = ConfigParser()
         try:
             if six.PY2:
@@ -261,19 +325,37 @@ class ActivityBundle(Bundle):
                 cp.read_string(linfo_file.read().decode())
         except ParsingError as e:
             logging.exception('Exception reading linfo file: %s', e)
-            return
+            return None
 
         section = 'Activity'
+        linfo = {}
 
         if cp.has_option(section, 'name'):
-            self._name = cp.get(section, 'name')
+            linfo['name'] = cp.get(section, 'name')
 
         if cp.has_option(section, 'summary'):
-            self._summary = cp.get(section, 'summary')
+            linfo['summary'] = cp.get(section, 'summary')
 
         if cp.has_option(section, 'tags'):
             tag_list = cp.get(section, 'tags').strip(';')
-            self._tags = [tag.strip() for tag in tag_list.split(';')]
+            linfo['tags'] = [tag.strip() for tag in tag_list.split(';')]
+
+        return linfo
+
+    def _set_linfo(self, linfo):
+        if 'name' in linfo:
+            self._name = linfo['name']
+
+        if 'summary' in linfo:
+            self._summary = linfo['summary']
+
+        if 'tags' in linfo:
+            self._tags = linfo['tags']
+
+    def _parse_linfo(self, linfo_file):
+        linfo = self._read_linfo(linfo_file)
+        if linfo is not None:
+            self._set_linfo(linfo)
 
     def get_locale_path(self):
         """Get the locale path inside the (installed) activity bundle."""
@@ -458,8 +540,206 @@ class ActivityBundle(Bundle):
         return self.get_path().startswith(env.get_user_activities_path())
 
 
+def _get_languages():
+    # Using method from gettext.py, first find languages from environ
+    languages = []
+    for envar in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG'):
+        val = os.environ.get(envar)
+        if val:
+            languages = val.split(':')
+            break
+
+    # Next, normalize and expand the languages
+    nelangs = []
+    for lang in languages:
+        for nelang in _expand_lang(lang):
+            if nelang not in nelangs:
+                nelangs.append(nelang)
+
+    return nelangs
+
+
+class _BundleIndex(object):
+    """Persistent index of the metadata of the bundle directories.
+
+    Entries are validated against the modification time of activity.info
+    and of the locale directory, so bundles are only parsed again after
+    they have been upgraded.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+
+        self._entries = {}
+        try:
+            with open(self._path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return
+        if index.get('version') == _INDEX_VERSION:
+            self._entries = index['bundles']
+
+    def _get_stamp(self, bundle_path):
+        try:
+            st = os.stat(os.path.join(bundle_path, 'activity',
+                                      'activity.info'))
+        except OSError:
+            return None
+        try:
+            locale_mtime = os.stat(os.path.join(bundle_path,
+                                                'locale')).st_mtime
+        except OSError:
+            locale_mtime = None
+        return [st.st_mtime, st.st_size, locale_mtime]
+
+    def lookup(self, bundle_path):
+        with self._lock:
+            self._load()
+            entry = self._entries.get(bundle_path)
+        if entry is None or entry['stamp'] != self._get_stamp(bundle_path):
+            return None
+        return entry
+
+    def read(self, bundle_path):
+        """Parse a bundle directory and store its metadata in the index"""
+        stamp = self._get_stamp(bundle_path)
+        bundle = ActivityBundle(bundle_path, translated=False)
+        entry = bundle._get_metadata()
+        entry['stamp'] = stamp
+
+        with self._lock:
+            self._load()
+            self._entries[bundle_path] = entry
+            self._set_dirty()
+        return entry
+
+    def prune(self, path, bundle_paths):
+        """Drop the entries of the bundles of the directory path that are
+        not in bundle_paths anymore"""
+        path = os.path.normpath(path)
+        bundle_paths = set(bundle_paths)
+        with self._lock:
+            self._load()
+            for bundle_path in list(self._entries.keys()):
+                directory = os.path.normpath(os.path.dirname(bundle_path))
+                if directory == path and bundle_path not in bundle_paths:
+                    del self._entries[bundle_path]
+                    self._set_dirty()
+
+    def _set_dirty(self):
+        if not self._dirty:
+            self._dirty = True
+            atexit.register(self.save)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            index = {'version': _INDEX_VERSION, 'bundles': self._entries}
+            try:
+                fd, temp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(self._path))
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(index, f)
+                os.rename(temp_path, self._path)
+            except (IOError, OSError) as e:
+                logging.warning('Could not save the bundle index: %s', e)
+                return
+            self._dirty = False
+
+
+def _get_bundle_index():
+    global _bundle_index
+
+    if _bundle_index is None:
+        _bundle_index = _BundleIndex(
+            env.get_profile_path('activity-index.json'))
+    return _bundle_index
+
+
+def load_bundle(path, translated=True):
+    """Create an ActivityBundle, from the bundle index if the bundle is a
+    directory.
+
+    Unlike get_bundle_instance(), a new ActivityBundle is returned by
+    every call.
+
+    Keyword arguments:
+    path -- path of the bundle directory or archive
+    translated -- whether to use the name, summary and tags of the locale
+        of the user
+    """
+    if not os.path.isdir(path):
+        return ActivityBundle(path, translated=translated)
+
+    index = _get_bundle_index()
+    entry = index.lookup(path)
+    if entry is None:
+        entry = index.read(path)
+    return ActivityBundle(path, translated=translated, metadata=entry)
+
+
 def get_bundle_instance(path, translated=True):
     global _bundle_instances
     if path not in _bundle_instances:
-        _bundle_instances[path] = ActivityBundle(path, translated=translated)
+        _bundle_instances[path] = load_bundle(path, translated=translated)
     return _bundle_instances[path]
+
+
+def scan(path, translated=True):
+    """Get the activity bundles installed as directories in path.
+
+    The bundles missing from the bundle index, or changed since they
+    were indexed, are parsed in parallel and the index is saved.
+    Malformed bundles are skipped.
+
+    Keyword arguments:
+    path -- directory containing the bundles, like ~/Activities
+    translated -- whether to use the name, summary and tags of the locale
+        of the user
+    """
+    index = _get_bundle_index()
+
+    bundle_paths = []
+    for name in sorted(os.listdir(path)):
+        bundle_path = os.path.join(path, name)
+        if os.path.isfile(os.path.join(bundle_path, 'activity',
+                                       'activity.info')):
+            bundle_paths.append(bundle_path)
+
+    missing = [bundle_path for bundle_path in bundle_paths
+               if index.lookup(bundle_path) is None]
+
+    def read(bundle_path):
+        try:
+            index.read(bundle_path)
+        except MalformedBundleException as e:
+            logging.warning('Skipping bundle %s: %s', bundle_path, e)
+
+    if len(missing) > 1:
+        pool = ThreadPool(min(_SCAN_WORKERS, len(missing)))
+        try:
+            pool.map(read, missing)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for bundle_path in missing:
+            read(bundle_path)
+    index.prune(path, bundle_paths)
+    index.save()
+
+    bundles = []
+    for bundle_path in bundle_paths:
+        entry = index.lookup(bundle_path)
+        if entry is not None:
+            bundles.append(ActivityBundle(bundle_path, translated=translated,
+                                          metadata=entry))
+    return bundles
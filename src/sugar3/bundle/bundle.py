@@ -20,11 +20,27 @@
 UNSTABLE.
 """
 
-import six
+import io
 import os
+import mmap
+import stat
+import struct
 import logging
 import shutil
+import tempfile
+import threading
 import zipfile
+import zlib
+from multiprocessing.pool import ThreadPool
+
+# Size of the buffer used to decompress the members of a bundle
+_EXTRACT_BUFFER_SIZE = 1024 * 1024
+# Members above which a bundle is extracted by several threads
+_PARALLEL_EXTRACT_THRESHOLD = 64
+_PARALLEL_EXTRACT_WORKERS = 4
+
+# Local file header of the members of a zip file
+_ZIP_FILE_HEADER = struct.Struct('<4s5HL2L2H')
 
 
 class AlreadyInstalledException(Exception):
@@ -51,6 +67,154 @@ class MalformedBundleException(Exception):
     pass
 
 
+def _is_inside(dest_dir, path):
+    """Return whether path resolves to a location in dest_dir, which
+    must be a real path."""
+    path = os.path.realpath(path)
+    return path == dest_dir or path.startswith(dest_dir + os.sep)
+
+
+def _get_member_path(dest_dir, name):
+    parts = name.split('/')
+    if name.startswith('/') or '..' in parts:
+        raise ZipExtractException('Invalid path %r in bundle' % name)
+    path = os.path.join(dest_dir, *parts)
+    if not _is_inside(dest_dir, path):
+        raise ZipExtractException('Path %r leaves the bundle' % name)
+    return path
+
+
+def _is_symlink(info):
+    return stat.S_ISLNK(info.external_attr >> 16)
+
+
+def _extract_symlink(zip_file, info, dest_dir):
+    path = _get_member_path(dest_dir, info.filename)
+    target = zip_file.read(info).decode('utf-8')
+    if not _is_inside(dest_dir, os.path.join(os.path.dirname(path),
+                                             target)):
+        raise ZipExtractException('Link %r points out of the bundle' %
+                                  info.filename)
+
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    os.symlink(target, path)
+
+
+def _extract_member(zip_file, info, dest_dir):
+    path = _get_member_path(dest_dir, info.filename)
+    mode = info.external_attr >> 16
+
+    if info.filename.endswith('/'):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return
+
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            # created meanwhile by another worker
+            if not os.path.isdir(parent):
+                raise
+
+    with zip_file.open(info) as source, open(path, 'wb') as dest:
+        if info.file_size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(dest.fileno(), 0, info.file_size)
+            except OSError:
+                pass
+        shutil.copyfileobj(source, dest, _EXTRACT_BUFFER_SIZE)
+
+    if mode & 0o777:
+        os.chmod(path, mode & 0o777)
+
+
+def _extract_zip(zip_path, members, dest_dir, workers):
+    """Extract the members of the zip file at zip_path to dest_dir,
+    spreading them over workers threads when it is greater than 1.
+
+    Symbolic links are created once all the other members have been
+    extracted, so that no member is written through one, and they must
+    point inside dest_dir."""
+    dest_dir = os.path.realpath(dest_dir)
+    links = [info for info in members if _is_symlink(info)]
+    members = [info for info in members if not _is_symlink(info)]
+
+    _extract_files(zip_path, members, dest_dir, workers)
+
+    if links:
+        with zipfile.ZipFile(zip_path) as zip_file:
+            for info in links:
+                _extract_symlink(zip_file, info, dest_dir)
+        # links through links created afterwards are only resolved now
+        for info in links:
+            _get_member_path(dest_dir, info.filename)
+
+
+def _extract_files(zip_path, members, dest_dir, workers):
+    if workers <= 1:
+        with zipfile.ZipFile(zip_path) as zip_file:
+            for info in members:
+                _extract_member(zip_file, info, dest_dir)
+        return
+
+    # zlib releases the GIL, give every thread its own handle so they
+    # can decompress concurrently
+    local = threading.local()
+
+    def extract(info):
+        if not hasattr(local, 'zip_file'):
+            local.zip_file = zipfile.ZipFile(zip_path)
+        _extract_member(local.zip_file, info, dest_dir)
+
+    # biggest members first, for the workers to finish together
+    members = sorted(members, key=lambda info: info.file_size, reverse=True)
+    pool = ThreadPool(workers)
+    try:
+        pool.map(extract, members, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class _MmapReader(io.RawIOBase):
+    """Read a member stored uncompressed in a zip file from a memory
+    mapping of the file."""
+
+    def __init__(self, zip_mmap, offset, size):
+        io.RawIOBase.__init__(self)
+        self._mmap = zip_mmap
+        self._start = offset
+        self._end = offset + size
+        self._pos = offset
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos - self._start
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos - self._start
+        elif whence == io.SEEK_END:
+            offset += self._end - self._start
+        self._pos = self._start + max(0, offset)
+        return self.tell()
+
+    def readinto(self, b):
+        size = max(0, min(len(b), self._end - self._pos))
+        b[:size] = self._mmap[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+
 class Bundle(object):
     """A Sugar activity, content module, etc.
 
@@ -69,6 +233,9 @@ class Bundle(object):
         self._path = path
         self._zip_root_dir = None
         self._zip_file = None
+        self._zip_members = None
+        self._zip_dirs = None
+        self._zip_mmap = None
         self._installation_time = os.stat(path).st_mtime
 
         if not os.path.isdir(self._path):
@@ -84,14 +251,14 @@ class Bundle(object):
             self._zip_file.close()
 
     def _check_zip_bundle(self):
-        file_names = self._zip_file.namelist()
-        if len(file_names) == 0:
+        infos = self._zip_file.infolist()
+        if len(infos) == 0:
             raise MalformedBundleException('Empty zip file')
 
-        if file_names[0] == 'mimetype':
-            del file_names[0]
+        if infos[0].filename == 'mimetype':
+            del infos[0]
 
-        self._zip_root_dir = file_names[0].split('/')[0]
+        self._zip_root_dir = infos[0].filename.split('/')[0]
         if self._zip_root_dir.startswith('.'):
             raise MalformedBundleException(
                 'root directory starts with .')
@@ -103,13 +270,56 @@ class Bundle(object):
                     'directory whose name ends with %r' %
                     self._unzipped_extension)
 
-        for file_name in file_names:
-            if not file_name.startswith(self._zip_root_dir):
+        # index the members by their path in the root directory, and
+        # the directories containing them
+        self._zip_members = {}
+        self._zip_dirs = set([''])
+        for info in infos:
+            root_dir, sep_, name = info.filename.partition('/')
+            if root_dir != self._zip_root_dir:
                 raise MalformedBundleException(
                     'All files in the bundle must be inside a single ' +
                     'top-level directory')
 
+            if name.endswith('/'):
+                parent = name[:-1]
+            else:
+                self._zip_members[name] = info
+                parent = name.rpartition('/')[0]
+            while parent not in self._zip_dirs:
+                self._zip_dirs.add(parent)
+                parent = parent.rpartition('/')[0]
+
+    def _get_zip_name(self, filename):
+        name = os.path.normpath(filename).replace(os.sep, '/').strip('/')
+        if name == '.':
+            return ''
+        return name
+
+    def _open_stored_member(self, info):
+        if self._zip_mmap is None:
+            with open(self._path, 'rb') as f:
+                self._zip_mmap = mmap.mmap(f.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+
+        offset = info.header_offset
+        header = _ZIP_FILE_HEADER.unpack(
+            self._zip_mmap[offset:offset + _ZIP_FILE_HEADER.size])
+        if header[0] != b'PK\003\004':
+            return None
+        offset += _ZIP_FILE_HEADER.size + header[9] + header[10]
+        if offset + info.file_size > len(self._zip_mmap):
+            return None
+        return io.BufferedReader(
+            _MmapReader(self._zip_mmap, offset, info.file_size))
+
     def get_file(self, filename):
+        """Open a file of the bundle for reading, or return None if it
+        does not exist.
+
+        The members of zip bundles are streamed, the ones stored
+        uncompressed are read from a memory mapping of the bundle.
+        """
         f = None
 
         if self._zip_file is None:
@@ -120,14 +330,18 @@ class Bundle(object):
                 logging.debug("cannot open path %s" % path)
                 return None
         else:
-            path = os.path.join(self._zip_root_dir, filename)
-            try:
-                data = self._zip_file.read(path)
-                f = six.BytesIO(data)
-            except KeyError:
-                logging.debug('%s not found in zip %s.' % (filename, path))
+            info = self._zip_members.get(self._get_zip_name(filename))
+            if info is None:
+                logging.debug('%s not found in zip %s.' %
+                              (filename, self._path))
                 return None
 
+            if info.compress_type == zipfile.ZIP_STORED and \
+                    not info.flag_bits & 0x1:
+                f = self._open_stored_member(info)
+            if f is None:
+                f = self._zip_file.open(info)
+
         return f
 
     def is_file(self, filename):
@@ -135,24 +349,14 @@ class Bundle(object):
             path = os.path.join(self._path, filename)
             return os.path.isfile(path)
         else:
-            path = os.path.join(self._zip_root_dir, filename)
-            try:
-                self._zip_file.getinfo(path)
-            except KeyError:
-                return False
-
-            return True
+            return self._get_zip_name(filename) in self._zip_members
 
     def is_dir(self, filename):
         if self._zip_file is None:
             path = os.path.join(self._path, filename)
             return os.path.isdir(path)
         else:
-            path = os.path.join(self._zip_root_dir, filename, "")
-            for f in self._zip_file.namelist():
-                if f.startswith(path):
-                    return True
-            return False
+            return self._get_zip_name(filename) in self._zip_dirs
 
     def get_path(self):
         """Get the bundle path."""
@@ -166,24 +370,52 @@ class Bundle(object):
     def get_show_launcher(self):
         return True
 
-    def _unzip(self, install_dir):
+    def _unzip(self, install_dir, workers=None):
+        """Extract the bundle into install_dir.
+
+        The bundle is extracted into a temporary directory next to its
+        final location, which is then renamed into place, replacing any
+        previous installation only once the extraction has succeeded.
+
+        workers -- number of threads extracting members, by default more
+                   than one is only used for bundles with many members
+        """
         if self._zip_file is None:
             raise AlreadyInstalledException
 
         if not os.path.isdir(install_dir):
             os.mkdir(install_dir, 0o775)
 
-        # zipfile provides API that in theory would let us do this
-        # correctly by hand, but handling all the oddities of
-        # Windows/UNIX mappings, extension attributes, deprecated
-        # features, etc makes it impractical.
-        if os.spawnlp(os.P_WAIT, 'unzip', 'unzip', '-o', self._path,
-                      '-x', 'mimetype', '-d', install_dir):
-            # clean up install dir after failure
-            shutil.rmtree(os.path.join(install_dir, self._zip_root_dir),
-                          ignore_errors=True)
-            # indicate failure.
-            raise ZipExtractException
+        members = [info for info in self._zip_file.infolist()
+                   if info.filename != 'mimetype']
+        if workers is None:
+            workers = 1
+            if len(members) > _PARALLEL_EXTRACT_THRESHOLD:
+                workers = _PARALLEL_EXTRACT_WORKERS
+
+        temp_dir = tempfile.mkdtemp(prefix='.' + self._zip_root_dir,
+                                    dir=install_dir)
+        try:
+            _extract_zip(self._path, members, temp_dir, workers)
+
+            bundle_path = os.path.join(install_dir, self._zip_root_dir)
+            old_path = None
+            if os.path.lexists(bundle_path):
+                old_path = os.path.join(temp_dir, '.old')
+                os.rename(bundle_path, old_path)
+            try:
+                os.rename(os.path.join(temp_dir, self._zip_root_dir),
+                          bundle_path)
+            except OSError:
+                if old_path is not None:
+                    os.rename(old_path, bundle_path)
+                raise
+        except (IOError, OSError, zipfile.BadZipfile, zlib.error,
+                RuntimeError, ValueError) as e:
+            logging.error('Error extracting %s: %s', self._path, e)
+            raise ZipExtractException(str(e))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
     def _zip(self, bundle_path):
         if self._zip_file is not None:
@@ -19,7 +19,7 @@ import os
 
 from gi.repository import Gio
 
-from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle.activitybundle import ActivityBundle, load_bundle
 from sugar3.bundle.contentbundle import ContentBundle
 
 
@@ -44,7 +44,7 @@ def bundle_from_dir(path):
     an unzipped bundle.
     """
     if os.path.exists(os.path.join(path, 'activity', 'activity.info')):
-        return ActivityBundle(path)
+        return load_bundle(path)
     elif os.path.exists(os.path.join(path, 'library', 'library.info')):
         return ContentBundle(path)
     return None
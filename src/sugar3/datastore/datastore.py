@@ -21,12 +21,16 @@ STABLE
 """
 
 import six
+import atexit
+import itertools
 import logging
 import time
 from datetime import datetime
 import os
 import tempfile
+import weakref
 from gi.repository import GObject
+from gi.repository import GLib
 from gi.repository import Gio
 import dbus
 
@@ -34,12 +38,65 @@ from sugar3 import env
 from sugar3 import mime
 from sugar3 import dispatch
 from sugar3.profile import get_color
+from sugar3.util import LRU
+from sugar3.util import SizedLRU
+from sugar3.util import TempFilePath
 
 DS_DBUS_SERVICE = 'org.laptop.sugar.DataStore'
 DS_DBUS_INTERFACE = 'org.laptop.sugar.DataStore'
 DS_DBUS_PATH = '/org/laptop/sugar/DataStore'
 
+# Upper bound of object ids requested from the datastore in a single call
+_GET_MANY_BATCH_SIZE = 100
+# Number of entries fetched per call by iter_find()
+_FIND_PAGE_SIZE = 100
+# Delay in milliseconds during which successive queue_write() calls for
+# the same DSObject are merged into a single write
+_WRITE_COALESCE_DELAY = 500
+# Budget in bytes for the metadata kept in the process-wide cache
+_METADATA_CACHE_SIZE = 4 * 1024 * 1024
+# Number of entry files kept around to hand out links to
+_FILE_CACHE_SIZE = 20
+
 _data_store = None
+_pending_fetches = {}
+_pending_fetches_sid = None
+_live_objects = {}
+_queued_writes = {}
+_writes_in_flight = set()
+_last_written = weakref.WeakKeyDictionary()
+# (object_id, mtime) -> TempFilePath of a file retrieved from the datastore
+_file_cache = LRU(_FILE_CACHE_SIZE)
+# directory -> private directory of the links created in it
+_link_dirs = {}
+_link_counter = itertools.count()
+
+
+def _get_metadata_size(properties):
+    size = 0
+    for key, value in properties.items():
+        size += len(key)
+        if isinstance(value, (six.binary_type, six.text_type)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+
+_metadata_cache = SizedLRU(_METADATA_CACHE_SIZE, _get_metadata_size)
+
+# Binary properties that are only fetched on first access when they are
+# explicitly requested in a properties list
+_LAZY_PROPERTIES = ['preview']
+
+# Properties fetched when listing entries with properties=LISTED_PROPERTIES,
+# the other ones, like 'preview', are fetched with the whole entry on first
+# use
+LISTED_PROPERTIES = ['uid', 'activity', 'activity_id', 'title',
+                     'title_set_by_user', 'keep', 'ctime', 'mtime',
+                     'timestamp', 'icon-color', 'mime_type', 'share-scope',
+                     'buddies', 'description', 'tags', 'filesize',
+                     'mountpoint']
 
 
 def _get_data_store():
@@ -58,19 +115,284 @@ def _get_data_store():
 
 
 def __datastore_created_cb(object_id):
-    metadata = _get_data_store().get_properties(object_id, byte_arrays=True)
+    _fetch_properties_later(object_id, __send_created)
+
+
+def __send_created(object_id, metadata):
+    _cache_metadata(object_id, metadata)
     created.send(None, object_id=object_id, metadata=metadata)
 
 
 def __datastore_updated_cb(object_id):
-    metadata = _get_data_store().get_properties(object_id, byte_arrays=True)
+    _forget_metadata(object_id)
+    _forget_cached_files(object_id)
+    _fetch_properties_later(object_id, __send_updated)
+
+
+def __send_updated(object_id, metadata):
+    properties = _cache_metadata(object_id, metadata)
+    for ds_object in list(_live_objects.get(object_id, [])):
+        if ds_object.object_id == object_id and \
+                ds_object._metadata is not None:
+            ds_object._metadata.update(properties)
     updated.send(None, object_id=object_id, metadata=metadata)
 
 
 def __datastore_deleted_cb(object_id):
+    _forget_metadata(object_id)
+    _forget_cached_files(object_id)
     deleted.send(None, object_id=object_id)
 
 
+def _normalize_properties(properties):
+    if six.PY3:
+        for x, y in list(properties.items()):
+            if x in _LAZY_PROPERTIES or isinstance(y, _LazyBlob):
+                # binary data, don't attempt to decode (and copy) it
+                continue
+            try:
+                properties[x] = y.decode()
+            except BaseException:
+                pass
+
+    default_keys = ['activity', 'activity_id',
+                    'mime_type', 'title_set_by_user']
+    for key in default_keys:
+        if key not in properties:
+            properties[key] = ''
+
+    return properties
+
+
+def _cache_metadata(object_id, properties):
+    """Store a copy of the properties of object_id in the metadata cache.
+
+    Cached dictionaries are shared between DSMetadata instances and must
+    never be modified in place, the normalized copy is returned.
+    """
+    properties = _normalize_properties(dict(properties))
+    _metadata_cache[object_id] = properties
+    return properties
+
+
+def _forget_metadata(object_id):
+    if object_id in _metadata_cache:
+        del _metadata_cache[object_id]
+
+
+def _get_cached_metadata(object_id):
+    """Return a DSMetadata sharing the cached properties of object_id,
+    or None if they are not cached.
+    """
+    properties = _metadata_cache.get(object_id)
+    if properties is None:
+        return None
+    return DSMetadata._new_shared(properties)
+
+
+def _track_object(object_id, ds_object):
+    if object_id not in _live_objects:
+        _live_objects[object_id] = weakref.WeakSet()
+    _live_objects[object_id].add(ds_object)
+
+
+def _untrack_object(object_id, ds_object):
+    objects = _live_objects.get(object_id)
+    if objects is None:
+        return
+    objects.discard(ds_object)
+    if not objects:
+        del _live_objects[object_id]
+
+
+class _LazyBlob(object):
+    """Placeholder for a binary property that has not been fetched yet."""
+
+    __slots__ = ['_object_id', '_key', '_data', '_fetched']
+
+    def __init__(self, object_id, key):
+        self._object_id = object_id
+        self._key = key
+        self._data = None
+        self._fetched = False
+
+    def get_data(self):
+        """Return the data of the property, or None if the entry does not
+        have it."""
+        if not self._fetched:
+            entries = _find_by_ids([self._object_id], [self._key])
+            entry = entries.get(str(self._object_id), {})
+            self._data = entry.get(self._key)
+            self._fetched = True
+        return self._data
+
+
+def _split_lazy_properties(properties):
+    """Return the properties to request from the datastore and the ones
+    to be replaced by lazy placeholders.
+    """
+    if not properties:
+        return properties, []
+    eager = [key for key in properties if key not in _LAZY_PROPERTIES]
+    lazy = [key for key in properties if key in _LAZY_PROPERTIES]
+    if lazy and not eager:
+        # an empty list would request every property
+        eager = ['uid']
+    return eager, lazy
+
+
+def _add_lazy_properties(object_id, entry, lazy_keys):
+    for key in lazy_keys:
+        entry[key] = _LazyBlob(object_id, key)
+    return entry
+
+
+def _remove_link_dir(link_dir):
+    try:
+        os.rmdir(link_dir)
+    except OSError:
+        # links still in use are left behind
+        pass
+
+
+def _new_link_path(dir_path, prefix):
+    """Return a new path in the private directory of the process in
+    dir_path, creating the directory on first use.
+    """
+    link_dir = _link_dirs.get(dir_path)
+    if link_dir is None or not os.path.isdir(link_dir):
+        link_dir = tempfile.mkdtemp(prefix='dsobject-links-', dir=dir_path)
+        atexit.register(_remove_link_dir, link_dir)
+        _link_dirs[dir_path] = link_dir
+    return os.path.join(link_dir, '%s%d' % (prefix, next(_link_counter)))
+
+
+def _link_file(file_path):
+    """Create a new read-only hardlink to file_path in a directory next
+    to it and return its path, or None if the file system does not
+    support it.
+
+    The link shares its content, and its permissions, with file_path and
+    the copies the datastore made of it.
+    """
+    try:
+        link_path = _new_link_path(os.path.dirname(file_path), 'dsobject')
+        os.link(file_path, link_path)
+    except OSError:
+        logging.debug('Cannot link %s, falling back to a copy', file_path)
+        return None
+
+    try:
+        # writing to the link would change the entry in the datastore
+        os.chmod(link_path, 0o444)
+    except OSError:
+        logging.debug('Cannot make %s read-only', link_path)
+    return link_path
+
+
+def _forget_cached_files(object_id):
+    for cached_key in _file_cache.keys():
+        if cached_key[0] == object_id:
+            del _file_cache[cached_key]
+
+
+def _get_cached_file(object_id, mtime):
+    """Return the path of a file with the content of object_id, retrieving
+    it from the datastore only if that version is not cached yet.
+    """
+    key = (object_id, mtime)
+    if key in _file_cache:
+        file_path = _file_cache[key]
+        if os.path.exists(file_path):
+            return file_path
+
+    _forget_cached_files(object_id)
+
+    file_path = _get_data_store().get_filename(object_id)
+    if not file_path:
+        return None
+    _file_cache[key] = TempFilePath(file_path)
+    return _file_cache[key]
+
+
+def _link_cached_file(object_id, mtime):
+    file_path = _get_cached_file(object_id, mtime)
+    if file_path is None:
+        return None
+    return _link_file(file_path)
+
+
+def _split_batches(object_ids):
+    for i in range(0, len(object_ids), _GET_MANY_BATCH_SIZE):
+        yield object_ids[i:i + _GET_MANY_BATCH_SIZE]
+
+
+def _find_by_ids(object_ids, properties, reply_handler=None,
+                 error_handler=None):
+    """Fetch the properties of several entries with a single find() call.
+
+    The result is a dictionary mapping each object id found in the
+    datastore to its properties; entries that do not exist are left out.
+    """
+    query = {'uid': [str(object_id) for object_id in object_ids],
+             'limit': len(object_ids)}
+    if properties and 'uid' not in properties:
+        properties = list(properties) + ['uid']
+
+    def index_entries(entries):
+        return dict((str(entry['uid']), entry) for entry in entries)
+
+    def find_reply_handler_cb(entries, total_count_):
+        reply_handler(index_entries(entries))
+
+    if reply_handler and error_handler:
+        _get_data_store().find(query, properties or [],
+                               reply_handler=find_reply_handler_cb,
+                               error_handler=error_handler,
+                               byte_arrays=True)
+        return
+
+    entries, total_count_ = _get_data_store().find(query, properties or [],
+                                                   byte_arrays=True)
+    return index_entries(entries)
+
+
+def _fetch_properties_later(object_id, callback):
+    """Queue a properties fetch for object_id, to be run from an idle.
+
+    Every fetch queued before the main loop gets idle again is sent to the
+    datastore as part of the same batch, callback is then invoked with the
+    object id and its properties.
+    """
+    global _pending_fetches_sid
+
+    _pending_fetches.setdefault(object_id, []).append(callback)
+    if _pending_fetches_sid is None:
+        _pending_fetches_sid = GLib.idle_add(_flush_pending_fetches)
+
+
+def _flush_pending_fetches():
+    global _pending_fetches_sid
+
+    _pending_fetches_sid = None
+    pending = _pending_fetches.copy()
+    _pending_fetches.clear()
+
+    def reply_handler_cb(metadata_by_id):
+        for object_id, metadata in metadata_by_id.items():
+            for callback in pending.get(object_id, []):
+                callback(object_id, metadata)
+
+    def error_handler_cb(error):
+        logging.error('Could not fetch datastore entries: %s', error)
+
+    for batch in _split_batches(list(pending.keys())):
+        _find_by_ids(batch, None, reply_handler=reply_handler_cb,
+                     error_handler=error_handler_cb)
+
+    return False
+
+
 created = dispatch.Signal()
 deleted = dispatch.Signal()
 updated = dispatch.Signal()
@@ -84,25 +406,75 @@ class DSMetadata(GObject.GObject):
 
     def __init__(self, properties=None):
         GObject.GObject.__init__(self)
+        # True while _properties is a dictionary of the metadata cache,
+        # which gets copied before the first modification
+        self._shared = False
+        # Object id of an entry listed with LISTED_PROPERTIES only, whose
+        # other properties are fetched on first use
+        self._partial_id = None
         if not properties:
-            self._properties = {}
-        else:
-            if six.PY3:
-                for x, y in list(properties.items()):
-                    try:
-                        properties[x] = y.decode()
-                    except BaseException:
-                        pass
-            self._properties = properties
-
-        default_keys = ['activity', 'activity_id',
-                        'mime_type', 'title_set_by_user']
-        for key in default_keys:
-            if key not in self._properties:
-                self._properties[key] = ''
+            properties = {}
+        self._properties = _normalize_properties(properties)
+
+    @classmethod
+    def _new_shared(cls, properties):
+        metadata = cls()
+        metadata._properties = properties
+        metadata._shared = True
+        return metadata
+
+    @classmethod
+    def _new_partial(cls, object_id, properties):
+        metadata = cls(properties)
+        metadata._partial_id = object_id
+        return metadata
+
+    def _unshare(self):
+        if self._shared:
+            self._properties = self._properties.copy()
+            self._shared = False
+
+    def _complete(self, key=None):
+        """Fetch the whole entry of partial metadata, if key may be one
+        of the properties that were not listed."""
+        if self._partial_id is None or key in LISTED_PROPERTIES or \
+                key in self._properties:
+            return
+        object_id = self._partial_id
+        self._partial_id = None
+
+        properties = _get_data_store().get_properties(object_id,
+                                                      byte_arrays=True)
+        properties = dict(_cache_metadata(object_id, properties))
+        # keep the values set since the entry was listed
+        for name, value in self._properties.items():
+            if not isinstance(value, _LazyBlob):
+                properties[name] = value
+        self._properties = properties
+        self._shared = False
+
+    def _resolve(self, key):
+        value = self._properties[key]
+        if isinstance(value, _LazyBlob):
+            value = value.get_data()
+            self._unshare()
+            if value is None:
+                del self._properties[key]
+                raise KeyError(key)
+            self._properties[key] = value
+        return value
 
     def __getitem__(self, key):
-        return self._properties[key]
+        self._complete(key)
+        return self._resolve(key)
+
+    def _load_lazy_properties(self):
+        self._complete()
+        for key in list(self._properties.keys()):
+            try:
+                self._resolve(key)
+            except KeyError:
+                pass
 
     def __setitem__(self, key, value):
         if six.PY3:
@@ -111,31 +483,55 @@ class DSMetadata(GObject.GObject):
             except BaseException:
                 pass
         if key not in self._properties or self._properties[key] != value:
+            self._unshare()
             self._properties[key] = value
             self.emit('updated')
 
     def __delitem__(self, key):
+        self._complete(key)
+        self._unshare()
         del self._properties[key]
 
     def __contains__(self, key):
-        return self._properties.__contains__(key)
+        self._complete(key)
+        if key not in self._properties:
+            return False
+        try:
+            self._resolve(key)
+        except KeyError:
+            return False
+        return True
 
     def has_key(self, key):
         logging.warning(".has_key() is deprecated, use 'in'")
-        return key in self._properties
+        return key in self
 
     def keys(self):
+        self._load_lazy_properties()
         return list(self._properties.keys())
 
     def get_dictionary(self):
+        self._unshare()
+        self._load_lazy_properties()
         return self._properties
 
+    def get_memoryview(self, key):
+        """Return a memoryview on a binary property, without copying it.
+
+        Lazy properties are fetched from the datastore on the first call.
+        """
+        value = self[key]
+        if isinstance(value, six.text_type):
+            value = value.encode('utf-8')
+        return memoryview(value)
+
     def copy(self):
+        self._load_lazy_properties()
         return DSMetadata(self._properties.copy())
 
     def get(self, key, default=None):
-        if key in self._properties:
-            return self._properties[key]
+        if key in self:
+            return self[key]
         else:
             return default
 
@@ -149,8 +545,10 @@ class DSObject(object):
     """A representation of a DS entry."""
 
     def __init__(self, object_id, metadata=None, file_path=None):
-        self._update_signal_match = None
         self._object_id = None
+        # Incremented on every change of the object id, so that the reply
+        # of a create sent before a detach does not restore the id
+        self._id_generation = 0
 
         self.set_object_id(object_id)
 
@@ -163,25 +561,26 @@ class DSObject(object):
         return self._object_id
 
     def set_object_id(self, object_id):
-        if self._update_signal_match is not None:
-            self._update_signal_match.remove()
+        if self._object_id is not None:
+            _untrack_object(self._object_id, self)
         if object_id is not None:
-            self._update_signal_match = _get_data_store().connect_to_signal(
-                'Updated', self.__object_updated_cb, arg0=object_id)
+            # Updates are dispatched by the module-level Updated handler
+            _get_data_store()
+            _track_object(object_id, self)
 
         self._object_id = object_id
+        self._id_generation += 1
 
     object_id = property(get_object_id, set_object_id)
 
-    def __object_updated_cb(self, object_id):
-        properties = _get_data_store().get_properties(self._object_id,
-                                                      byte_arrays=True)
-        self._metadata.update(properties)
-
     def get_metadata(self):
         if self._metadata is None and self.object_id is not None:
-            properties = _get_data_store().get_properties(self.object_id)
-            metadata = DSMetadata(properties)
+            metadata = _get_cached_metadata(self.object_id)
+            if metadata is None:
+                properties = _get_data_store().get_properties(
+                    self.object_id, byte_arrays=True)
+                metadata = DSMetadata._new_shared(
+                    _cache_metadata(self.object_id, properties))
             self._metadata = metadata
         return self._metadata
 
@@ -191,12 +590,50 @@ class DSObject(object):
 
     metadata = property(get_metadata, set_metadata)
 
-    def get_file_path(self, fetch=True):
+    def get_file_path(self, fetch=True, shared=False):
+        """Return the path of the file of the entry.
+
+        Keyword arguments:
+        fetch -- retrieve the file from the datastore if there is no local
+                 copy yet (default True)
+        shared -- instead of having the datastore copy the file, hand out
+                  a hardlink to a copy cached by the process for the
+                  current mtime of the entry. The file shares its content
+                  with other DSObjects and with the entry itself, so it is
+                  made read-only, and must not be made writable or
+                  written to (default False)
+
+        """
         if fetch and self._file_path is None and self.object_id is not None:
-            self.set_file_path(_get_data_store().get_filename(self.object_id))
+            file_path = None
+            mtime = self.metadata.get('mtime')
+            if shared and mtime:
+                file_path = _link_cached_file(self.object_id, mtime)
+            if file_path is None:
+                file_path = _get_data_store().get_filename(self.object_id)
+            self.set_file_path(file_path)
             self._owns_file = True
         return self._file_path
 
+    def open_file(self):
+        """Open the file of the entry read-only, without copying it.
+
+        The entry file is retrieved once per mtime and shared by every
+        DSObject of the process.
+
+        Return: a binary file object, or None if the entry has no file
+
+        """
+        file_path = self._file_path
+        mtime = self.metadata.get('mtime')
+        if file_path is None and self.object_id is not None and mtime:
+            file_path = _get_cached_file(self.object_id, mtime)
+        if file_path is None:
+            file_path = self.get_file_path()
+        if not file_path:
+            return None
+        return open(file_path, 'rb')
+
     def set_file_path(self, file_path):
         if self._file_path != file_path:
             if self._file_path and self._owns_file:
@@ -263,10 +700,9 @@ class RawObject(object):
         # and w/o this, it wouldn't work since we have file from mounted device
         if self._file_path is None:
             data_path = os.path.join(env.get_profile_path(), 'data')
-            self._file_path = tempfile.mktemp(
-                prefix='rawobject', dir=data_path)
             if not os.path.exists(data_path):
                 os.makedirs(data_path)
+            self._file_path = _new_link_path(data_path, 'rawobject')
             os.symlink(self.object_id, self._file_path)
         return self._file_path
 
@@ -303,11 +739,109 @@ def get(object_id):
     if object_id.startswith('/'):
         return RawObject(object_id)
 
-    metadata = _get_data_store().get_properties(object_id, byte_arrays=True)
+    metadata = _get_cached_metadata(object_id)
+    if metadata is None:
+        properties = _get_data_store().get_properties(object_id,
+                                                      byte_arrays=True)
+        metadata = DSMetadata._new_shared(
+            _cache_metadata(object_id, properties))
+
+    return DSObject(object_id, metadata, None)
+
+
+def get_many(object_ids, properties=None, reply_handler=None,
+             error_handler=None):
+    """Get the properties of several objects at once.
+
+    The ids are sent to the datastore in batches, each batch costing a
+    single round trip instead of one per object.
+
+    Keyword arguments:
+    object_ids -- list of unique identifiers of the objects
+    properties -- you can specify here a list of metadata you want to be
+                  present in the result e.g. ['title, 'keep'] (default None)
+                  binary properties like 'preview' are only fetched when
+                  first accessed, with LISTED_PROPERTIES only the common
+                  properties are fetched, the other ones are fetched with
+                  the whole entry when first accessed
+    reply_handler -- if given together with error_handler, all the batches
+                     are requested at once and reply_handler is called
+                     with the list of DSObjects of every batch as soon as
+                     it arrives (default None)
+    error_handler -- will be called with an instance of a DBusException
+                     representing a remote exception (default None)
+
+    Return: a list of DSObjects in the order of object_ids, None for the
+    objects that do not exist
 
-    ds_object = DSObject(object_id, DSMetadata(metadata), None)
-    # TODO: register the object for updates
-    return ds_object
+    """
+    logging.debug('datastore.get_many')
+
+    object_ids = list(object_ids)
+
+    request_properties, lazy_keys, partial = \
+        _get_listing_properties(properties)
+
+    def build_objects(batch, cached, metadata_by_id):
+        ds_objects = []
+        for object_id in batch:
+            if object_id.startswith('/'):
+                ds_objects.append(RawObject(object_id))
+            elif object_id in cached:
+                ds_objects.append(DSObject(object_id, cached[object_id],
+                                           None))
+            elif object_id in metadata_by_id:
+                if partial:
+                    metadata = DSMetadata._new_partial(
+                        object_id, metadata_by_id[object_id])
+                else:
+                    metadata = DSMetadata(_add_lazy_properties(
+                        object_id, metadata_by_id[object_id], lazy_keys))
+                ds_objects.append(DSObject(object_id, metadata, None))
+            else:
+                ds_objects.append(None)
+        return ds_objects
+
+    def get_cached(batch):
+        # Only full metadata can be served from the cache
+        cached = {}
+        if not properties or partial:
+            for object_id in batch:
+                metadata = _get_cached_metadata(object_id)
+                if metadata is not None:
+                    cached[object_id] = metadata
+        return cached
+
+    def ds_ids(batch, cached):
+        return [object_id for object_id in batch
+                if not object_id.startswith('/') and
+                object_id not in cached]
+
+    def batch_reply_handler(batch, cached):
+        def batch_reply_handler_cb(metadata_by_id):
+            reply_handler(build_objects(batch, cached, metadata_by_id))
+        return batch_reply_handler_cb
+
+    if reply_handler and error_handler:
+        for batch in _split_batches(object_ids):
+            cached = get_cached(batch)
+            if not ds_ids(batch, cached):
+                reply_handler(build_objects(batch, cached, {}))
+                continue
+            _find_by_ids(ds_ids(batch, cached), request_properties,
+                         reply_handler=batch_reply_handler(batch, cached),
+                         error_handler=error_handler)
+        return
+
+    ds_objects = []
+    for batch in _split_batches(object_ids):
+        cached = get_cached(batch)
+        metadata_by_id = {}
+        if ds_ids(batch, cached):
+            metadata_by_id = _find_by_ids(ds_ids(batch, cached),
+                                          request_properties)
+        ds_objects.extend(build_objects(batch, cached, metadata_by_id))
+    return ds_objects
 
 
 def create():
@@ -340,7 +874,15 @@ def _update_ds_entry(uid, properties, filename, transfer_ownership=False,
                                  filename, transfer_ownership)
 
 
-def _create_ds_entry(properties, filename, transfer_ownership=False):
+def _create_ds_entry(properties, filename, transfer_ownership=False,
+                     reply_handler=None, error_handler=None, timeout=-1):
+    if reply_handler and error_handler:
+        _get_data_store().create(dbus.Dictionary(properties), filename,
+                                 transfer_ownership,
+                                 reply_handler=reply_handler,
+                                 error_handler=error_handler,
+                                 timeout=timeout)
+        return
     object_id = _get_data_store().create(dbus.Dictionary(properties), filename,
                                          transfer_ownership)
     return object_id
@@ -351,14 +893,23 @@ def write(ds_object, update_mtime=True, transfer_ownership=False,
     """Write the DSObject given to the datastore. Creates a new entry if
     the entry does not exist yet.
 
+    The file of ds_object is copied, or moved if transfer_ownership is
+    set, into the entry. When ds_object has no file path, only the
+    metadata of an existing entry is updated and its file is kept as it
+    is, which lets callers that did not change the content skip sending
+    the file.
+
     Keyword arguments:
     update_mtime -- boolean if the mtime of the entry should be regenerated
                     (default True)
     transfer_ownership -- set it to true if the ownership of the entry should
                           be passed - who is responsible to delete the file
                           when done with it (default False)
-    reply_handler -- will be called with the method's return values as
-                     arguments (default None)
+    reply_handler -- will be called without arguments once the entry has
+                     been written, for creates the object id of ds_object
+                     is set at that point, unless the object id was
+                     changed in the meantime, e.g. set to None to detach
+                     ds_object from the entry being created (default None)
     error_handler -- will be called with an instance of a DBusException
                      representing a remote exception (default None)
     timeout -- dbus timeout for the caller to wait (default -1)
@@ -376,27 +927,177 @@ def write(ds_object, update_mtime=True, transfer_ownership=False,
     if file_path is None:
         file_path = ''
 
-    # FIXME: this func will be sync for creates regardless of the handlers
-    # supplied. This is very bad API, need to decide what to do here.
-    if ds_object.object_id:
-        _update_ds_entry(ds_object.object_id,
+    id_generation = ds_object._id_generation
+
+    def created_cb(object_id):
+        if ds_object._id_generation == id_generation:
+            ds_object.object_id = object_id
+            ds_object.metadata['uid'] = object_id
+        else:
+            logging.debug('Object detached while creating %s', object_id)
+        logging.debug('Written object %s to the datastore.', object_id)
+        reply_handler()
+
+    object_id = ds_object.object_id
+
+    def updated_cb():
+        # the cache may have been refilled while the update was sent
+        _forget_metadata(object_id)
+        reply_handler()
+
+    if object_id:
+        # the cached metadata is stale once the entry is written, the
+        # Updated signal only drops it on a later main loop iteration
+        _forget_metadata(object_id)
+        _update_ds_entry(object_id,
                          properties,
                          file_path,
                          transfer_ownership,
-                         reply_handler=reply_handler,
+                         reply_handler=reply_handler and updated_cb,
+                         error_handler=error_handler,
+                         timeout=timeout)
+    elif reply_handler and error_handler:
+        _create_ds_entry(properties, file_path, transfer_ownership,
+                         reply_handler=created_cb,
                          error_handler=error_handler,
                          timeout=timeout)
+        return
     else:
-        if reply_handler or error_handler:
-            logging.warning('datastore.write() cannot currently be called'
-                            'async for creates, see ticket 3071')
         ds_object.object_id = _create_ds_entry(properties, file_path,
                                                transfer_ownership)
         ds_object.metadata['uid'] = ds_object.object_id
-        # TODO: register the object for updates
     logging.debug('Written object %s to the datastore.', ds_object.object_id)
 
 
+class _QueuedWrite(object):
+    """The merged state of the queue_write() calls for a DSObject that
+    have not been sent to the datastore yet.
+    """
+
+    def __init__(self, ds_object):
+        self.ds_object = ds_object
+        self.update_mtime = False
+        self.owned_files = set()
+        self.timeout = -1
+        self.reply_handlers = []
+        self.error_handlers = []
+        self.sid = None
+
+    def merge(self, update_mtime, transfer_ownership, reply_handler,
+              error_handler, timeout):
+        self.update_mtime = self.update_mtime or update_mtime
+        file_path = self.ds_object.get_file_path(fetch=False)
+        if transfer_ownership and file_path:
+            self.owned_files.add(file_path)
+        if timeout != -1:
+            self.timeout = timeout
+        if reply_handler and error_handler:
+            self.reply_handlers.append(reply_handler)
+            self.error_handlers.append(error_handler)
+
+    def schedule(self):
+        if self.sid is None:
+            self.sid = GLib.timeout_add(_WRITE_COALESCE_DELAY,
+                                        self.__timeout_cb)
+
+    def __timeout_cb(self):
+        self.sid = None
+        if self.ds_object in _writes_in_flight:
+            # sent once the previous write of this object completes
+            return False
+
+        del _queued_writes[self.ds_object]
+        self._send()
+        return False
+
+    def _get_snapshot(self):
+        properties = self.ds_object.metadata.get_dictionary().copy()
+        properties.pop('mtime', None)
+        properties.pop('timestamp', None)
+        file_path = self.ds_object.get_file_path(fetch=False)
+        # the same path is rewritten in place by some activities
+        file_stamp = None
+        if file_path:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                pass
+            else:
+                file_stamp = (stat.st_ino, stat.st_size, stat.st_mtime)
+        return properties, file_path, file_stamp
+
+    def _send(self):
+        ds_object = self.ds_object
+        snapshot = self._get_snapshot()
+        file_path = snapshot[1]
+
+        # files handed over by superseded writes are never sent, so they
+        # are still ours to delete
+        for path in self.owned_files - set([file_path]):
+            if os.path.isfile(path):
+                os.remove(path)
+
+        if ds_object.object_id and _last_written.get(ds_object) == snapshot:
+            logging.debug('Skipping write of unchanged object %s',
+                          ds_object.object_id)
+            for handler in self.reply_handlers:
+                handler()
+            return
+
+        _writes_in_flight.add(ds_object)
+        write(ds_object, update_mtime=self.update_mtime,
+              transfer_ownership=file_path in self.owned_files,
+              reply_handler=lambda: self.__reply_handler_cb(snapshot),
+              error_handler=self.__error_handler_cb,
+              timeout=self.timeout)
+
+    def _finish(self):
+        _writes_in_flight.discard(self.ds_object)
+        queued_write = _queued_writes.get(self.ds_object)
+        if queued_write is not None:
+            queued_write.schedule()
+
+    def __reply_handler_cb(self, snapshot):
+        _last_written[self.ds_object] = snapshot
+        self._finish()
+        for handler in self.reply_handlers:
+            handler()
+
+    def __error_handler_cb(self, error):
+        self._finish()
+        if not self.error_handlers:
+            logging.error('Could not write object %s: %s',
+                          self.ds_object.object_id, error)
+        for handler in self.error_handlers:
+            handler(error)
+
+
+def queue_write(ds_object, update_mtime=True, transfer_ownership=False,
+                reply_handler=None, error_handler=None, timeout=-1):
+    """Queue an asynchronous write of the DSObject given to the datastore.
+
+    Calls made for the same DSObject within a short delay are merged into
+    a single write of its latest state, and a write that would not change
+    the metadata or the file of an entry is skipped altogether. A write
+    queued while the previous one of the same object is still being
+    processed is sent once it completes.
+
+    The keyword arguments are the ones of write(), the handlers of all the
+    merged calls are invoked when the write completes.
+
+    """
+    logging.debug('datastore.queue_write')
+
+    queued_write = _queued_writes.get(ds_object)
+    if queued_write is None:
+        queued_write = _QueuedWrite(ds_object)
+        _queued_writes[ds_object] = queued_write
+    queued_write.merge(update_mtime, transfer_ownership, reply_handler,
+                       error_handler, timeout)
+    if ds_object not in _writes_in_flight:
+        queued_write.schedule()
+
+
 def delete(object_id):
     """Delete the datastore entry with the given uid.
 
@@ -436,6 +1137,11 @@ def find(query, sorting=None, limit=None, offset=None, properties=None,
     offset -- return only results starting at offset (default None)
     properties -- you can specify here a list of metadata you want to be
                   present in the result e.g. ['title, 'keep'] (default None)
+                  when called synchronously, binary properties like
+                  'preview' are only fetched when first accessed, with
+                  LISTED_PROPERTIES only the common properties are
+                  fetched, the other ones are fetched with the whole entry
+                  when first accessed
     reply_handler -- will be called with the method's return values as
                      arguments (default None)
     error_handler -- will be called with an instance of a DBusException
@@ -463,17 +1169,143 @@ def find(query, sorting=None, limit=None, offset=None, properties=None,
                                byte_arrays=True)
         return
     else:
+        properties, lazy_keys, partial = _get_listing_properties(properties)
         entries, total_count = _get_data_store().find(query, properties,
                                                       byte_arrays=True)
+
+    return _entries_to_objects(entries, lazy_keys, partial), total_count
+
+
+def _get_listing_properties(properties):
+    """Return the properties to request when listing entries, the ones
+    to be replaced by lazy placeholders, and whether the metadata of the
+    entries is partial."""
+    if properties is LISTED_PROPERTIES:
+        return LISTED_PROPERTIES, [], True
+    if not properties:
+        # an empty list requests every property
+        return [], [], False
+    eager, lazy = _split_lazy_properties(properties)
+    return eager, lazy, False
+
+
+def _entries_to_objects(entries, lazy_keys=(), partial=False):
     ds_objects = []
     for entry in entries:
         object_id = entry['uid']
         del entry['uid']
+        _add_lazy_properties(object_id, entry, lazy_keys)
+
+        if partial:
+            metadata = DSMetadata._new_partial(object_id, entry)
+        else:
+            metadata = DSMetadata(entry)
+        ds_objects.append(DSObject(object_id, metadata, None))
+
+    return ds_objects
 
-        ds_object = DSObject(object_id, DSMetadata(entry), None)
-        ds_objects.append(ds_object)
 
-    return ds_objects, total_count
+def iter_find(query, sorting=None, page_size=_FIND_PAGE_SIZE,
+              properties=None):
+    """Iterate over the DS entries that match the query provided.
+
+    Unlike find(), results are fetched in pages of page_size entries using
+    the limit and offset query keys, so only one page is held in memory at
+    a time. When called from the main loop, the next page is requested
+    asynchronously while the current one is being consumed; if it has not
+    arrived when it is needed, because the caller does not return to the
+    main loop between pages, the page is fetched synchronously instead and
+    the following pages are not requested in advance. The main loop is
+    never iterated from the caller.
+
+    Keyword arguments:
+    query -- a dictionary containing metadata key value pairs, see find()
+             a limit or offset in it bounds the whole iteration, a limit
+             of 0 yields no entries
+    sorting -- key to order results by e.g. 'timestamp' (default None)
+    page_size -- number of entries fetched per call (default 100)
+    properties -- you can specify here a list of metadata you want to be
+                  present in the result e.g. ['title, 'keep'] (default None)
+                  binary properties like 'preview' are only fetched when
+                  first accessed, with LISTED_PROPERTIES only the common
+                  properties are fetched, the other ones are fetched with
+                  the whole entry when first accessed
+
+    Return: a generator of DSObjects matching the query
+
+    """
+    query = query.copy()
+
+    properties, lazy_keys, partial = _get_listing_properties(properties)
+
+    if sorting:
+        query['order_by'] = sorting
+    offset = query.pop('offset', None) or 0
+    limit = query.pop('limit', None)
+    if limit == 0:
+        return
+    end = None if limit is None else offset + limit
+
+    def get_page_query(page_offset):
+        page_query = query.copy()
+        page_query['offset'] = page_offset
+        page_query['limit'] = page_size
+        if end is not None:
+            page_query['limit'] = min(page_size, end - page_offset)
+        return page_query
+
+    def request_page(page_offset):
+        page = {'offset': page_offset}
+
+        def reply_handler_cb(entries, total_count):
+            page['entries'] = entries
+            page['total_count'] = total_count
+
+        def error_handler_cb(error):
+            page['error'] = error
+
+        _get_data_store().find(get_page_query(page_offset), properties,
+                               reply_handler=reply_handler_cb,
+                               error_handler=error_handler_cb,
+                               byte_arrays=True)
+        return page
+
+    def fetch_page(page_offset):
+        return _get_data_store().find(get_page_query(page_offset),
+                                      properties, byte_arrays=True)
+
+    # replies can only arrive if the main loop runs between pages
+    prefetch = GLib.main_depth() > 0
+
+    def wait_page(page):
+        if 'error' in page:
+            raise page['error']
+        return page['entries'], page['total_count']
+
+    entries, total_count = fetch_page(offset)
+    if end is None or end > total_count:
+        end = total_count
+
+    while entries:
+        offset += len(entries)
+        next_page = None
+        if prefetch and offset < end:
+            next_page = request_page(offset)
+
+        for ds_object in _entries_to_objects(entries, lazy_keys, partial):
+            yield ds_object
+        entries = None
+
+        if next_page is not None and \
+                ('entries' in next_page or 'error' in next_page):
+            entries, total_count_ = wait_page(next_page)
+        elif offset < end:
+            if next_page is not None:
+                # the caller does not return to the main loop, fetching
+                # pages twice would only slow it down
+                logging.debug('iter_find: page not prefetched in time')
+                prefetch = False
+            entries, total_count_ = fetch_page(offset)
 
 
 def copy(ds_object, mount_point):
@@ -502,9 +1334,20 @@ def copy(ds_object, mount_point):
         new_ds_object.metadata['suggested_filename'] = filename
 
     # this will cause the file be retrieved from the DS
-    new_ds_object.file_path = ds_object.file_path
-
-    write(new_ds_object)
+    file_path = ds_object.get_file_path(shared=True)
+    new_ds_object.file_path = file_path
+
+    # hand a link over to the datastore, which then moves it in place
+    # instead of copying the whole file once more
+    link_path = None
+    if file_path:
+        link_path = _link_file(file_path)
+    if link_path is not None:
+        new_ds_object.file_path = link_path
+        write(new_ds_object, transfer_ownership=True)
+        new_ds_object.file_path = file_path
+    else:
+        write(new_ds_object)
 
     return new_ds_object
 
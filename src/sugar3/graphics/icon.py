@@ -92,6 +92,10 @@ import re
 import math
 import logging
 import os
+import mmap
+import struct
+import hashlib
+import tempfile
 
 from six.moves.configparser import ConfigParser
 
@@ -106,38 +110,214 @@ from gi.repository import GdkPixbuf
 from gi.repository import Rsvg
 import cairo
 
+from sugar3 import env
 from sugar3.graphics import style
 from sugar3.graphics.xocolor import XoColor
 from sugar3.util import LRU
+from sugar3.util import SizedLRU
 
 _BADGE_SIZE = 0.45
+# Budget in bytes of SVG data for the parsed handles kept by _SVGLoader
+_HANDLE_CACHE_SIZE = 4 * 1024 * 1024
+# Budget in bytes of the rendered surfaces kept in memory, can be
+# overridden in KiB with the SUGAR_ICON_CACHE_SIZE environment variable
+_SURFACE_CACHE_SIZE = 8 * 1024 * 1024
+# Bump when the rendering or the raster format changes, to discard the
+# rasters stored by previous versions
+_RASTER_STORE_VERSION = 2
+# Number of rasters stored on disk above which the least recently used
+# ones are pruned
+_RASTER_STORE_MAX_FILES = 2000
+
+_ENTITY_RE = re.compile(r'<!ENTITY\s+(\S+)\s[^>]*>')
+
+
+class _SVGTemplate(object):
+    '''
+    An SVG icon split around its entity declarations, so recoloring it
+    only joins slices instead of searching the whole text again.
+    '''
+
+    def __init__(self, icon):
+        self._chunks = []
+        self._declarations = []
+
+        position = 0
+        for match in _ENTITY_RE.finditer(icon):
+            self._chunks.append(icon[position:match.start()])
+            self._declarations.append((match.group(1), match.group(0)))
+            position = match.end()
+        self._chunks.append(icon[position:])
+
+    def render(self, entities):
+        parts = [self._chunks[0]]
+        for (entity, xml), chunk in zip(self._declarations, self._chunks[1:]):
+            if entity in entities:
+                xml = '<!ENTITY %s "%s">' % (entity, entities[entity])
+            parts.append(xml)
+            parts.append(chunk)
+        return ''.join(parts)
 
 
 class _SVGLoader(object):
 
     def __init__(self):
         self._cache = LRU(100)
+        self._handle_cache = SizedLRU(_HANDLE_CACHE_SIZE,
+                                      lambda entry: entry[1])
 
-    def load(self, file_name, entities, cache):
+    def _get_template(self, file_name, cache):
         if file_name in self._cache:
-            icon = self._cache[file_name]
-        else:
-            icon_file = open(file_name, 'r')
-            icon = icon_file.read()
-            icon_file.close()
+            return self._cache[file_name]
+
+        with open(file_name, 'r') as icon_file:
+            template = _SVGTemplate(icon_file.read())
 
-            if cache:
-                self._cache[file_name] = icon
+        if cache:
+            self._cache[file_name] = template
+        return template
 
+    def load(self, file_name, entities, cache):
+        valid_entities = {}
         for entity, value in list(entities.items()):
             if isinstance(value, six.string_types):
-                xml = '<!ENTITY %s "%s">' % (entity, value)
-                icon = re.sub('<!ENTITY %s .*>' % entity, xml, icon)
+                valid_entities[entity] = value
             else:
                 logging.error(
                     'Icon %s, entity %s is invalid.', file_name, entity)
 
-        return Rsvg.Handle.new_from_data(icon.encode('utf-8'))
+        key = (file_name, tuple(sorted(valid_entities.items())))
+        if key in self._handle_cache:
+            return self._handle_cache[key][0]
+
+        template = self._get_template(file_name, cache)
+        data = template.render(valid_entities).encode('utf-8')
+        handle = Rsvg.Handle.new_from_data(data)
+
+        if cache:
+            self._handle_cache[key] = (handle, len(data))
+        return handle
+
+
+def _get_surface_cache_size():
+    try:
+        return int(os.environ['SUGAR_ICON_CACHE_SIZE']) * 1024
+    except (KeyError, ValueError):
+        return _SURFACE_CACHE_SIZE
+
+
+def _get_surface_size(surface):
+    return surface.get_stride() * surface.get_height()
+
+
+class _RasterStore(object):
+    '''
+    Rendered icons stored as raw cairo image data in a directory, so that
+    processes sharing it, and later launches, only rasterize each icon
+    once. The files are mapped copy-on-write and wrapped in surfaces
+    without copying them.
+    '''
+
+    _MAGIC = b'SICN'
+    _HEADER = struct.Struct('<4s5i')
+    # Keep the image data aligned for cairo
+    _HEADER_SIZE = 64
+    # Number of stores between two checks of the number of files
+    _PRUNE_INTERVAL = 100
+
+    def __init__(self, path):
+        self._path = path
+        self._stores_count = 0
+
+    def _get_file_path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self._path, digest)
+
+    def lookup(self, key):
+        try:
+            with open(self._get_file_path(key), 'rb') as raster_file:
+                data = mmap.mmap(raster_file.fileno(), 0,
+                                 access=mmap.ACCESS_COPY)
+        except (IOError, OSError, ValueError):
+            return None
+
+        try:
+            magic, version_, image_format, width, height, stride = \
+                self._HEADER.unpack_from(data)
+            if magic != self._MAGIC or \
+                    len(data) != self._HEADER_SIZE + stride * height:
+                return None
+            return cairo.ImageSurface.create_for_data(
+                memoryview(data)[self._HEADER_SIZE:], image_format, width,
+                height, stride)
+        except (struct.error, cairo.Error, ValueError):
+            logging.warning('Ignoring invalid icon raster for %s', key)
+            return None
+
+    def store(self, key, surface):
+        surface.flush()
+        header = self._HEADER.pack(self._MAGIC, 0, surface.get_format(),
+                                   surface.get_width(), surface.get_height(),
+                                   surface.get_stride())
+        header = header.ljust(self._HEADER_SIZE, b'\0')
+
+        try:
+            if not os.path.isdir(self._path):
+                os.makedirs(self._path)
+            fd, temp_path = tempfile.mkstemp(dir=self._path)
+            with os.fdopen(fd, 'wb') as raster_file:
+                raster_file.write(header)
+                raster_file.write(surface.get_data())
+            os.rename(temp_path, self._get_file_path(key))
+        except (IOError, OSError):
+            logging.exception('Cannot store icon raster for %s', key)
+            return
+
+        if self._stores_count % self._PRUNE_INTERVAL == 0:
+            self._prune()
+        self._stores_count += 1
+
+    def _prune(self):
+        try:
+            names = os.listdir(self._path)
+            if len(names) <= _RASTER_STORE_MAX_FILES:
+                return
+
+            paths = [os.path.join(self._path, name) for name in names]
+            paths.sort(key=self._get_last_use)
+            for path in paths[:len(paths) - _RASTER_STORE_MAX_FILES // 2]:
+                os.remove(path)
+        except OSError:
+            logging.exception('Cannot prune icon rasters in %s', self._path)
+
+    def _get_last_use(self, path):
+        # Reads update the access time, which may be disabled or only
+        # updated daily by the mount options, stores update the mtime
+        stat = os.stat(path)
+        return max(stat.st_atime, stat.st_mtime)
+
+
+_raster_store = None
+
+
+def _get_raster_store():
+    '''
+    Return the store of rendered icons, or None if it is disabled. The
+    rasters are stored in the icon-cache directory of the profile, the
+    SUGAR_ICON_SHARED_CACHE environment variable overrides it, or
+    disables the store when set to an empty string.
+    '''
+    global _raster_store
+
+    if _raster_store is None:
+        base = os.environ.get('SUGAR_ICON_SHARED_CACHE')
+        if base is None:
+            base = env.get_profile_path('icon-cache')
+        elif not base:
+            return None
+        _raster_store = _RasterStore(
+            os.path.join(base, str(_RASTER_STORE_VERSION)))
+    return _raster_store
 
 
 class _IconInfo(object):
@@ -159,8 +339,13 @@ class _BadgeInfo(object):
 
 class _IconBuffer(object):
 
-    _surface_cache = LRU(100)
+    _surface_cache = SizedLRU(_get_surface_cache_size(), _get_surface_size)
     _loader = _SVGLoader()
+    _theme_watched = False
+    # (icon_name, size) -> (file_name, attach_x, attach_y) for the theme
+    _icon_info_cache = LRU(500)
+    # (badge_name, size) -> file_name for the theme
+    _badge_file_cache = LRU(100)
 
     def __init__(self):
         self.icon_name = None
@@ -224,38 +409,58 @@ class _IconBuffer(object):
 
         return attach_x, attach_y
 
+    def _lookup_icon(self, icon_name, size):
+        key = (icon_name, size)
+        if key in self._icon_info_cache:
+            return self._icon_info_cache[key]
+
+        theme = Gtk.IconTheme.get_default()
+        info = theme.lookup_icon(icon_name, size, 0)
+        if info:
+            attach_x, attach_y = self._get_attach_points(info, size)
+            result = (info.get_filename(), attach_x, attach_y)
+            del info
+        else:
+            logging.warning('No icon with the name %s was found in the '
+                            'theme.', icon_name)
+            result = (None, 0, 0)
+
+        self._icon_info_cache[key] = result
+        return result
+
     def _get_icon_info(self, file_name, icon_name):
         icon_info = _IconInfo()
 
         if file_name:
             icon_info.file_name = file_name
         elif icon_name:
-            theme = Gtk.IconTheme.get_default()
-
             size = 50
             if self.width is not None:
                 size = self.width
 
-            info = theme.lookup_icon(icon_name, int(size), 0)
-            if info:
-                attach_x, attach_y = self._get_attach_points(info, size)
-
-                icon_info.file_name = info.get_filename()
-                icon_info.attach_x = attach_x
-                icon_info.attach_y = attach_y
-
-                del info
-            else:
-                logging.warning('No icon with the name %s was found in the '
-                                'theme.', icon_name)
+            icon_info.file_name, icon_info.attach_x, icon_info.attach_y = \
+                self._lookup_icon(icon_name, int(size))
 
         return icon_info
 
-    def _draw_badge(self, context, size, sensitive, widget):
+    def _lookup_badge_file_name(self, size):
+        key = (self.badge_name, size)
+        if key in self._badge_file_cache:
+            return self._badge_file_cache[key]
+
         theme = Gtk.IconTheme.get_default()
-        badge_info = theme.lookup_icon(self.badge_name, int(size), 0)
+        badge_info = theme.lookup_icon(self.badge_name, size, 0)
+        badge_file_name = None
         if badge_info:
             badge_file_name = badge_info.get_filename()
+            del badge_info
+
+        self._badge_file_cache[key] = badge_file_name
+        return badge_file_name
+
+    def _draw_badge(self, context, size, sensitive, widget):
+        badge_file_name = self._lookup_badge_file_name(int(size))
+        if badge_file_name:
             if badge_file_name.endswith('.svg'):
                 handle = self._loader.load(badge_file_name, {}, self.cache)
 
@@ -340,10 +545,74 @@ class _IconBuffer(object):
 
         return pixbuf
 
+    @classmethod
+    def _watch_theme(cls):
+        if cls._theme_watched:
+            return
+        theme = Gtk.IconTheme.get_default()
+        if theme is not None:
+            theme.connect('changed', cls.__theme_changed_cb)
+            cls._theme_watched = True
+
+    @classmethod
+    def __theme_changed_cb(cls, theme):
+        # Names may resolve to other files now, stored rasters are keyed
+        # by file and stay valid
+        cls._surface_cache.clear()
+        cls._icon_info_cache = LRU(500)
+        cls._badge_file_cache = LRU(100)
+
+    def _get_raster_key(self, sensitive, widget):
+        # Pixbufs set by the caller cannot be identified across processes
+        if self.pixbuf is not None:
+            return None
+        # Insensitive renders depend on the style of the widget, without
+        # one they are the same as the sensitive render
+        if not sensitive and widget and widget.get_style():
+            return None
+
+        icon_info = self._get_icon_info(self.file_name, self.icon_name)
+        if icon_info.file_name is None:
+            return None
+        try:
+            mtime = os.stat(icon_info.file_name).st_mtime
+        except OSError:
+            return None
+
+        # Badges depend on the themes
+        themes = None
+        settings = Gtk.Settings.get_default()
+        if settings is not None:
+            themes = (settings.props.gtk_theme_name,
+                      settings.props.gtk_icon_theme_name)
+
+        if self.background_color is None:
+            color = None
+        else:
+            color = (self.background_color.red, self.background_color.green,
+                     self.background_color.blue)
+
+        return repr((icon_info.file_name, mtime, self.fill_color,
+                     self.stroke_color, self.badge_name, self.width,
+                     self.height, color, themes))
+
     def get_surface(self, sensitive=True, widget=None):
+        self._watch_theme()
+
         cache_key = self._get_cache_key(sensitive)
-        if cache_key in self._surface_cache:
-            return self._surface_cache[cache_key]
+        surface = self._surface_cache.get(cache_key)
+        if surface is not None:
+            return surface
+
+        raster_store = _get_raster_store()
+        raster_key = None
+        if raster_store is not None:
+            raster_key = self._get_raster_key(sensitive, widget)
+        if raster_key is not None:
+            surface = raster_store.lookup(raster_key)
+            if surface is not None:
+                self._surface_cache[cache_key] = surface
+                return surface
 
         if self.pixbuf:
             # We alredy have the pixbuf for this icon.
@@ -428,6 +697,8 @@ class _IconBuffer(object):
             self._draw_badge(context, badge_info.size, sensitive, widget)
 
         self._surface_cache[cache_key] = surface
+        if raster_key is not None:
+            raster_store.store(raster_key, surface)
 
         return surface
 
@@ -1438,6 +1709,19 @@ def get_icon_file_name(icon_name):
     return filename
 
 
+def get_surface_cache_stats():
+    '''
+    Get the usage counters of the cache of rendered icons shared by every
+    icon of the process.
+
+    Returns:
+        dict, with the number of `entries`, their total `size` and the
+        `max_size` budget in bytes, and the `hits`, `misses` and
+        `evictions` counters
+    '''
+    return _IconBuffer._surface_cache.get_stats()
+
+
 def get_surface(**kwargs):
     '''
     Get cairo surface of the icon.  Supports the same arguments as
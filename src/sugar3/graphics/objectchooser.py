@@ -28,9 +28,12 @@ from gi.repository import Gtk
 from gi.repository import Gdk
 import dbus
 
-from sugar3.datastore import datastore
+from sugar3 import util
 from sugar3.activity.activity import PREVIEW_SIZE
 
+# only needed once an object has been chosen
+datastore = util.LazyModule('sugar3.datastore.datastore')
+
 
 J_DBUS_SERVICE = 'org.laptop.Journal'
 J_DBUS_INTERFACE = 'org.laptop.Journal'
@@ -19,10 +19,14 @@
 STABLE.
 """
 
+import io
 import os
+import re
+import time
+import errno
+import hashlib
 import threading
 from six.moves import urllib
-import fcntl
 import tempfile
 
 from gi.repository import GObject
@@ -33,6 +37,8 @@ from six.moves import socketserver
 
 __authinfos = {}
 
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
 
 def _add_authinfo(authinfo):
     __authinfos[threading.currentThread()] = authinfo
@@ -61,7 +67,15 @@ class GlibTCPServer(socketserver.TCPServer):
         self.socket.setblocking(0)  # Set nonblocking
 
         # Watch the listener socket for data
-        GLib.io_add_watch(self.socket, GLib.IO_IN, self._handle_accept)
+        self._watch_id = GLib.io_add_watch(self.socket, GLib.IO_IN,
+                                           self._handle_accept)
+
+    def server_close(self):
+        """Stop watching and close the listener socket."""
+        if self._watch_id:
+            GLib.source_remove(self._watch_id)
+            self._watch_id = 0
+        socketserver.TCPServer.server_close(self)
 
     def _handle_accept(self, source, condition):
         """Process incoming data on the server's socket by doing an accept()
@@ -83,17 +97,57 @@ class GlibTCPServer(socketserver.TCPServer):
         pass
 
 
+def _parse_range(value, size):
+    """Parse the value of a Range header for a file of the given size.
+
+    Returns the start and end offsets of the range, end excluded, or None
+    if the whole file should be sent. Raises ValueError if the range is
+    not satisfiable.
+    """
+    match = _RANGE_RE.match(value.replace(' ', ''))
+    if match is None:
+        # several ranges or other units, serving the whole file is allowed
+        return None
+
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        start = max(0, size - int(last))
+        end = size
+    else:
+        start = int(first)
+        end = size
+        if last:
+            end = min(int(last) + 1, size)
+    if start >= end:
+        raise ValueError('Unsatisfiable range %s' % value)
+    return start, end
+
+
 class ChunkedGlibHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
     """RequestHandler class that integrates with Glib mainloop.  It writes
        the specified file to the client in chunks, returning control to the
        mainloop between chunks.
+
+       Chunks are sent with sendfile() when it is available, their size
+       grows from CHUNK_SIZE to MAX_CHUNK_SIZE while the client keeps up,
+       and is bounded so that every client served by the main loop gets
+       its turn. Single byte ranges are supported, to resume transfers.
     """
 
     CHUNK_SIZE = 4096
+    MAX_CHUNK_SIZE = 1024 * 1024
+
+    _use_sendfile = hasattr(os, 'sendfile')
 
     def __init__(self, request, client_address, server):
         self._file = None
         self._srcid = 0
+        self._offset = 0
+        self._end = None
+        self._chunk_size = self.CHUNK_SIZE
+        self._buffer = b''
         SimpleHTTPServer.SimpleHTTPRequestHandler.__init__(
             self, request, client_address, server)
 
@@ -104,26 +158,76 @@ class ChunkedGlibHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
         """Serve a GET request."""
         self._file = self.send_head()
         if self._file:
-            self._srcid = GLib.io_add_watch(self.wfile, GLib.IO_OUT |
-                                            GLib.IO_ERR,
+            if self._end is None:
+                # a directory listing
+                self._file.seek(0, io.SEEK_END)
+                self._end = self._file.tell()
+                self._file.seek(0)
+            self.wfile.flush()
+            self.request.setblocking(0)
+            self._srcid = GLib.io_add_watch(self.request.fileno(),
+                                            GLib.IO_OUT | GLib.IO_ERR |
+                                            GLib.IO_HUP,
                                             self._send_next_chunk)
         else:
-            self._cleanup()
+            # the response is flushed once we return
+            GLib.idle_add(self._cleanup)
 
     def _send_next_chunk(self, source, condition):
-        if condition & GLib.IO_ERR:
+        if condition & (GLib.IO_ERR | GLib.IO_HUP):
             self._cleanup()
             return False
         if not (condition & GLib.IO_OUT):
             self._cleanup()
             return False
-        data = self._file.read(self.CHUNK_SIZE)
-        count = os.write(self.wfile.fileno(), data)
-        if count != len(data) or len(data) != self.CHUNK_SIZE:
+
+        count = min(self._chunk_size, self._end - self._offset)
+        try:
+            sent = self._send(count)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return True
+            self._cleanup()
+            return False
+
+        if sent == 0 and count > 0:
+            # the file is shorter than announced
+            self._cleanup()
+            return False
+        self._offset += sent
+
+        if sent == count:
+            self._chunk_size = min(self._chunk_size * 2,
+                                   self.MAX_CHUNK_SIZE)
+        else:
+            # the socket buffer is full, the client is slower than us
+            self._chunk_size = max(self._chunk_size // 2, self.CHUNK_SIZE)
+
+        if self._offset >= self._end:
             self._cleanup()
             return False
         return True
 
+    def _send(self, count):
+        fd = self.request.fileno()
+        if self._use_sendfile and not self._buffer:
+            try:
+                file_fd = self._file.fileno()
+            except (AttributeError, io.UnsupportedOperation):
+                pass
+            else:
+                return os.sendfile(fd, file_fd, self._offset, count)
+
+        # keep what the socket did not take for the next round
+        if not self._buffer:
+            self._file.seek(self._offset)
+            self._buffer = self._file.read(count)
+            if not self._buffer:
+                return 0
+        sent = os.write(fd, self._buffer[:count])
+        self._buffer = self._buffer[sent:]
+        return sent
+
     def _cleanup(self):
         if self._file:
             self._file.close()
@@ -135,6 +239,7 @@ class ChunkedGlibHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
             self.wfile.flush()
         self.wfile.close()
         self.rfile.close()
+        self.request.close()
 
     def finish(self):
         """Close the sockets when we're done, not before"""
@@ -175,9 +280,31 @@ class ChunkedGlibHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
         except IOError:
             self.send_error(404, 'File not found')
             return None
-        self.send_response(200)
+
+        size = os.fstat(f.fileno())[6]
+        byte_range = None
+        if self.headers.get('Range'):
+            try:
+                byte_range = _parse_range(self.headers.get('Range'), size)
+            except ValueError:
+                f.close()
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % size)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+
+        if byte_range is None:
+            self._offset, self._end = 0, size
+            self.send_response(200)
+        else:
+            self._offset, self._end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (self._offset, self._end - 1, size))
         self.send_header('Content-type', ctype)
-        self.send_header('Content-Length', str(os.fstat(f.fileno())[6]))
+        self.send_header('Content-Length', str(self._end - self._offset))
+        self.send_header('Accept-Ranges', 'bytes')
         self.send_header('Content-Disposition', 'attachment; filename="%s"' %
                          os.path.basename(path))
         self.end_headers()
@@ -185,7 +312,12 @@ class ChunkedGlibHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
 
 
 class GlibURLDownloader(GObject.GObject):
-    """Grabs a URL in chunks, returning to the mainloop after each chunk"""
+    """Downloads a URL in a thread, reporting to the mainloop.
+
+    The connection and the transfer do not block the mainloop, the
+    'progress' signal is emitted at most every PROGRESS_INTERVAL seconds,
+    and all the signals are emitted from the mainloop.
+    """
 
     __gsignals__ = {
         'finished': (GObject.SignalFlags.RUN_FIRST, None,
@@ -196,14 +328,18 @@ class GlibURLDownloader(GObject.GObject):
                      ([GObject.TYPE_PYOBJECT])),
     }
 
-    CHUNK_SIZE = 4096
+    CHUNK_SIZE = 64 * 1024
+    MAX_CHUNK_SIZE = 1024 * 1024
+    PROGRESS_INTERVAL = 0.2
 
     def __init__(self, url, destdir=None):
         self._url = url
         if not destdir:
             destdir = tempfile.gettempdir()
         self._destdir = destdir
-        self._srcid = 0
+        self._thread = None
+        self._cancelled = False
+        self._remove_on_cancel = True
         self._fname = None
         self._outf = None
         self._suggested_fname = None
@@ -211,42 +347,41 @@ class GlibURLDownloader(GObject.GObject):
         self._written = 0
         GObject.GObject.__init__(self)
 
-    def start(self, destfile=None, destfd=None):
-        self._info = urllib.request.urlopen(self._url)
-        self._outf = None
-        self._fname = None
+    def start(self, destfile=None, destfd=None, resume=False, checksum=None):
+        """Start the download.
+
+        Keyword arguments:
+        destfile -- path of the downloaded file, a temporary file in destdir
+            is used by default
+        destfd -- file descriptor of destfile, if it is already open
+        resume -- continue from the end of destfile if it exists, using a
+            Range request, instead of downloading again
+        checksum -- tuple of a hashlib algorithm name and the expected
+            hexadecimal digest of the file, checked while downloading
+        """
         if destfd and not destfile:
             raise ValueError('Must provide destination file too when'
                              ' specifying file descriptor')
-        if destfile:
-            self._suggested_fname = os.path.basename(destfile)
-            self._fname = os.path.abspath(os.path.expanduser(destfile))
-            if destfd:
-                # Use the user-supplied destination file descriptor
-                self._outf = destfd
-            else:
-                self._outf = os.open(self._fname, os.O_RDWR |
-                                     os.O_TRUNC | os.O_CREAT, 0o644)
-        else:
-            fname = self._get_filename_from_headers(self._info.headers)
-            self._suggested_fname = fname
-            garbage_, path = urllib.parse.splittype(self._url)
-            garbage_, path = urllib.parse.splithost(path or "")
-            path, garbage_ = urllib.parse.splitquery(path or "")
-            path, garbage_ = urllib.parse.splitattr(path or "")
-            suffix = os.path.splitext(path)[1]
-            (self._outf, self._fname) = tempfile.mkstemp(suffix=suffix,
-                                                         dir=self._destdir)
-
-        fcntl.fcntl(self._info.fp.fileno(), fcntl.F_SETFD, os.O_NDELAY)
-        self._srcid = GLib.io_add_watch(self._info.fp.fileno(),
-                                        GLib.IO_IN | GLib.IO_ERR,
-                                        self._read_next_chunk)
+        if resume and not destfile:
+            raise ValueError('Must provide destination file to resume')
+        if checksum is not None:
+            # fail early on unknown algorithms
+            hashlib.new(checksum[0])
 
-    def cancel(self):
-        if self._srcid == 0:
+        self._cancelled = False
+        self._written = 0
+        self._thread = threading.Thread(
+            target=self._download, args=(destfile, destfd, resume, checksum))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def cancel(self, remove=True):
+        """Stop the download, removing the downloaded file unless remove is
+        False, so that it can be resumed later."""
+        if self._thread is None or self._cancelled:
             raise RuntimeError('Download already canceled or stopped')
-        self.cleanup(remove=True)
+        self._cancelled = True
+        self._remove_on_cancel = remove
 
     def _get_filename_from_headers(self, headers):
         if 'Content-Disposition' not in headers:
@@ -264,46 +399,135 @@ class GlibURLDownloader(GObject.GObject):
             fname = fname[:len(fname) - 1]
         return fname
 
-    def _read_next_chunk(self, source, condition):
-        if condition & GLib.IO_ERR:
-            self.cleanup(remove=True)
-            self.emit('error', 'Error downloading file.')
-            return False
-        elif not (condition & GLib.IO_IN):
-            # shouldn't get here, but...
-            return True
+    def _open_url(self, offset):
+        request = urllib.request.Request(self._url)
+        if offset:
+            request.add_header('Range', 'bytes=%d-' % offset)
+        try:
+            return urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if offset and e.code == 416:
+                # nothing left to download
+                return None
+            raise
+
+    def _open_destination(self, destfile, destfd, resume):
+        offset = 0
+        if destfile:
+            self._suggested_fname = os.path.basename(destfile)
+            self._fname = os.path.abspath(os.path.expanduser(destfile))
+            if destfd:
+                # Use the user-supplied destination file descriptor
+                self._outf = destfd
+            else:
+                flags = os.O_RDWR | os.O_CREAT
+                if not resume:
+                    flags |= os.O_TRUNC
+                self._outf = os.open(self._fname, flags, 0o644)
+            if resume:
+                offset = os.fstat(self._outf).st_size
+
+        self._info = self._open_url(offset)
 
+        if not destfile:
+            fname = self._get_filename_from_headers(self._info.headers)
+            self._suggested_fname = fname
+            path = urllib.parse.urlparse(self._url).path
+            suffix = os.path.splitext(path)[1]
+            (self._outf, self._fname) = tempfile.mkstemp(suffix=suffix,
+                                                         dir=self._destdir)
+        elif self._info is not None and offset and \
+                self._info.getcode() != 206:
+            # the server ignored the range, start over
+            os.ftruncate(self._outf, 0)
+            offset = 0
+
+        os.lseek(self._outf, offset, os.SEEK_SET)
+        return offset
+
+    def _hash_destination(self, hasher, size):
+        os.lseek(self._outf, 0, os.SEEK_SET)
+        while size > 0:
+            data = os.read(self._outf, min(size, self.MAX_CHUNK_SIZE))
+            if not data:
+                break
+            hasher.update(data)
+            size -= len(data)
+
+    def _download(self, destfile, destfd, resume, checksum):
         try:
-            data = self._info.fp.read(self.CHUNK_SIZE)
-            count = os.write(self._outf, data)
+            offset = self._open_destination(destfile, destfd, resume)
+            self._written = offset
+
+            hasher = None
+            if checksum is not None:
+                hasher = hashlib.new(checksum[0])
+                self._hash_destination(hasher, offset)
+
+            if self._info is not None:
+                self._receive(hasher)
+                if self._cancelled:
+                    self.cleanup(remove=self._remove_on_cancel)
+                    return
+
+            if hasher is not None and \
+                    hasher.hexdigest() != checksum[1].lower():
+                self.cleanup(remove=True)
+                GLib.idle_add(self.emit, 'error',
+                              'Checksum mismatch of downloaded file.')
+                return
+        except Exception as err:
+            self.cleanup(remove=not resume)
+            GLib.idle_add(self.emit, 'error',
+                          'Error downloading file: %r' % err)
+            return
+
+        self.cleanup()
+        GLib.idle_add(self.emit, 'progress', self._written)
+        GLib.idle_add(self.emit, 'finished', self._fname,
+                      self._suggested_fname)
+
+    def _receive(self, hasher):
+        expected = self._info.headers.get('Content-Length')
+        if expected is not None:
+            expected = self._written + int(expected)
+
+        # read what is available, instead of waiting for a full chunk
+        read = getattr(self._info, 'read1', self._info.read)
+        chunk_size = self.CHUNK_SIZE
+        last_progress = time.time()
+        while not self._cancelled:
+            data = read(chunk_size)
+            if not data:
+                break
+
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._outf, view):]
             self._written += len(data)
+            if hasher is not None:
+                hasher.update(data)
 
-            # error writing data to file?
-            if count < len(data):
-                self.cleanup(remove=True)
-                self.emit('error', 'Error writing to download file.')
-                return False
+            if len(data) == chunk_size:
+                chunk_size = min(chunk_size * 2, self.MAX_CHUNK_SIZE)
 
-            self.emit('progress', self._written)
+            now = time.time()
+            if now - last_progress >= self.PROGRESS_INTERVAL:
+                last_progress = now
+                GLib.idle_add(self.emit, 'progress', self._written)
 
-            # done?
-            if len(data) < self.CHUNK_SIZE:
-                self.cleanup()
-                self.emit('finished', self._fname, self._suggested_fname)
-                return False
-        except Exception as err:
-            self.cleanup(remove=True)
-            self.emit('error', 'Error downloading file: %r' % err)
-            return False
-        return True
+        if not self._cancelled and expected is not None and \
+                self._written < expected:
+            raise IOError('Connection closed after %d of %d bytes' %
+                          (self._written, expected))
 
     def cleanup(self, remove=False):
-        if self._srcid > 0:
-            GLib.source_remove(self._srcid)
-            self._srcid = 0
-        del self._info
+        if self._info is not None:
+            self._info.close()
         self._info = None
-        os.close(self._outf)
-        if remove:
+        if self._outf is not None:
+            os.close(self._outf)
+            self._outf = None
+        if remove and self._fname is not None and \
+                os.path.exists(self._fname):
             os.remove(self._fname)
-        self._outf = None
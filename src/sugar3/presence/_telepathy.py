@@ -0,0 +1,48 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""The Telepathy constants used by the presence modules and activities
+
+These are the values of the TelepathyGLib constants, loading its typelib
+only for them would slow down the start of every activity.
+"""
+
+ACCOUNT_MANAGER_SERVICE = 'org.freedesktop.Telepathy.AccountManager'
+ACCOUNT_MANAGER_PATH = '/org/freedesktop/Telepathy/AccountManager'
+ACCOUNT_MANAGER = 'org.freedesktop.Telepathy.AccountManager'
+ACCOUNT = 'org.freedesktop.Telepathy.Account'
+
+CHANNEL = 'org.freedesktop.Telepathy.Channel'
+CHANNEL_INTERFACE_GROUP = 'org.freedesktop.Telepathy.Channel.Interface.Group'
+CONN_INTERFACE_ROOM_CONFIG = \
+    'org.freedesktop.Telepathy.Channel.Interface.RoomConfig1'
+CHANNEL_TYPE_TUBES = 'org.freedesktop.Telepathy.Channel.Type.Tubes'
+CHANNEL_TYPE_TEXT = 'org.freedesktop.Telepathy.Channel.Type.Text'
+CLIENT = 'org.freedesktop.Telepathy.Client'
+CLIENT_HANDLER = 'org.freedesktop.Telepathy.Client.Handler'
+CONNECTION = 'org.freedesktop.Telepathy.Connection'
+CONNECTION_INTERFACE_ALIASING = \
+    'org.freedesktop.Telepathy.Connection.Interface.Aliasing'
+CONNECTION_INTERFACE_CONTACTS = \
+    'org.freedesktop.Telepathy.Connection.Interface.Contacts'
+PROPERTIES_INTERFACE = 'org.freedesktop.Telepathy.Properties'
+
+CHANNEL_GROUP_FLAG_CHANNEL_SPECIFIC_HANDLES = 256
+CONNECTION_STATUS_CONNECTED = 0
+HANDLE_TYPE_CONTACT = 1
+HANDLE_TYPE_ROOM = 2
+PROPERTY_FLAG_WRITE = 2
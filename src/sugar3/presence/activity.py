@@ -25,29 +25,15 @@ import six
 import logging
 from functools import partial
 
-import gi
-gi.require_version('TelepathyGLib', '0.12')
 import dbus
 from dbus import PROPERTIES_IFACE
 from gi.repository import GObject
-from gi.repository import TelepathyGLib
 
-from sugar3.presence.buddy import Buddy
-
-CHANNEL = TelepathyGLib.IFACE_CHANNEL
-CHANNEL_INTERFACE_GROUP = TelepathyGLib.IFACE_CHANNEL_INTERFACE_GROUP
-CONN_INTERFACE_ROOM_CONFIG = \
-    TelepathyGLib.IFACE_CHANNEL_INTERFACE_ROOM_CONFIG
-CHANNEL_TYPE_TUBES = TelepathyGLib.IFACE_CHANNEL_TYPE_TUBES
-CHANNEL_TYPE_TEXT = TelepathyGLib.IFACE_CHANNEL_TYPE_TEXT
-CONNECTION = TelepathyGLib.IFACE_CONNECTION
-PROPERTIES_INTERFACE = TelepathyGLib.IFACE_PROPERTIES_INTERFACE
-
-CHANNEL_GROUP_FLAG_CHANNEL_SPECIFIC_HANDLES = \
-    TelepathyGLib.ChannelGroupFlags.CHANNEL_SPECIFIC_HANDLES
-HANDLE_TYPE_CONTACT = TelepathyGLib.HandleType.CONTACT
-HANDLE_TYPE_ROOM = TelepathyGLib.HandleType.ROOM
-PROPERTY_FLAG_WRITE = TelepathyGLib.PropertyFlags.WRITE
+from sugar3.presence._telepathy import CHANNEL, CHANNEL_INTERFACE_GROUP, \
+    CONN_INTERFACE_ROOM_CONFIG, CHANNEL_TYPE_TUBES, CHANNEL_TYPE_TEXT, \
+    CONNECTION, PROPERTIES_INTERFACE, \
+    CHANNEL_GROUP_FLAG_CHANNEL_SPECIFIC_HANDLES, HANDLE_TYPE_CONTACT, \
+    HANDLE_TYPE_ROOM, PROPERTY_FLAG_WRITE
 
 CONN_INTERFACE_ACTIVITY_PROPERTIES = 'org.laptop.Telepathy.ActivityProperties'
 CONN_INTERFACE_BUDDY_INFO = 'org.laptop.Telepathy.BuddyInfo'
@@ -279,8 +265,14 @@ class Activity(GObject.GObject):
         if not self._joined:
             raise RuntimeError('Cannot invite a buddy to an activity that is'
                                'not shared.')
+        contact_handle = buddy.contact_handle
+        if contact_handle is None:
+            # the buddy has just been created and is still being resolved
+            contact_handle = self.telepathy_conn.RequestHandles(
+                HANDLE_TYPE_CONTACT, [buddy.contact_id],
+                dbus_interface=CONNECTION)[0]
         self.telepathy_text_chan[CHANNEL].AddMembers(
-            [buddy.contact_handle], message,
+            [contact_handle], message,
             dbus_interface=CHANNEL_INTERFACE_GROUP,
             reply_handler=partial(
                 self.__invite_cb, response_cb),
@@ -332,7 +324,7 @@ class Activity(GObject.GObject):
         def get_handle_owners_cb(handles):
             self.telepathy_conn.InspectHandles(
                 HANDLE_TYPE_CONTACT, handles,
-                reply_handler=reply_cb,
+                reply_handler=partial(reply_cb, handles=handles),
                 error_handler=self.__error_handler_cb,
                 dbus_interface=CONNECTION)
 
@@ -346,11 +338,13 @@ class Activity(GObject.GObject):
         else:
             get_handle_owners_cb(input_handles)
 
-    def _add_initial_buddies(self, contact_ids):
+    def _add_initial_buddies(self, contact_ids, handles):
         _logger.debug('__add_initial_buddies %r' % contact_ids)
-        for contact_id in contact_ids:
-            self._buddies[contact_id] = self._get_buddy(contact_id)
-            self._joined_buddies[contact_id] = self._get_buddy(contact_id)
+        # the buddies fetch their properties in a single batch
+        for contact_id, handle in zip(contact_ids, handles):
+            buddy = self._get_buddy(contact_id, handle)
+            self._buddies[contact_id] = buddy
+            self._joined_buddies[contact_id] = buddy
         # Once we have the initial members, we can finish the join process
         self._joined = True
         self.emit('joined', True, None)
@@ -371,27 +365,35 @@ class Activity(GObject.GObject):
         if removed:
             self._resolve_handles(removed, reply_cb=self._remove_buddies)
 
-    def _add_buddies(self, contact_ids):
-        for contact_id in contact_ids:
+    def _add_buddies(self, contact_ids, handles):
+        for contact_id, handle in zip(contact_ids, handles):
             if contact_id not in self._buddies:
-                buddy = self._get_buddy(contact_id)
+                buddy = self._get_buddy(contact_id, handle)
                 self.emit('buddy-joined', buddy)
                 self._buddies[contact_id] = buddy
             if contact_id not in self._joined_buddies:
                 self._joined_buddies[contact_id] = buddy
 
-    def _remove_buddies(self, contact_ids):
+    def _remove_buddies(self, contact_ids, handles):
+        # imported here, presenceservice imports this module
+        from sugar3.presence.presenceservice import get_instance
+
         for contact_id in contact_ids:
             if contact_id in self._buddies:
                 buddy = self._get_buddy(contact_id)
                 self.emit('buddy-left', buddy)
                 del self._buddies[contact_id]
+            get_instance().invalidate_buddy(self._account_path, contact_id)
+
+    def _get_buddy(self, contact_id, handle=None):
+        # imported here, presenceservice imports this module
+        from sugar3.presence.presenceservice import get_instance
 
-    def _get_buddy(self, contact_id):
         if contact_id in self._buddies:
             return self._buddies[contact_id]
         else:
-            return Buddy(self._account_path, contact_id)
+            return get_instance().get_buddy(self._account_path, contact_id,
+                                            handle)
 
     def join(self):
         """Join this activity.
@@ -22,30 +22,25 @@ STABLE.
 """
 
 import logging
+from functools import partial
 
 import six
-import gi
-gi.require_version('TelepathyGLib', '0.12')
 from gi.repository import GObject
+from gi.repository import GLib
 import dbus
 
 from sugar3.presence.connectionmanager import get_connection_manager
 from sugar3.profile import get_color, get_nick_name
-
-from gi.repository import TelepathyGLib
-
-CONNECTION = TelepathyGLib.IFACE_CONNECTION
-CONNECTION_INTERFACE_ALIASING = \
-    TelepathyGLib.IFACE_CONNECTION_INTERFACE_ALIASING
-CONNECTION_INTERFACE_CONTACTS = \
-    TelepathyGLib.IFACE_CONNECTION_INTERFACE_CONTACTS
-
-HANDLE_TYPE_CONTACT = TelepathyGLib.HandleType.CONTACT
+from sugar3.presence._telepathy import CONNECTION, \
+    CONNECTION_INTERFACE_ALIASING, CONNECTION_INTERFACE_CONTACTS, \
+    HANDLE_TYPE_CONTACT
 
 CONN_INTERFACE_BUDDY_INFO = 'org.laptop.Telepathy.BuddyInfo'
 
 _logger = logging.getLogger('sugar3.presence.buddy')
 
+_buddy_loaders = {}
+
 
 class BaseBuddy(GObject.GObject):
     """UI interface for a Buddy in the presence service
@@ -150,30 +145,128 @@ class BaseBuddy(GObject.GObject):
         return None
 
 
+class _BuddyLoader(object):
+    """Fetch the handles and aliases of the buddies of an account in
+    batches.
+
+    Buddies created during the same main loop iteration, like the members
+    of a shared activity, are resolved with a single RequestHandles()
+    call and their aliases fetched with a single GetContactAttributes()
+    call.
+    """
+
+    def __init__(self, account_path):
+        self._account_path = account_path
+        self._pending = []
+        self._flush_sid = None
+
+    def add(self, buddy):
+        self._pending.append(buddy)
+        if self._flush_sid is None:
+            self._flush_sid = GLib.idle_add(self.__flush_cb)
+
+    def __flush_cb(self):
+        self._flush_sid = None
+        buddies = self._pending
+        self._pending = []
+
+        connection_manager = get_connection_manager()
+        connection = connection_manager.get_connection(self._account_path)
+
+        unresolved = [buddy for buddy in buddies
+                      if buddy.contact_handle is None]
+        if unresolved:
+            self._request_handles(connection, buddies, unresolved)
+        else:
+            self._fetch(connection, buddies)
+        return False
+
+    def _request_handles(self, connection, buddies, unresolved):
+        connection.RequestHandles(
+            HANDLE_TYPE_CONTACT,
+            [buddy.contact_id for buddy in unresolved],
+            dbus_interface=CONNECTION,
+            reply_handler=partial(self.__got_handles_cb, connection,
+                                  buddies, unresolved),
+            error_handler=partial(self.__request_handles_error_cb,
+                                  connection, buddies, unresolved))
+
+    def __got_handles_cb(self, connection, buddies, unresolved, handles):
+        for buddy, handle in zip(unresolved, handles):
+            buddy.contact_handle = handle
+        self._fetch(connection, buddies)
+
+    def __request_handles_error_cb(self, connection, buddies, unresolved,
+                                   error):
+        resolved = [buddy for buddy in buddies
+                    if buddy.contact_handle is not None]
+        if resolved:
+            self._fetch(connection, resolved)
+
+        if len(unresolved) == 1:
+            _logger.warning('Cannot resolve buddy %s: %s',
+                            unresolved[0].contact_id, error)
+            return
+
+        # a single invalid or departed contact fails the whole batch
+        _logger.warning('Cannot resolve %d buddies, retrying one by one:'
+                        ' %s', len(unresolved), error)
+        for buddy in unresolved:
+            self._request_handles(connection, [buddy], [buddy])
+
+    def _fetch(self, connection, buddies):
+        handles = [buddy.contact_handle for buddy in buddies]
+        connection.GetContactAttributes(
+            handles, [CONNECTION_INTERFACE_ALIASING], False,
+            dbus_interface=CONNECTION_INTERFACE_CONTACTS,
+            reply_handler=partial(self.__got_attributes_cb, buddies),
+            error_handler=self.__error_handler_cb)
+
+        # BuddyInfo has no batched equivalent of GetProperties()
+        for buddy in buddies:
+            buddy._fetch_properties(connection)
+
+    def __got_attributes_cb(self, buddies, attributes):
+        _logger.debug('__got_attributes_cb %r', attributes)
+        for buddy in buddies:
+            if buddy.contact_handle in attributes:
+                buddy._update_attributes(attributes[buddy.contact_handle])
+
+    def __error_handler_cb(self, error):
+        _logger.warning('Cannot fetch the aliases of buddies: %s', error)
+
+
+def _get_buddy_loader(account_path):
+    if account_path not in _buddy_loaders:
+        _buddy_loaders[account_path] = _BuddyLoader(account_path)
+    return _buddy_loaders[account_path]
+
+
 class Buddy(BaseBuddy):
+    """A remote buddy, whose properties are filled in asynchronously.
+
+    Until the presence service answers, the properties have their
+    default values, notify signals are emitted as they are set.
+    """
+
     __gtype_name__ = 'PresenceBuddy'
 
-    def __init__(self, account_path, contact_id):
+    def __init__(self, account_path, contact_id, contact_handle=None):
         _logger.debug('Buddy.__init__')
         BaseBuddy.__init__(self)
 
         self._account_path = account_path
         self.contact_id = contact_id
-        self.contact_handle = None
+        self.contact_handle = contact_handle
 
-        connection_manager = get_connection_manager()
-        connection = connection_manager.get_connection(account_path)
+        _get_buddy_loader(account_path).add(self)
 
+    def _fetch_properties(self, connection):
         connection_name = connection.object_path.replace('/', '.')[1:]
 
         bus = dbus.SessionBus()
-        obj = bus.get_object(connection_name, connection.object_path)
-        handles = obj.RequestHandles(HANDLE_TYPE_CONTACT, [self.contact_id],
-                                     dbus_interface=CONNECTION)
-        self.contact_handle = handles[0]
-
         if six.PY2:
-            self._get_properties_call = bus.call_async(
+            bus.call_async(
                 connection_name,
                 connection.object_path,
                 CONN_INTERFACE_BUDDY_INFO,
@@ -185,7 +278,7 @@ class Buddy(BaseBuddy):
                 utf8_strings=True,
                 byte_arrays=True)
         else:
-            self._get_properties_call = bus.call_async(
+            bus.call_async(
                 connection_name,
                 connection.object_path,
                 CONN_INTERFACE_BUDDY_INFO,
@@ -196,27 +289,10 @@ class Buddy(BaseBuddy):
                 error_handler=self.__error_handler_cb,
                 byte_arrays=True)
 
-        self._get_attributes_call = bus.call_async(
-            connection_name,
-            connection.object_path,
-            CONNECTION_INTERFACE_CONTACTS,
-            'GetContactAttributes',
-            'auasb',
-            ([self.contact_handle], [CONNECTION_INTERFACE_ALIASING],
-             False),
-            reply_handler=self.__got_attributes_cb,
-            error_handler=self.__error_handler_cb)
-
     def __got_properties_cb(self, properties):
         _logger.debug('__got_properties_cb %r', properties)
-        self._get_properties_call = None
         self._update_properties(properties)
 
-    def __got_attributes_cb(self, attributes):
-        _logger.debug('__got_attributes_cb %r', attributes)
-        self._get_attributes_call = None
-        self._update_attributes(attributes[self.contact_handle])
-
     def __error_handler_cb(self, error):
         _logger.debug('__error_handler_cb %r', error)
 
@@ -243,18 +319,6 @@ class Buddy(BaseBuddy):
         if nick_key in attributes:
             self.props.nick = attributes[nick_key]
 
-    def do_get_property(self, pspec):
-        if pspec.name == 'nick' and self._get_attributes_call is not None:
-            _logger.debug('%r: Blocking on GetContactAttributes() because '
-                          'someone wants property nick', self)
-            self._get_attributes_call.block()
-        elif pspec.name != 'nick' and self._get_properties_call is not None:
-            _logger.debug('%r: Blocking on GetProperties() because someone '
-                          'wants property %s', self, pspec.name)
-            self._get_properties_call.block()
-
-        return BaseBuddy.do_get_property(self, pspec)
-
 
 class Owner(BaseBuddy):
 
@@ -19,24 +19,27 @@
 UNSTABLE. It should really be internal to the sugar3.presence package.
 """
 
+import logging
 from functools import partial
 
 import dbus
 from dbus import PROPERTIES_IFACE
 
-from gi.repository import TelepathyGLib
+from sugar3.presence._telepathy import ACCOUNT_MANAGER_SERVICE, \
+    ACCOUNT_MANAGER_PATH, ACCOUNT_MANAGER, ACCOUNT, \
+    CONNECTION_STATUS_CONNECTED
 
-ACCOUNT_MANAGER_SERVICE = TelepathyGLib.ACCOUNT_MANAGER_BUS_NAME
-ACCOUNT_MANAGER_PATH = TelepathyGLib.ACCOUNT_MANAGER_OBJECT_PATH
-ACCOUNT_MANAGER = TelepathyGLib.IFACE_ACCOUNT_MANAGER
 
-ACCOUNT = TelepathyGLib.IFACE_ACCOUNT
+_proxies = {}
 
-HANDLE_TYPE_CONTACT = TelepathyGLib.HandleType.CONTACT
 
-CONNECTION = TelepathyGLib.IFACE_CONNECTION
-
-CONNECTION_STATUS_CONNECTED = TelepathyGLib.ConnectionStatus.CONNECTED
+def get_proxy(bus_name, object_path):
+    """Get a proxy for a remote object on the session bus, the proxies are
+    shared so signal matches and introspection are set up only once."""
+    key = (bus_name, object_path)
+    if key not in _proxies:
+        _proxies[key] = dbus.SessionBus().get_object(bus_name, object_path)
+    return _proxies[key]
 
 
 class Connection(object):
@@ -47,58 +50,104 @@ class Connection(object):
 
 
 class ConnectionManager(object):
-    """Track available telepathy connections"""
+    """Track available telepathy connections
+
+    The accounts and their properties are fetched asynchronously and kept
+    up to date by the AccountPropertyChanged and StatusChanged signals.
+    Methods called before the replies arrived wait for them.
+    """
 
     def __init__(self):
         self._connections_per_account = {}
+        self._account_properties = {}
+        self._pending_calls = []
 
         bus = dbus.SessionBus()
-        obj = bus.get_object(ACCOUNT_MANAGER_SERVICE, ACCOUNT_MANAGER_PATH)
-        account_manager = dbus.Interface(obj, ACCOUNT_MANAGER)
-        account_paths = account_manager.Get(ACCOUNT_MANAGER, 'ValidAccounts',
-                                            dbus_interface=PROPERTIES_IFACE)
+        self._pending_calls.append(bus.call_async(
+            ACCOUNT_MANAGER_SERVICE, ACCOUNT_MANAGER_PATH, PROPERTIES_IFACE,
+            'Get', 'ss', (ACCOUNT_MANAGER, 'ValidAccounts'),
+            reply_handler=self.__got_accounts_cb,
+            error_handler=self.__error_handler_cb))
+
+    def _wait_ready(self):
+        while self._pending_calls:
+            # blocking runs the reply handler, which may queue more calls
+            self._pending_calls.pop(0).block()
+
+    def __got_accounts_cb(self, account_paths):
+        bus = dbus.SessionBus()
         for account_path in account_paths:
-            obj = bus.get_object(ACCOUNT_MANAGER_SERVICE, account_path)
+            obj = get_proxy(ACCOUNT_MANAGER_SERVICE, account_path)
             obj.connect_to_signal('AccountPropertyChanged',
                                   partial(self.__account_property_changed_cb,
                                           account_path))
-            connection_path = obj.Get(ACCOUNT, 'Connection')
-            if connection_path != '/':
-                self._track_connection(account_path, connection_path)
+            self._pending_calls.append(bus.call_async(
+                ACCOUNT_MANAGER_SERVICE, account_path, PROPERTIES_IFACE,
+                'GetAll', 's', (ACCOUNT,),
+                reply_handler=partial(self.__got_account_properties_cb,
+                                      account_path),
+                error_handler=self.__error_handler_cb))
+
+    def __got_account_properties_cb(self, account_path, properties):
+        self._account_properties[account_path] = dict(properties)
+        connection_path = properties.get('Connection', '/')
+        if connection_path != '/':
+            self._track_connection(account_path, connection_path)
+
+    def __error_handler_cb(self, error):
+        logging.error('ConnectionManager: %s', error)
 
     def __account_property_changed_cb(self, account_path, properties):
-        if 'Connection' not in properties:
-            return
-        if properties['Connection'] == '/':
-            if account_path in self._connections_per_account:
-                del self._connections_per_account[account_path]
-        else:
-            self._track_connection(account_path, properties['Connection'])
+        account_properties = self._account_properties.setdefault(
+            account_path, {})
+        account_properties.update(properties)
+
+        if 'Connection' in properties:
+            if properties['Connection'] == '/':
+                if account_path in self._connections_per_account:
+                    del self._connections_per_account[account_path]
+            else:
+                self._track_connection(account_path,
+                                       properties['Connection'])
+        elif 'ConnectionStatus' in properties and \
+                account_path in self._connections_per_account:
+            self._connections_per_account[account_path].connected = \
+                properties['ConnectionStatus'] == CONNECTION_STATUS_CONNECTED
 
     def _track_connection(self, account_path, connection_path):
         connection_name = connection_path.replace('/', '.')[1:]
-        bus = dbus.SessionBus()
-        connection = bus.get_object(connection_name, connection_path)
+        connection = get_proxy(connection_name, connection_path)
+        if account_path in self._connections_per_account and \
+                self._connections_per_account[account_path].connection is \
+                connection:
+            return
+
         connection.connect_to_signal('StatusChanged',
                                      partial(self.__status_changed_cb,
                                              account_path))
         self._connections_per_account[account_path] = \
             Connection(account_path, connection)
 
-        account = bus.get_object(ACCOUNT_MANAGER_SERVICE, account_path)
-        status = account.Get(ACCOUNT, 'ConnectionStatus')
+        status = self._account_properties[account_path].get(
+            'ConnectionStatus')
         if status == CONNECTION_STATUS_CONNECTED:
             self._connections_per_account[account_path].connected = True
         else:
             self._connections_per_account[account_path].connected = False
 
     def __status_changed_cb(self, account_path, status, reason):
+        if account_path in self._account_properties:
+            self._account_properties[account_path]['ConnectionStatus'] = \
+                status
+        if account_path not in self._connections_per_account:
+            return
         if status == CONNECTION_STATUS_CONNECTED:
             self._connections_per_account[account_path].connected = True
         else:
             self._connections_per_account[account_path].connected = False
 
     def get_preferred_connection(self):
+        self._wait_ready()
         best_connection = None, None
         for account_path, connection in list(
                 self._connections_per_account.items()):
@@ -110,18 +159,27 @@ class ConnectionManager(object):
         return best_connection
 
     def get_connection(self, account_path):
+        self._wait_ready()
         return self._connections_per_account[account_path].connection
 
     def get_connections_per_account(self):
+        self._wait_ready()
         return self._connections_per_account
 
     def get_account_for_connection(self, connection_path):
+        self._wait_ready()
         for account_path, connection in list(
                 self._connections_per_account.items()):
             if connection.connection.object_path == connection_path:
                 return account_path
         return None
 
+    def get_account_property(self, account_path, name):
+        """Get a property of the Account interface of an account from the
+        cache, or None if it is not known"""
+        self._wait_ready()
+        return self._account_properties.get(account_path, {}).get(name)
+
 
 _connection_manager = None
 
@@ -21,30 +21,64 @@ STABLE.
 """
 
 import logging
+import weakref
 import dbus
 import dbus.exceptions
-from dbus import PROPERTIES_IFACE
 
 from sugar3.presence.buddy import Buddy, Owner
 from sugar3.presence.activity import Activity
-from sugar3.presence.connectionmanager import get_connection_manager
+from sugar3.presence.connectionmanager import get_connection_manager, \
+    get_proxy
+from sugar3.presence._telepathy import HANDLE_TYPE_CONTACT, CONNECTION
+from sugar3.util import LRU
 
 from gi.repository import GObject
-from gi.repository import TelepathyGLib
 
 _logger = logging.getLogger('sugar3.presence.presenceservice')
 
-ACCOUNT_MANAGER_SERVICE = TelepathyGLib.ACCOUNT_MANAGER_BUS_NAME
-ACCOUNT_MANAGER_PATH = TelepathyGLib.ACCOUNT_MANAGER_OBJECT_PATH
-ACCOUNT_MANAGER = TelepathyGLib.IFACE_ACCOUNT_MANAGER
+CONN_INTERFACE_ACTIVITY_PROPERTIES = 'org.laptop.Telepathy.ActivityProperties'
 
-ACCOUNT = TelepathyGLib.IFACE_ACCOUNT
+# Number of recently used buddies kept alive when nothing else uses them
+_BUDDY_CACHE_SIZE = 100
 
-HANDLE_TYPE_CONTACT = TelepathyGLib.HandleType.CONTACT
 
-CONNECTION = TelepathyGLib.IFACE_CONNECTION
+class _BuddyCache(object):
+    """Buddies by account path and contact id.
 
-CONN_INTERFACE_ACTIVITY_PROPERTIES = 'org.laptop.Telepathy.ActivityProperties'
+    Every buddy still referenced somewhere is found through a weak
+    reference, and the most recently used ones are also kept alive so
+    that looking them up again does not query the network.
+    """
+
+    def __init__(self, size):
+        self._live = weakref.WeakValueDictionary()
+        self._recent = LRU(size)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, account_path, contact_id, contact_handle=None):
+        key = (account_path, contact_id)
+        buddy = self._live.get(key)
+        if buddy is None:
+            self.misses += 1
+            buddy = Buddy(account_path, contact_id, contact_handle)
+            self._live[key] = buddy
+        else:
+            self.hits += 1
+        self._recent[key] = buddy
+        return buddy
+
+    def invalidate(self, account_path, contact_id):
+        key = (account_path, contact_id)
+        self._live.pop(key, None)
+        if key in self._recent:
+            del self._recent[key]
+
+    def get_stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'live': len(self._live),
+                'cached': len(self._recent.keys())}
 
 
 class PresenceService(GObject.GObject):
@@ -61,7 +95,7 @@ class PresenceService(GObject.GObject):
         GObject.GObject.__init__(self)
 
         self._activity_cache = None
-        self._buddy_cache = {}
+        self._buddy_cache = _BuddyCache(_BUDDY_CACHE_SIZE)
 
     def get_activity(self, activity_id, warn_if_none=True):
         """Retrieve single Activity object for the given unique id
@@ -121,20 +155,32 @@ class PresenceService(GObject.GObject):
                 connection_manager.get_account_for_connection(connection_path)
 
             connection_name = connection_path.replace('/', '.')[1:]
-            bus = dbus.SessionBus()
-            connection = bus.get_object(connection_name, connection_path)
+            connection = get_proxy(connection_name, connection_path)
             activity = Activity(account_path, connection,
                                 room_handle=room_handle)
             self._activity_cache = activity
             return activity
 
-    def get_buddy(self, account_path, contact_id):
-        if (account_path, contact_id) in self._buddy_cache:
-            return self._buddy_cache[(account_path, contact_id)]
+    def get_buddy(self, account_path, contact_id, contact_handle=None):
+        """Retrieve the Buddy object of a contact, creating it if needed
 
-        buddy = Buddy(account_path, contact_id)
-        self._buddy_cache[(account_path, contact_id)] = buddy
-        return buddy
+        account_path -- the Telepathy account of the contact
+        contact_id -- the identifier of the contact on that account
+        contact_handle -- the handle of the contact, if it is already known,
+            saves resolving it
+        """
+        return self._buddy_cache.get(account_path, contact_id,
+                                     contact_handle)
+
+    def invalidate_buddy(self, account_path, contact_id):
+        """Forget the Buddy object of a contact, the next lookup will
+        fetch its properties again"""
+        self._buddy_cache.invalidate(account_path, contact_id)
+
+    def get_buddy_cache_stats(self):
+        """Get the hits and misses of the buddy lookups, and the numbers of
+        live and cached Buddy objects"""
+        return self._buddy_cache.get_stats()
 
     # DEPRECATED
     def get_buddy_by_telepathy_handle(self, tp_conn_name, tp_conn_path,
@@ -153,22 +199,16 @@ class PresenceService(GObject.GObject):
         :Returns: the Buddy object, or None if the buddy is not found
         """
 
-        bus = dbus.Bus()
-        obj = bus.get_object(ACCOUNT_MANAGER_SERVICE, ACCOUNT_MANAGER_PATH)
-        account_manager = dbus.Interface(obj, ACCOUNT_MANAGER)
-        account_paths = account_manager.Get(ACCOUNT_MANAGER, 'ValidAccounts',
-                                            dbus_interface=PROPERTIES_IFACE)
-        for account_path in account_paths:
-            obj = bus.get_object(ACCOUNT_MANAGER_SERVICE, account_path)
-            connection_path = obj.Get(ACCOUNT, 'Connection')
-            if connection_path == tp_conn_path:
-                connection_name = connection_path.replace('/', '.')[1:]
-                connection = bus.get_object(connection_name, connection_path)
-                contact_ids = connection.InspectHandles(
-                    HANDLE_TYPE_CONTACT,
-                    [handle],
-                    dbus_interface=CONNECTION)
-                return self.get_buddy(account_path, contact_ids[0])
+        connection_manager = get_connection_manager()
+        account_path = \
+            connection_manager.get_account_for_connection(tp_conn_path)
+        if account_path is not None:
+            connection = connection_manager.get_connection(account_path)
+            contact_ids = connection.InspectHandles(
+                HANDLE_TYPE_CONTACT,
+                [handle],
+                dbus_interface=CONNECTION)
+            return self.get_buddy(account_path, contact_ids[0], handle)
 
         raise ValueError('Unknown buddy in connection %s with handle %d' %
                          (tp_conn_path, handle))
@@ -21,10 +21,8 @@ STABLE.
 
 from sugar3.presence.tubeconn import TubeConnection
 from sugar3.presence import presenceservice
-from gi.repository import TelepathyGLib
-
-CHANNEL_GROUP_FLAG_CHANNEL_SPECIFIC_HANDLES = \
-    TelepathyGLib.ChannelGroupFlags.CHANNEL_SPECIFIC_HANDLES
+from sugar3.presence._telepathy import \
+    CHANNEL_GROUP_FLAG_CHANNEL_SPECIFIC_HANDLES
 
 
 class SugarTubeConnection(TubeConnection):
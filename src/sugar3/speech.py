@@ -27,17 +27,35 @@ from gi.repository import Gdk
 from gi.repository import GLib
 from gi.repository import GObject
 
-_HAS_GST = True
-try:
+from sugar3 import power
+from sugar3.util import LazyModule
+
+
+def _load_gst():
     gi.require_version('Gst', '1.0')
-    from gi.repository import Gst
-    Gst.init(None)
-    Gst.parse_launch('espeak')
-except BaseException:
-    logging.error('Gst or the espeak plugin is not installed in the system.')
-    _HAS_GST = False
+    from gi.repository import Gst as module
+    module.init(None)
+    return module
+
+
+# GStreamer is initialized when speech is first used
+Gst = LazyModule('gi.repository.Gst', _load_gst)
+
+_HAS_GST = None
+
+
+def _has_gst():
+    global _HAS_GST
+    if _HAS_GST is None:
+        try:
+            Gst.parse_launch('espeak')
+            _HAS_GST = True
+        except BaseException:
+            logging.error('Gst or the espeak plugin is not installed in the'
+                          ' system.')
+            _HAS_GST = False
+    return _HAS_GST
 
-from sugar3 import power
 
 DEFAULT_PITCH = 0
 
@@ -226,7 +244,7 @@ class SpeechManager(GObject.GObject):
         self.restore()
 
     def enabled(self):
-        return _HAS_GST
+        return _has_gst()
 
     def _update_state(self, player, signal):
         self._is_playing = (signal == 'play')
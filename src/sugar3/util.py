@@ -30,6 +30,9 @@ import gettext
 import tempfile
 import logging
 import atexit
+import importlib
+import collections
+import types
 
 
 def _(msg):
@@ -215,6 +218,85 @@ class LRU:
         return list(self.d.keys())
 
 
+class SizedLRU(object):
+    """
+    LRU cache bounded by the total size of its values instead of by
+    their count.
+
+    max_size -- budget for the sum of the sizes of the values
+    sizeof -- callable returning the size of a value (default len)
+
+    Values bigger than the whole budget are not stored. Lookups made
+    with get() and evictions are counted in the hits, misses and
+    evictions attributes.
+    """
+
+    def __init__(self, max_size, sizeof=len):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sizeof = sizeof
+        self._d = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._d
+
+    def __len__(self):
+        return len(self._d)
+
+    def __getitem__(self, key):
+        value, size = self._d.pop(key)
+        self._d[key] = (value, size)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._d:
+            del self[key]
+
+        size = self._sizeof(value)
+        if size > self.max_size:
+            return
+
+        self._d[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            self._evict()
+
+    def __delitem__(self, key):
+        value_, size = self._d.pop(key)
+        self.size -= size
+
+    def _evict(self):
+        key = next(iter(self._d))
+        del self[key]
+        self.evictions += 1
+
+    def get(self, key, default=None):
+        if key in self._d:
+            self.hits += 1
+            return self[key]
+        self.misses += 1
+        return default
+
+    def get_stats(self):
+        """Return a dictionary with the usage counters of the cache."""
+        return {'entries': len(self._d),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    def keys(self):
+        return list(self._d.keys())
+
+    def clear(self):
+        self._d.clear()
+        self.size = 0
+
+
 units = [['%d year', '%d years', 356 * 24 * 60 * 60],
          ['%d month', '%d months', 30 * 24 * 60 * 60],
          ['%d week', '%d weeks', 7 * 24 * 60 * 60],
@@ -240,6 +322,45 @@ ELAPSED = _('%s ago')
 # xgettext will pick them up as plurals.
 
 
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is only imported when one of its attributes
+    is first used, to keep rarely used dependencies out of the startup of
+    activities.
+
+    Args:
+        name (str): name of the module to import
+        loader (callable): optional function importing and returning the
+            module, for modules which need a setup like the typelibs of a
+            given version
+    """
+
+    def __init__(self, name, loader=None):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_lazy_loader'] = loader
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            loader = self.__dict__['_lazy_loader']
+            if loader is None:
+                module = importlib.import_module(self.__name__)
+            else:
+                module = loader()
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
 def ngettext(singular, plural, n):
     pass
 
@@ -0,0 +1,133 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Compare the latency of launching an activity in a new process and through
+the zygote of sugar3.activity.zygote, until the constructor of the activity
+has run.  Needs a display and a session bus.
+
+Usage: python activitylaunch.py [repetitions]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+from sugar3.activity import zygote
+
+ACTIVITY_INFO = '''[Activity]
+name = Benchmark
+activity_version = 1
+bundle_id = org.sugarlabs.Benchmark
+exec = sugar-activity3 activity.BenchmarkActivity
+icon = activity-benchmark
+license = GPLv2+
+'''
+
+ACTIVITY_PY = '''import os
+
+from sugar3.activity import activity
+
+
+class BenchmarkActivity(activity.Activity):
+
+    def __init__(self, handle):
+        os._exit(0)
+'''
+
+SUGAR_ACTIVITY = os.path.join(os.path.dirname(__file__), os.pardir,
+                              os.pardir, 'bin', 'sugar-activity3')
+
+
+def create_bundle(path):
+    bundle_path = os.path.join(path, 'Benchmark.activity')
+    os.makedirs(os.path.join(bundle_path, 'activity'))
+    with open(os.path.join(bundle_path, 'activity',
+                           'activity.info'), 'w') as f:
+        f.write(ACTIVITY_INFO)
+    with open(os.path.join(bundle_path, 'activity.py'), 'w') as f:
+        f.write(ACTIVITY_PY)
+    return bundle_path
+
+
+def get_command(i):
+    return ['sugar-activity3', 'activity.BenchmarkActivity',
+            '-b', 'org.sugarlabs.Benchmark', '-a', '%040x' % i]
+
+
+def launch_process(bundle_path, environ, i):
+    command = [sys.executable, SUGAR_ACTIVITY] + get_command(i)[1:]
+    with open(os.devnull, 'w') as dev_null:
+        subprocess.check_call(command, env=environ, cwd=bundle_path,
+                              stdout=dev_null, stderr=dev_null)
+
+
+def launch_zygote(socket_path, bundle_path, environ, i):
+    with open(os.devnull, 'r+') as dev_null:
+        fd = dev_null.fileno()
+        pid_, connection = zygote.launch(socket_path, get_command(i),
+                                         environ, bundle_path, fd, fd, fd)
+    status = zygote.read_exit_status(connection)
+    if status != 0:
+        raise RuntimeError('Activity failed with status %d' % status)
+
+
+def run(label, launch, repetitions):
+    timings = []
+    for i in range(repetitions):
+        start = time.time()
+        launch(i)
+        timings.append(time.time() - start)
+    timings.sort()
+    print('%-16s median %.3fs, min %.3fs, max %.3fs' %
+          (label, timings[len(timings) // 2], timings[0], timings[-1]))
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    temp_dir = tempfile.mkdtemp()
+    zygote_process = None
+    try:
+        bundle_path = create_bundle(temp_dir)
+        environ = os.environ.copy()
+        environ['SUGAR_HOME'] = os.path.join(temp_dir, 'home')
+
+        socket_path = os.path.join(temp_dir, 'zygote')
+        zygote_process = subprocess.Popen(
+            [sys.executable, '-m', 'sugar3.activity.zygote', socket_path])
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+        # wait for the preloading
+        launch_zygote(socket_path, bundle_path, environ, 0)
+
+        run('new process', lambda i: launch_process(bundle_path, environ, i),
+            repetitions)
+        run('zygote', lambda i: launch_zygote(socket_path, bundle_path,
+                                              environ, i), repetitions)
+    finally:
+        if zygote_process is not None:
+            zygote_process.terminate()
+            zygote_process.wait()
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
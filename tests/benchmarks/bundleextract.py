@@ -0,0 +1,98 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Compare the in-process bundle extraction with the unzip command.
+
+Usage: python bundleextract.py [number of files] [repetitions]
+"""
+
+import os
+import sys
+import time
+import shutil
+import random
+import tempfile
+import subprocess
+import zipfile
+
+from sugar3.bundle.activitybundle import ActivityBundle
+
+ACTIVITY_INFO = b'''[Activity]
+name = Benchmark
+activity_version = 1
+bundle_id = org.sugarlabs.Benchmark
+exec = sugar-activity3 activity.BenchmarkActivity
+icon = activity-benchmark
+license = GPLv2+
+'''
+
+
+def create_bundle(path, n_files):
+    xo_path = os.path.join(path, 'Benchmark-1.xo')
+    rand = random.Random(0)
+    with zipfile.ZipFile(xo_path, 'w', zipfile.ZIP_DEFLATED) as xo:
+        xo.writestr('Benchmark.activity/activity/activity.info',
+                    ACTIVITY_INFO)
+        for i in range(n_files):
+            # mostly small sources, with a few large media files
+            size = rand.choice([2, 8, 32, 64, 2048]) * 1024
+            words = [b'%x' % rand.randint(0, 512) for j in range(size // 4)]
+            xo.writestr('Benchmark.activity/dir%d/file%d' % (i % 10, i),
+                        b' '.join(words)[:size])
+    return xo_path
+
+
+def run(label, extract, repetitions):
+    timings = []
+    for i in range(repetitions):
+        install_dir = tempfile.mkdtemp()
+        start = time.time()
+        extract(install_dir)
+        timings.append(time.time() - start)
+        shutil.rmtree(install_dir)
+    print('%-24s best %.3fs  mean %.3fs' % (label, min(timings),
+                                            sum(timings) / len(timings)))
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        xo_path = create_bundle(temp_dir, n_files)
+        bundle = ActivityBundle(xo_path)
+        print('%d files, %d bytes compressed' % (n_files,
+                                                 os.path.getsize(xo_path)))
+
+        run('unzip subprocess',
+            lambda install_dir: subprocess.check_call(
+                ['unzip', '-q', '-o', xo_path, '-d', install_dir]),
+            repetitions)
+        run('in-process, 1 thread',
+            lambda install_dir: bundle._unzip(install_dir, workers=1),
+            repetitions)
+        run('in-process, 4 threads',
+            lambda install_dir: bundle._unzip(install_dir, workers=4),
+            repetitions)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Measure the throughput of the file server of sugar3.network with
+concurrent clients on the loopback interface, with sendfile() and
+adaptive chunks, and with the former fixed 4 KiB read() and write().
+
+Usage: python fileserver.py [file size in MiB] [clients]
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+
+from gi.repository import GLib
+
+from sugar3 import network
+
+
+class FixedChunkHandler(network.ChunkedGlibHTTPRequestHandler):
+    MAX_CHUNK_SIZE = network.ChunkedGlibHTTPRequestHandler.CHUNK_SIZE
+    _use_sendfile = False
+
+
+def download(port, size, timings):
+    start = time.time()
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(b'GET /shared.bin HTTP/1.0\r\n\r\n')
+    received = 0
+    while True:
+        data = sock.recv(256 * 1024)
+        if not data:
+            break
+        received += len(data)
+    sock.close()
+    if received < size:
+        print('short transfer: %d of %d bytes' % (received, size))
+    timings.append(time.time() - start)
+
+
+def run(label, handler_class, size, n_clients):
+    server = network.GlibTCPServer(('127.0.0.1', 0), handler_class)
+    port = server.socket.getsockname()[1]
+    main_loop = GLib.MainLoop()
+    timings = []
+
+    def check_done():
+        if len(timings) < n_clients:
+            return True
+        main_loop.quit()
+        return False
+
+    start = time.time()
+    for i in range(n_clients):
+        threading.Thread(target=download,
+                         args=(port, size, timings)).start()
+    GLib.timeout_add(10, check_done)
+    main_loop.run()
+    elapsed = time.time() - start
+
+    print('%-24s %.1f MiB/s total, slowest client %.2fs, fastest %.2fs' %
+          (label, size * n_clients / elapsed / 1024 / 1024, max(timings),
+           min(timings)))
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    size *= 1024 * 1024
+
+    temp_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        with open(os.path.join(temp_dir, 'shared.bin'), 'wb') as f:
+            f.write(os.urandom(size))
+        os.chdir(temp_dir)
+
+        print('%d MiB to %d clients' % (size // 1024 // 1024, n_clients))
+        run('fixed 4 KiB chunks', FixedChunkHandler, size, n_clients)
+        run('sendfile, adaptive', network.ChunkedGlibHTTPRequestHandler,
+            size, n_clients)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
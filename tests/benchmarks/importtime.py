@@ -0,0 +1,95 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Break down the time taken to import a module of sugar3 in a new
+interpreter, per imported module, using python -X importtime.
+
+Exits with status 1 if the total is above the limit given in
+milliseconds, to catch regressions of the startup time of activities.
+
+Usage: python importtime.py [module] [limit in ms] [repetitions]
+"""
+
+import sys
+import subprocess
+
+# Number of modules listed, by their own import time
+_TOP_MODULES = 25
+
+
+def measure(module):
+    """Return the self and cumulative import times in microseconds of the
+    modules imported by module, by name, in import order."""
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.STDOUT, universal_newlines=True)
+
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # the header
+            continue
+        timings.append((fields[2].strip(), self_us, cumulative_us))
+    return timings
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else 'sugar3.activity.activity'
+    limit = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    repetitions = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    # keep the fastest run of each module, the others are noise
+    best = {}
+    order = []
+    totals = []
+    for i in range(repetitions):
+        timings = measure(module)
+        totals.append(sum(self_us for name_, self_us, c_ in timings))
+        for name, self_us, cumulative_us in timings:
+            if name not in best:
+                order.append(name)
+                best[name] = (self_us, cumulative_us)
+            else:
+                best[name] = (min(best[name][0], self_us),
+                              min(best[name][1], cumulative_us))
+
+    total = min(totals) / 1000.0
+    print('import %s: %.1f ms, %d modules' % (module, total, len(order)))
+
+    print('\nsugar3 modules, cumulative:')
+    for name in order:
+        if name.startswith('sugar3'):
+            print('  %8.1f ms  %s' % (best[name][1] / 1000.0, name))
+
+    print('\nslowest modules, self:')
+    slowest = sorted(order, key=lambda name: best[name][0], reverse=True)
+    for name in slowest[:_TOP_MODULES]:
+        print('  %8.1f ms  %s' % (best[name][0] / 1000.0, name))
+
+    if limit is not None and total > limit:
+        print('\nAbove the limit of %.1f ms' % limit)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sugar3.activity.activity import Activity
+from sugar3.datastore import datastore
+
+
+class _DocumentActivity(object):
+    """The document saving of an Activity implementing update_file(),
+    without a window."""
+
+    _update_jobject_file = Activity.__dict__['_update_jobject_file']
+    _write_document = Activity.__dict__['_write_document']
+
+    def __init__(self):
+        self._jobject = datastore.DSObject(None, datastore.DSMetadata())
+        self._owns_file = False
+        self._transfer_file = False
+        self._document_path = None
+        self.content = 'first'
+        self.updates = 0
+
+    def get_id(self):
+        return 'activity-id'
+
+    def write_file(self, file_path):
+        with open(file_path, 'w') as f:
+            f.write(self.content)
+
+    def update_file(self, file_path):
+        self.updates += 1
+        self.write_file(file_path)
+
+
+class _JournalObject(object):
+
+    def __init__(self, object_id):
+        self.object_id = object_id
+
+
+class _CopyingActivity(object):
+    """The save queue of an Activity, with a save that only records the
+    object id each write is sent for."""
+
+    copy = Activity.__dict__['copy']
+    _run_queued_save = Activity.__dict__['_run_queued_save']
+    save_cb = Activity.__dict__['_Activity__save_cb']
+
+    def __init__(self):
+        self._jobject = _JournalObject('original')
+        self._updating_jobject = False
+        self._save_queued = False
+        self._copy_queued = False
+        self._quit_requested = False
+        self._closing = False
+        self.writes = []
+
+    def _save(self, wait):
+        if self._updating_jobject:
+            self._save_queued = True
+            return
+        self._updating_jobject = True
+        self.writes.append(self._jobject.object_id)
+
+    def save(self):
+        self._save(wait=False)
+
+
+class TestActivity(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._root, 'instance'))
+        os.environ['SUGAR_ACTIVITY_ROOT'] = self._root
+
+    def tearDown(self):
+        del os.environ['SUGAR_ACTIVITY_ROOT']
+        shutil.rmtree(self._root)
+
+    def test_clean_save_then_dirty_save(self):
+        activity = _DocumentActivity()
+        document_path = os.path.join(self._root, 'instance',
+                                     'document-activity-id')
+
+        activity._update_jobject_file(True)
+        self.assertEqual(activity._jobject.get_file_path(fetch=False),
+                         document_path)
+        self.assertFalse(activity._transfer_file)
+
+        # a clean save sends no file, the entry keeps the one it has
+        activity._update_jobject_file(False)
+        self.assertIsNone(activity._jobject.get_file_path(fetch=False))
+        self.assertTrue(os.path.isfile(document_path))
+
+        # the next dirty save updates the same document and sends it
+        activity.content = 'second'
+        activity._update_jobject_file(True)
+        self.assertEqual(activity.updates, 1)
+        self.assertEqual(activity._jobject.get_file_path(fetch=False),
+                         document_path)
+        self.assertFalse(activity._transfer_file)
+        with open(document_path) as f:
+            self.assertEqual(f.read(), 'second')
+
+        activity._jobject.destroy()
+        self.assertTrue(os.path.isfile(document_path))
+
+    def test_copy_while_saving(self):
+        activity = _CopyingActivity()
+
+        # the preview of a save is still being encoded
+        activity.save()
+        activity.writes = []
+        activity.copy()
+        self.assertEqual(activity._jobject.object_id, 'original')
+
+        activity.save_cb()
+        self.assertEqual(activity.writes, ['original'])
+        self.assertIsNone(activity._jobject.object_id)
+
+        activity.save_cb()
+        activity.save()
+        self.assertEqual(activity.writes, ['original', None])
@@ -15,17 +15,27 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import os
+import stat
+import shutil
 import unittest
 import subprocess
+import tempfile
+import zipfile
 
 from sugar3.bundle.helpers import bundle_from_dir, bundle_from_archive
+from sugar3.bundle import activitybundle
 from sugar3.bundle.activitybundle import ActivityBundle
+from sugar3.bundle.bundle import ZipExtractException
 from sugar3.bundle.contentbundle import ContentBundle
 
 tests_dir = os.path.dirname(__file__)
 data_dir = os.path.join(tests_dir, "data")
 SAMPLE_ACTIVITY_PATH = os.path.join(data_dir, 'sample.activity')
 SAMPLE_CONTENT_PATH = os.path.join(data_dir, 'sample.content')
+SAMPLE_ACTIVITY_FILES = ['activity.py',
+                         'setup.py',
+                         'activity/activity.info',
+                         'activity/activity-sample.svg']
 
 
 class TestBundle(unittest.TestCase):
@@ -47,3 +57,182 @@ class TestBundle(unittest.TestCase):
         subprocess.check_call(["zip", "-r", "sample-1.xol", "sample.content"])
         bundle = bundle_from_archive("./sample-1.xol")
         self.assertIsInstance(bundle, ContentBundle)
+
+    def _create_activity_archive(self, path):
+        xo_path = os.path.join(path, 'Sample-1.xo')
+        with zipfile.ZipFile(xo_path, 'w', zipfile.ZIP_DEFLATED) as xo:
+            for name in SAMPLE_ACTIVITY_FILES:
+                xo.write(os.path.join(SAMPLE_ACTIVITY_PATH, name),
+                         os.path.join('sample.activity', name))
+
+            link = zipfile.ZipInfo('sample.activity/activity/icon.svg')
+            link.external_attr = (stat.S_IFLNK | 0o777) << 16
+            xo.writestr(link, 'activity-sample.svg')
+        return xo_path
+
+    def _check_installed_activity(self, install_path):
+        for name in SAMPLE_ACTIVITY_FILES:
+            with open(os.path.join(SAMPLE_ACTIVITY_PATH, name), 'rb') as f:
+                expected = f.read()
+            with open(os.path.join(install_path, name), 'rb') as f:
+                self.assertEqual(f.read(), expected)
+
+        self.assertTrue(os.access(os.path.join(install_path, 'setup.py'),
+                                  os.X_OK))
+        self.assertEqual(
+            os.readlink(os.path.join(install_path, 'activity', 'icon.svg')),
+            'activity-sample.svg')
+
+    def test_activity_bundle_install(self):
+        temp_dir = tempfile.mkdtemp()
+        activities_path = os.path.join(temp_dir, 'Activities')
+        os.environ['SUGAR_ACTIVITIES_PATH'] = activities_path
+        os.environ['XDG_DATA_HOME'] = temp_dir
+        try:
+            bundle = ActivityBundle(self._create_activity_archive(temp_dir))
+            install_path = bundle.install()
+
+            self.assertEqual(install_path,
+                             os.path.join(activities_path, 'sample.activity'))
+            self._check_installed_activity(install_path)
+            self.assertEqual(os.listdir(activities_path), ['sample.activity'])
+        finally:
+            del os.environ['SUGAR_ACTIVITIES_PATH']
+            del os.environ['XDG_DATA_HOME']
+            shutil.rmtree(temp_dir)
+
+    def test_parallel_unzip(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            bundle = ActivityBundle(self._create_activity_archive(temp_dir))
+            install_dir = os.path.join(temp_dir, 'Activities')
+
+            bundle._unzip(install_dir, workers=4)
+            # a second installation replaces the first one
+            bundle._unzip(install_dir, workers=4)
+
+            self._check_installed_activity(
+                os.path.join(install_dir, 'sample.activity'))
+            self.assertEqual(os.listdir(install_dir), ['sample.activity'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_unzip_hostile_links(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            home_dir = os.path.join(temp_dir, 'home')
+            os.mkdir(home_dir)
+            xo_path = self._create_activity_archive(temp_dir)
+            with zipfile.ZipFile(xo_path, 'a') as xo:
+                link = zipfile.ZipInfo('sample.activity/a')
+                link.external_attr = (stat.S_IFLNK | 0o777) << 16
+                xo.writestr(link, home_dir)
+                xo.writestr('sample.activity/a/.bashrc', 'echo owned\n')
+            bundle = ActivityBundle(xo_path)
+            install_dir = os.path.join(temp_dir, 'Activities')
+
+            for workers in (1, 4):
+                self.assertRaises(ZipExtractException, bundle._unzip,
+                                  install_dir, workers)
+                self.assertEqual(os.listdir(home_dir), [])
+                self.assertEqual(os.listdir(install_dir), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_scan(self):
+        temp_dir = tempfile.mkdtemp()
+        index_path = os.path.join(temp_dir, 'activity-index.json')
+        activitybundle._bundle_index = activitybundle._BundleIndex(index_path)
+        language = os.environ.get('LANGUAGE')
+        os.environ['LANGUAGE'] = 'es'
+        try:
+            activities_path = os.path.join(temp_dir, 'Activities')
+            bundle_path = os.path.join(activities_path, 'sample.activity')
+            shutil.copytree(SAMPLE_ACTIVITY_PATH, bundle_path,
+                            ignore=shutil.ignore_patterns('dist', 'locale'))
+            linfo_dir = os.path.join(bundle_path, 'locale', 'es')
+            os.makedirs(linfo_dir)
+            with open(os.path.join(linfo_dir, 'activity.linfo'), 'w') as f:
+                f.write('[Activity]\nname = Ejemplo\n')
+
+            bundles = activitybundle.scan(activities_path)
+            self.assertEqual([bundle.get_name() for bundle in bundles],
+                             ['Ejemplo'])
+            self.assertTrue(os.path.exists(index_path))
+
+            # a new index is filled from the saved one
+            activitybundle._bundle_index = \
+                activitybundle._BundleIndex(index_path)
+            self.assertIsNotNone(
+                activitybundle._bundle_index.lookup(bundle_path))
+            bundle = bundle_from_dir(bundle_path)
+            self.assertEqual(bundle.get_name(), 'Ejemplo')
+            self.assertEqual(bundle.get_bundle_id(), 'org.sugarlabs.Sample')
+            self.assertEqual(
+                ActivityBundle(bundle_path).get_name(), 'Ejemplo')
+
+            # an upgraded bundle is read again
+            info_path = os.path.join(bundle_path, 'activity',
+                                     'activity.info')
+            with open(info_path) as f:
+                info = f.read()
+            with open(info_path, 'w') as f:
+                f.write(info.replace('activity_version = 1',
+                                     'activity_version = 2'))
+            os.utime(info_path, (0, 0))
+            bundles = activitybundle.scan(activities_path, translated=False)
+            self.assertEqual(bundles[0].get_activity_version(), '2')
+            self.assertEqual(bundles[0].get_name(), 'Sample')
+
+            # parsing for the index does not register untranslated bundles
+            activitybundle._bundle_instances.pop(bundle_path, None)
+            activitybundle._bundle_index.read(bundle_path)
+            self.assertEqual(
+                activitybundle.get_bundle_instance(bundle_path).get_name(),
+                'Ejemplo')
+
+            # removed bundles are dropped from the index
+            shutil.rmtree(bundle_path)
+            self.assertEqual(activitybundle.scan(activities_path), [])
+            activitybundle._bundle_index = \
+                activitybundle._BundleIndex(index_path)
+            self.assertIsNone(
+                activitybundle._bundle_index.lookup(bundle_path))
+            activitybundle._bundle_index._load()
+            self.assertEqual(activitybundle._bundle_index._entries, {})
+        finally:
+            if language is None:
+                del os.environ['LANGUAGE']
+            else:
+                os.environ['LANGUAGE'] = language
+            activitybundle._bundle_index = None
+            shutil.rmtree(temp_dir)
+
+    def test_zip_bundle_files(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            xo_path = self._create_activity_archive(temp_dir)
+            with zipfile.ZipFile(xo_path, 'a') as xo:
+                xo.writestr('sample.activity/data/stored.bin',
+                            b'x' * 4096 + b'\nend\n', zipfile.ZIP_STORED)
+            bundle = ActivityBundle(xo_path)
+
+            self.assertTrue(bundle.is_dir('activity'))
+            self.assertTrue(bundle.is_dir('data/'))
+            self.assertFalse(bundle.is_dir('activity/activity.info'))
+            self.assertTrue(bundle.is_file('activity/activity.info'))
+            self.assertFalse(bundle.is_file('activity'))
+            self.assertIsNone(bundle.get_file('missing'))
+
+            with open(os.path.join(SAMPLE_ACTIVITY_PATH, 'setup.py'),
+                      'rb') as f:
+                self.assertEqual(bundle.get_file('setup.py').read(),
+                                 f.read())
+
+            stored = bundle.get_file('data/stored.bin')
+            self.assertEqual(len(stored.readline()), 4097)
+            self.assertEqual(stored.read(), b'end\n')
+            stored.seek(0)
+            self.assertEqual(len(stored.read()), 4101)
+        finally:
+            shutil.rmtree(temp_dir)
@@ -15,6 +15,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import os
+import gettext
 import unittest
 import shutil
 import subprocess
@@ -92,6 +93,35 @@ class TestGit(unittest.TestCase):
 
         os.chdir(cwd)
 
+    def _test_dist_xo_incremental(self, source_path, build_path):
+        cwd = os.getcwd()
+        os.chdir(build_path)
+
+        setup_path = os.path.join(source_path, "setup.py")
+        xo_path = os.path.join(build_path, "dist", "Sample-1.xo")
+        cache_path = os.path.join(build_path, "dist", ".xo-cache")
+
+        subprocess.call([setup_path, "dist_xo"])
+        first_infos = zipfile.ZipFile(xo_path).infolist()
+        cached = sorted(os.listdir(cache_path))
+
+        subprocess.call([setup_path, "dist_xo", "--jobs", "1"])
+        bundle_zip = zipfile.ZipFile(xo_path)
+        self.assertIsNone(bundle_zip.testzip())
+        self.assertEqual(sorted(os.listdir(cache_path)), cached)
+
+        second_infos = bundle_zip.infolist()
+        self.assertEqual([(info.filename, info.CRC) for info in first_infos],
+                         [(info.filename, info.CRC) for info in second_infos])
+
+        for info in second_infos:
+            if info.filename.endswith(".svg"):
+                self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+            if info.filename.endswith("setup.py"):
+                self.assertTrue(info.external_attr >> 16 & 0o100)
+
+        os.chdir(cwd)
+
     def _test_dist_source(self, source_path, build_path):
         cwd = os.getcwd()
         os.chdir(build_path)
@@ -125,6 +155,33 @@ class TestGit(unittest.TestCase):
 
         os.chdir(cwd)
 
+    def _test_build_incremental(self, source_path, build_path):
+        cwd = os.getcwd()
+        os.chdir(build_path)
+
+        setup_path = os.path.join(source_path, "setup.py")
+        subprocess.call([setup_path, "--builtin-msgfmt", "build"])
+
+        mo_path = os.path.join(build_path, self._share_locale_files[0])
+        with open(mo_path, "rb") as f:
+            translations = gettext.GNUTranslations(f)
+        self.assertEqual(translations.gettext("Sample"), "Ejemplo")
+        self.assertEqual(translations.gettext("Text string"),
+                         "Cadena de texto")
+
+        # a rewritten mo file would get the current time
+        mtime = os.path.getmtime(mo_path) + 100
+        os.utime(mo_path, (mtime, mtime))
+        subprocess.call([setup_path, "--builtin-msgfmt", "build"])
+        self.assertEqual(os.path.getmtime(mo_path), mtime)
+
+        os.unlink(os.path.join(source_path, "po", "es.po"))
+        subprocess.call([setup_path, "--builtin-msgfmt", "build"])
+        self.assertFalse(os.path.exists(os.path.join(build_path, "locale",
+                                                     "es")))
+
+        os.chdir(cwd)
+
     def _test_dev(self, source_path, build_path):
         activities_path = tempfile.mkdtemp()
 
@@ -199,6 +256,11 @@ class TestGit(unittest.TestCase):
         build_path = tempfile.mkdtemp()
         self._test_dist_xo(repo_path, build_path)
 
+    def test_dist_xo_incremental(self):
+        repo_path = self._create_repo()
+        build_path = tempfile.mkdtemp()
+        self._test_dist_xo_incremental(repo_path, build_path)
+
     def test_dist_source_in_source(self):
         repo_path = self._create_repo()
         self._test_dist_source(repo_path, repo_path)
@@ -226,6 +288,11 @@ class TestGit(unittest.TestCase):
         build_path = tempfile.mkdtemp()
         self._test_build(repo_path, build_path)
 
+    def test_build_incremental(self):
+        repo_path = self._create_repo()
+        build_path = tempfile.mkdtemp()
+        self._test_build_incremental(repo_path, build_path)
+
     def test_dev_in_source(self):
         repo_path = self._create_repo()
         self._test_dev(repo_path, repo_path)
@@ -0,0 +1,179 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sugar3.datastore import datastore
+
+
+class _DataStore(object):
+    """In-process stand-in for the D-Bus datastore service."""
+
+    def __init__(self):
+        self.entries = {}
+        self.files = {}
+        self.calls = []
+        self._next_id = 0
+        self._dir = tempfile.mkdtemp()
+
+    def get_filename(self, uid):
+        self.calls.append(('get_filename', uid))
+        file_path = os.path.join(self._dir, '%s-%d' % (uid, len(self.calls)))
+        with open(file_path, 'wb') as f:
+            f.write(self.files[uid])
+        return file_path
+
+    def connect_to_signal(self, signal, handler):
+        pass
+
+    def create(self, properties, filename, transfer_ownership):
+        self.calls.append(('create',))
+        self._next_id += 1
+        object_id = 'id%d' % self._next_id
+        self.entries[object_id] = dict(properties, uid=object_id)
+        return object_id
+
+    def update(self, uid, properties, filename, transfer_ownership):
+        self.calls.append(('update', uid))
+        self.entries[uid] = dict(properties, uid=uid)
+
+    def get_properties(self, uid, byte_arrays=False):
+        self.calls.append(('get_properties', uid))
+        return dict(self.entries[uid])
+
+    def find(self, query, properties, byte_arrays=False,
+             reply_handler=None, error_handler=None):
+        if reply_handler is not None:
+            # replies are only delivered by a main loop
+            self.calls.append(('find_async', query.get('offset')))
+            return
+        if 'offset' in query:
+            self.calls.append(('find', query['offset']))
+        else:
+            self.calls.append(('find', tuple(properties)))
+        uids = query.get('uid') or sorted(self.entries)
+        if not isinstance(uids, list):
+            uids = [uids]
+        entries = []
+        for uid in uids:
+            if uid not in self.entries:
+                continue
+            entry = self.entries[uid]
+            if properties:
+                entry = dict((key, value) for key, value in entry.items()
+                             if key in properties or key == 'uid')
+            entries.append(dict(entry))
+        total_count = len(entries)
+        offset = query.get('offset', 0)
+        entries = entries[offset:offset + query.get('limit', total_count)]
+        return entries, total_count
+
+
+class TestDataStore(unittest.TestCase):
+
+    def setUp(self):
+        self._data_store = _DataStore()
+        datastore._data_store = self._data_store
+        datastore._metadata_cache.clear()
+
+    def tearDown(self):
+        datastore._data_store = None
+        datastore._metadata_cache.clear()
+        shutil.rmtree(self._data_store._dir)
+
+    def test_get_after_write(self):
+        ds_object = datastore.create()
+        ds_object.metadata['title'] = 'First'
+        datastore.write(ds_object)
+        object_id = ds_object.object_id
+
+        first = datastore.get(object_id)
+        self.assertEqual(first.metadata['title'], 'First')
+
+        ds_object.metadata['title'] = 'Second'
+        datastore.write(ds_object)
+        # no main loop runs, the Updated signal is never received
+        second = datastore.get(object_id)
+        self.assertEqual(second.metadata['title'], 'Second')
+
+        for obj in (ds_object, first, second):
+            obj.destroy()
+
+    def test_find_listing(self):
+        self._data_store.entries['a'] = {'uid': 'a', 'title': 'A',
+                                         'preview': b'PNG', 'custom': 'x'}
+
+        # without a properties list every property is fetched
+        ds_objects, count = datastore.find({})
+        self.assertEqual(ds_objects[0].metadata['custom'], 'x')
+        self.assertEqual(ds_objects[0].metadata['preview'], b'PNG')
+        self.assertEqual(self._data_store.calls, [('find', ())])
+        ds_objects[0].destroy()
+
+        self._data_store.calls = []
+        ds_objects, count = datastore.find(
+            {}, properties=datastore.LISTED_PROPERTIES)
+        metadata = ds_objects[0].metadata
+        self.assertEqual(metadata['title'], 'A')
+        self.assertEqual(len(self._data_store.calls), 1)
+        # the other properties are fetched with the whole entry
+        self.assertEqual(metadata['custom'], 'x')
+        self.assertEqual(metadata['preview'], b'PNG')
+        self.assertEqual(self._data_store.calls[1:],
+                         [('get_properties', 'a')])
+        ds_objects[0].destroy()
+
+    def test_iter_find_without_main_loop(self):
+        for i in range(25):
+            object_id = 'id%02d' % i
+            self._data_store.entries[object_id] = {'uid': object_id}
+
+        object_ids = []
+        for ds_object in datastore.iter_find({}, page_size=10):
+            object_ids.append(ds_object.object_id)
+            ds_object.destroy()
+
+        self.assertEqual(object_ids, sorted(self._data_store.entries))
+        # no page is requested in advance, and so none twice
+        self.assertEqual(self._data_store.calls,
+                         [('find', 0), ('find', 10), ('find', 20)])
+
+    def test_shared_file_path(self):
+        self._data_store.entries['a'] = {'uid': 'a', 'mtime': '1'}
+        self._data_store.files['a'] = b'content'
+
+        ds_objects = [datastore.get('a') for i in range(2)]
+        paths = [ds_object.get_file_path(shared=True)
+                 for ds_object in ds_objects]
+
+        # both are links to the single copy retrieved from the datastore
+        self.assertEqual(len([call for call in self._data_store.calls
+                              if call[0] == 'get_filename']), 1)
+        self.assertNotEqual(paths[0], paths[1])
+        for path in paths:
+            self.assertNotEqual(os.path.dirname(path), self._data_store._dir)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o444)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'content')
+
+        for ds_object in ds_objects:
+            ds_object.destroy()
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+        datastore._forget_cached_files('a')
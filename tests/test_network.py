@@ -0,0 +1,276 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+
+from six.moves import urllib
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from gi.repository import GLib
+
+from sugar3 import network
+
+_TIMEOUT = 10
+
+# distinct lines, so that any misplaced byte range differs
+_CONTENT = b''.join(b'%07d\n' % i for i in range(40000))
+
+
+class TestParseRange(unittest.TestCase):
+
+    def test_open_ended(self):
+        self.assertEqual(network._parse_range('bytes=100-', 1000),
+                         (100, 1000))
+
+    def test_bounded(self):
+        self.assertEqual(network._parse_range('bytes=100-199', 1000),
+                         (100, 200))
+        # a last byte past the end is clamped to the size
+        self.assertEqual(network._parse_range('bytes=900-5000', 1000),
+                         (900, 1000))
+
+    def test_suffix(self):
+        self.assertEqual(network._parse_range('bytes=-100', 1000),
+                         (900, 1000))
+        self.assertEqual(network._parse_range('bytes=-5000', 1000),
+                         (0, 1000))
+
+    def test_whole_file(self):
+        # several ranges and other units may be answered with the file
+        self.assertIsNone(network._parse_range('bytes=0-9,20-29', 1000))
+        self.assertIsNone(network._parse_range('items=0-9', 1000))
+        self.assertIsNone(network._parse_range('bytes=-', 1000))
+        self.assertIsNone(network._parse_range('bytes=a-b', 1000))
+
+    def test_unsatisfiable(self):
+        self.assertRaises(ValueError, network._parse_range,
+                          'bytes=1000-', 1000)
+        self.assertRaises(ValueError, network._parse_range,
+                          'bytes=200-100', 1000)
+        self.assertRaises(ValueError, network._parse_range,
+                          'bytes=-0', 1000)
+
+
+class TestChunkedGlibHTTPRequestHandler(unittest.TestCase):
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._dir = tempfile.mkdtemp()
+        with open(os.path.join(self._dir, 'shared.txt'), 'wb') as f:
+            f.write(_CONTENT)
+        # files are served from the current directory
+        os.chdir(self._dir)
+        self._server = network.GlibTCPServer(
+            ('127.0.0.1', 0), network.ChunkedGlibHTTPRequestHandler)
+
+    def tearDown(self):
+        self._server.server_close()
+        os.chdir(self._cwd)
+        shutil.rmtree(self._dir)
+
+    def _get(self, headers):
+        url = 'http://127.0.0.1:%d/shared.txt' % \
+            self._server.server_address[1]
+        request = urllib.request.Request(url, headers=headers)
+        result = {}
+        loop = GLib.MainLoop()
+
+        def get():
+            try:
+                response = urllib.request.urlopen(request, timeout=_TIMEOUT)
+                result['status'] = response.getcode()
+                result['headers'] = response.headers
+                result['body'] = response.read()
+            except urllib.error.HTTPError as e:
+                result['status'] = e.code
+                result['headers'] = e.headers
+            finally:
+                GLib.idle_add(loop.quit)
+
+        thread = threading.Thread(target=get)
+        thread.start()
+        timeout_id = GLib.timeout_add_seconds(_TIMEOUT, loop.quit)
+        loop.run()
+        GLib.source_remove(timeout_id)
+        thread.join()
+        return result
+
+    def test_get(self):
+        result = self._get({})
+        self.assertEqual(result['status'], 200)
+        self.assertEqual(result['body'], _CONTENT)
+
+    def test_get_range(self):
+        result = self._get({'Range': 'bytes=1000-'})
+        self.assertEqual(result['status'], 206)
+        self.assertEqual(result['headers']['Content-Range'],
+                         'bytes 1000-%d/%d' % (len(_CONTENT) - 1,
+                                               len(_CONTENT)))
+        self.assertEqual(result['body'], _CONTENT[1000:])
+
+    def test_get_range_without_sendfile(self):
+        handler_class = network.ChunkedGlibHTTPRequestHandler
+        use_sendfile = handler_class._use_sendfile
+        handler_class._use_sendfile = False
+        try:
+            result = self._get({'Range': 'bytes=-1000'})
+        finally:
+            handler_class._use_sendfile = use_sendfile
+        self.assertEqual(result['status'], 206)
+        self.assertEqual(result['body'], _CONTENT[-1000:])
+
+    def test_get_unsatisfiable_range(self):
+        result = self._get({'Range': 'bytes=%d-' % len(_CONTENT)})
+        self.assertEqual(result['status'], 416)
+        self.assertEqual(result['headers']['Content-Range'],
+                         'bytes */%d' % len(_CONTENT))
+
+
+class _FileServer(socketserver.TCPServer):
+    """Serve _CONTENT in a thread, with single open-ended ranges."""
+
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0),
+                                        _FileRequestHandler)
+        self.ranges = []
+        # number of bytes sent before closing the next response
+        self.truncate = None
+
+
+class _FileRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        byte_range = self.headers.get('Range')
+        self.server.ranges.append(byte_range)
+        start = 0
+        if byte_range:
+            start = int(byte_range[len('bytes='):-len('-')])
+
+        body = _CONTENT[start:]
+        if byte_range:
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, len(_CONTENT) - 1, len(_CONTENT)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Disposition',
+                         'attachment; filename="content.txt"')
+        self.end_headers()
+
+        if self.server.truncate is not None:
+            body = body[:self.server.truncate]
+            self.server.truncate = None
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestGlibURLDownloader(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._server = _FileServer()
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+        self._url = 'http://127.0.0.1:%d/content.txt' % \
+            self._server.server_address[1]
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        shutil.rmtree(self._dir)
+
+    def _download(self, downloader, **kwargs):
+        result = {'progress': []}
+        loop = GLib.MainLoop()
+
+        def progress_cb(downloader, written):
+            result['progress'].append(written)
+
+        def finished_cb(downloader, file_name, suggested_name):
+            result['finished'] = (file_name, suggested_name)
+            loop.quit()
+
+        def error_cb(downloader, error):
+            result['error'] = error
+            loop.quit()
+
+        downloader.connect('progress', progress_cb)
+        downloader.connect('finished', finished_cb)
+        downloader.connect('error', error_cb)
+        downloader.start(**kwargs)
+        timeout_id = GLib.timeout_add_seconds(_TIMEOUT, loop.quit)
+        loop.run()
+        GLib.source_remove(timeout_id)
+        return result
+
+    def test_download(self):
+        downloader = network.GlibURLDownloader(self._url, self._dir)
+        result = self._download(downloader)
+
+        self.assertNotIn('error', result)
+        file_name, suggested_name = result['finished']
+        self.assertEqual(os.path.dirname(file_name), self._dir)
+        self.assertEqual(suggested_name, 'content.txt')
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), _CONTENT)
+        # the last progress is reported before finished
+        self.assertEqual(result['progress'][-1], len(_CONTENT))
+        self.assertEqual(result['progress'], sorted(result['progress']))
+
+    def test_resume_after_truncation(self):
+        dest_path = os.path.join(self._dir, 'content.txt')
+        self._server.truncate = 1000
+        downloader = network.GlibURLDownloader(self._url)
+        result = self._download(downloader, destfile=dest_path,
+                                resume=True)
+
+        # the connection closed early, what was received is kept
+        self.assertIn('error', result)
+        self.assertNotIn('finished', result)
+        self.assertEqual(os.path.getsize(dest_path), 1000)
+
+        checksum = ('sha1', hashlib.sha1(_CONTENT).hexdigest())
+        downloader = network.GlibURLDownloader(self._url)
+        result = self._download(downloader, destfile=dest_path,
+                                resume=True, checksum=checksum)
+
+        self.assertNotIn('error', result)
+        self.assertEqual(result['finished'][0], dest_path)
+        self.assertEqual(self._server.ranges, [None, 'bytes=1000-'])
+        with open(dest_path, 'rb') as f:
+            self.assertEqual(f.read(), _CONTENT)
+
+    def test_checksum_mismatch(self):
+        dest_path = os.path.join(self._dir, 'content.txt')
+        downloader = network.GlibURLDownloader(self._url)
+        result = self._download(downloader, destfile=dest_path,
+                                checksum=('sha1', '0' * 40))
+
+        self.assertEqual(result['error'],
+                         'Checksum mismatch of downloaded file.')
+        self.assertNotIn('finished', result)
+        self.assertFalse(os.path.exists(dest_path))
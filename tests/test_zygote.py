@@ -0,0 +1,132 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+
+from sugar3.activity import zygote
+
+_TIMEOUT = 10
+
+
+class _EchoZygote(zygote.Zygote):
+    """Zygote whose children print their environment instead of running
+    an activity."""
+
+    def _run_command(self):
+        output = '%s %s %s' % (sys.argv[0], os.environ['GREETING'],
+                               os.getcwd())
+        os.write(1, output.encode('utf-8'))
+        sys.exit(int(sys.argv[1]))
+
+
+@unittest.skipUnless(hasattr(socket, 'CMSG_LEN'), 'fd passing unsupported')
+class TestZygote(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = os.path.realpath(tempfile.mkdtemp())
+        self._socket_path = os.path.join(self._dir, 'zygote')
+        self._zygote = _EchoZygote(self._socket_path)
+
+    def tearDown(self):
+        self._zygote._socket.close()
+        os.close(self._zygote._wakeup_read)
+        os.close(self._zygote._wakeup_write)
+        shutil.rmtree(self._dir)
+
+    def test_message(self):
+        sock, peer = socket.socketpair()
+        read_fd, write_fd = os.pipe()
+        try:
+            message = {'command': ['sugar-activity3'], 'text': u'é' * 5}
+            zygote._send_message(sock, message, [write_fd])
+            os.close(write_fd)
+
+            received, fds = zygote._recv_message(peer, 1)
+            self.assertEqual(received, message)
+            self.assertEqual(len(fds), 1)
+            os.write(fds[0], b'through the pipe')
+            os.close(fds[0])
+            self.assertEqual(os.read(read_fd, 100), b'through the pipe')
+
+            zygote._send_message(sock, {'pid': 42})
+            self.assertEqual(zygote._recv_message(peer), ({'pid': 42}, []))
+
+            sock.close()
+            self.assertRaises(EOFError, zygote._recv_message, peer)
+        finally:
+            sock.close()
+            peer.close()
+            os.close(read_fd)
+
+    def test_socket_permissions(self):
+        self.assertEqual(os.stat(self._socket_path).st_mode & 0o777, 0o600)
+
+    def _send_request(self, stdout):
+        with open(os.devnull, 'r') as stdin:
+            return zygote.send_launch_request(
+                self._socket_path, ['sugar-activity3', '3'],
+                {'GREETING': 'hello'}, self._dir, stdin.fileno(), stdout,
+                stdout)
+
+    def test_launch(self):
+        read_fd, write_fd = os.pipe()
+        sock = self._send_request(write_fd)
+        os.close(write_fd)
+
+        self._zygote._accept()
+        pid = zygote.read_launch_reply(sock)
+        self.assertIn(pid, self._zygote._children)
+
+        deadline = time.time() + _TIMEOUT
+        while pid in self._zygote._children and time.time() < deadline:
+            time.sleep(0.01)
+            self._zygote._reap_children()
+
+        status = zygote.read_exit_status(sock)
+        self.assertTrue(os.WIFEXITED(status))
+        self.assertEqual(os.WEXITSTATUS(status), 3)
+        with os.fdopen(read_fd, 'rb') as output:
+            self.assertEqual(output.read().decode('utf-8'),
+                             'sugar-activity3 hello %s' % self._dir)
+
+    @unittest.skipUnless(hasattr(socket, 'SO_PEERCRED'),
+                         'credentials unsupported')
+    def test_launch_other_user(self):
+        read_fd, write_fd = os.pipe()
+        sock = self._send_request(write_fd)
+        os.close(write_fd)
+
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            self._zygote._accept()
+        finally:
+            os.getuid = getuid
+
+        self.assertEqual(self._zygote._children, {})
+        # closed with the request unread, the client may get a reset
+        self.assertRaises((EOFError, socket.error), zygote.read_launch_reply,
+                          sock)
+        sock.close()
+        # the descriptors sent with the request are closed
+        with os.fdopen(read_fd, 'rb') as output:
+            self.assertEqual(output.read(), b'')